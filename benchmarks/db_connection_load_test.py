@@ -0,0 +1,56 @@
+"""Load test for database connection handling on a database bound endpoint.
+
+Fires concurrent authenticated requests at GET /api/borrowings/, which only
+talks to PostgreSQL, so the numbers show the cost of opening a connection per
+request against persistent connections or the psycopg pool. Start the app
+once per setting and compare, for example:
+
+    DB_CONN_MAX_AGE=0 gunicorn library_service.wsgi:application -c /dev/null -w 4
+    DB_CONN_MAX_AGE=60 gunicorn library_service.wsgi:application -c /dev/null -w 4
+    DB_POOL=true gunicorn library_service.asgi:application -c gunicorn.conf.py
+
+and then, with the same database settings as the app:
+
+    python benchmarks/db_connection_load_test.py --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+
+from payment_load_test import prepare_payment, run_load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/api/borrowings/")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    options = parser.parse_args()
+
+    token = prepare_payment()
+    result = asyncio.run(
+        run_load(
+            options.url,
+            token,
+            options.requests,
+            options.concurrency,
+            path=options.path,
+            params={},
+        )
+    )
+
+    print(
+        f"{options.requests} requests to {options.path}, "
+        f"concurrency {options.concurrency}"
+    )
+    print(
+        f"throughput {result['throughput']:.1f} req/s, "
+        f"median {result['median'] * 1000:.1f} ms, "
+        f"p95 {result['p95'] * 1000:.1f} ms, "
+        f"statuses {result['statuses']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+"""Benchmark of the full borrow/pay/return lifecycle across the API.
+
+Seeds benchmark books and users, starts local Stripe and Telegram stubs and
+runs one virtual user per seeded user for --duration seconds. Every virtual
+user picks scenarios from the chosen mix: browsing and searching books,
+borrowing and paying for a book through the success callback, returning
+overdue books and paying the fine through a signed Stripe webhook, renewing an expired payment session and reading their history.
+
+For each endpoint it reports throughput, p50/p95/p99 latency, errors and
+the average SQL queries per request read from the app's /metrics endpoint,
+and writes everything to a JSON file named after the current commit.
+
+Start the app against the stubs. Without a Celery worker, tasks can run in
+the request with CELERY_TASK_ALWAYS_EAGER:
+
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_stub \\
+    STRIPE_WEBHOOK_SECRET=whsec_bench \\
+    TELEGRAM_API_URL=http://127.0.0.1:12112/bot TELEGRAM_SEND_INTERVAL=0 \\
+    CELERY_TASK_ALWAYS_EAGER=true \\
+        gunicorn library_service.asgi:application -c gunicorn.conf.py
+
+Query counts need a single worker or PROMETHEUS_MULTIPROC_DIR. Then, with
+the same database settings as the app. Seeding deletes every bench-* user
+with their borrowings and payments and adds benchmark books, so it only
+runs with --yes:
+
+    python benchmarks/lifecycle.py --mix default --users 20 --duration 60 --yes
+    python benchmarks/lifecycle.py --yes --compare benchmarks/results/lifecycle-abc1234.json
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from pathlib import Path
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from stubs import StripeStubHandler, TelegramStubHandler, start_stub
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+USER_EMAIL = "bench-{}@library.test"
+BOOK_TITLE = "Benchmark book {}"
+SEARCH_WORDS = ("benchmark", "book", "tolkien", "history", "benchmark book 42")
+
+# Relative weights of the scenarios a virtual user picks from.
+MIXES = {
+    "default": {
+        "browse": 45,
+        "search": 15,
+        "history": 10,
+        "borrow": 15,
+        "return": 10,
+        "renew": 5,
+    },
+    "browse": {"browse": 70, "search": 25, "history": 5},
+    "checkout": {"browse": 10, "borrow": 45, "return": 35, "renew": 10},
+}
+
+
+def seed(
+    users: int, books: int, seed_value: int, confirmed: bool
+) -> tuple[list[dict], list[int]]:
+    """Recreate the benchmark users with their history, return their state.
+
+    Every user starts with one overdue borrowing, whose return is fined, and
+    one expired payment session that blocks borrowing until it is renewed.
+    """
+    import django
+
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.utils import timezone as django_timezone
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from book.models import Book
+    from borrowing.models import Borrowing
+    from payment.models import Payment, PaymentSummary
+
+    database = connection.settings_dict["NAME"]
+
+    if not confirmed:
+        sys.exit(
+            f"The bench-* users of the {database} database would be recreated "
+            f"and up to {books} benchmark books added. Run again with --yes."
+        )
+
+    print(f"Seeding {users} users and {books} books in the {database} database")
+    random.seed(seed_value)
+    now = django_timezone.now()
+    User = get_user_model()
+
+    User.objects.filter(email__startswith="bench-").delete()
+    existing = Book.objects.filter(title__startswith="Benchmark book").count()
+    Book.objects.bulk_create(
+        Book(
+            title=BOOK_TITLE.format(number),
+            author=f"Author {number % 97}",
+            cover=random.choice(("Hard", "Soft")),
+            inventory=10**6,
+            daily_fee=random.randint(1, 9),
+        )
+        for number in range(existing, books)
+    )
+    book_ids = list(
+        Book.objects.filter(title__startswith="Benchmark book")
+        .order_by("id")
+        .values_list("id", flat=True)[:books]
+    )
+
+    created_users = User.objects.bulk_create(
+        User(email=USER_EMAIL.format(number), password="!") for number in range(users)
+    )
+    overdue = Borrowing.objects.bulk_create(
+        Borrowing(
+            book_id=random.choice(book_ids),
+            user=user,
+            expected_return_date=now - timedelta(days=random.randint(1, 10)),
+        )
+        for user in created_users
+    )
+    expired = Borrowing.objects.bulk_create(
+        Borrowing(
+            book_id=random.choice(book_ids),
+            user=user,
+            expected_return_date=now - timedelta(days=20),
+            actual_return_date=now - timedelta(days=20),
+        )
+        for user in created_users
+    )
+    Borrowing.objects.filter(id__in=[b.id for b in overdue + expired]).update(
+        borrow_date=now - timedelta(days=30)
+    )
+    Payment.objects.bulk_create(
+        [
+            Payment(
+                borrowing=borrowing,
+                status=Payment.StatusChoices.PAID,
+                type=Payment.TypeChoices.PAYMENT,
+                session_id=f"cs_bench_paid_{borrowing.id}",
+                money_to_pay=1,
+            )
+            for borrowing in overdue
+        ]
+        + [
+            Payment(
+                borrowing=borrowing,
+                status=Payment.StatusChoices.EXPIRED,
+                type=Payment.TypeChoices.PAYMENT,
+                session_id=f"cs_bench_expired_{borrowing.id}",
+                money_to_pay=1,
+            )
+            for borrowing in expired
+        ]
+    )
+    PaymentSummary.refresh([user.id for user in created_users])
+
+    states = [
+        {
+            "token": str(AccessToken.for_user(user)),
+            "active": [],
+            "overdue": [borrowing.id],
+            "expired": True,
+        }
+        for user, borrowing in zip(created_users, overdue)
+    ]
+
+    return states, book_ids
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+
+    def add(self, endpoint: str, latency: float, status: int | None) -> None:
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status or "error"] += 1
+
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+
+
+class VirtualUser:
+    webhook_secret = "whsec_bench"
+
+    def __init__(self, client, recorder, state: dict, book_ids: list[int]):
+        self.client = client
+        self.recorder = recorder
+        self.headers = {"Authorization": f"Bearer {state['token']}"}
+        self.active = state["active"]
+        self.overdue = state["overdue"]
+        self.expired = state["expired"]
+        self.book_ids = book_ids
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+
+        try:
+            response = await self.client.request(
+                method,
+                url,
+                headers={**self.headers, **kwargs.pop("headers", {})},
+                **kwargs,
+            )
+        except httpx.HTTPError:
+            self.recorder.add(endpoint, time.perf_counter() - started, None)
+            return None
+
+        self.recorder.add(endpoint, time.perf_counter() - started, response.status_code)
+
+        return response
+
+    async def send_webhook(self, session_id: str) -> None:
+        payload = json.dumps(
+            {
+                "id": f"evt_{session_id}",
+                "object": "event",
+                "type": "checkout.session.completed",
+                "data": {
+                    "object": {
+                        "id": session_id,
+                        "object": "checkout.session",
+                        "status": "complete",
+                        "payment_status": "paid",
+                    }
+                },
+            }
+        )
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode(), f"{timestamp}.{payload}".encode(), sha256
+        ).hexdigest()
+
+        await self.request(
+            "PaymentViewSet.webhook",
+            "POST",
+            "/api/payments/webhook/",
+            content=payload,
+            headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": f"t={timestamp},v1={signature}",
+            },
+        )
+
+    async def pay(self, payment_id: int) -> None:
+        """Wait for the checkout session, then complete it.
+
+        Payments are confirmed by the success callback, fines by the webhook.
+        """
+        for _ in range(20):
+            response = await self.request(
+                "PaymentViewSet.retrieve", "GET", f"/api/payments/{payment_id}/"
+            )
+            if response is None or response.status_code != 200:
+                return
+            if response.json()["status"] == "Pending":
+                break
+            await asyncio.sleep(0.1)
+        else:
+            return
+
+        payment = response.json()
+
+        if payment["type"] == "Fine":
+            return await self.send_webhook(payment["session_id"])
+
+        await self.request(
+            "PaymentViewSet.success",
+            "GET",
+            "/api/payments/success/",
+            params={"session_id": payment["session_id"]},
+        )
+
+    async def browse(self) -> None:
+        await self.request("BookViewSet.list", "GET", "/api/books/")
+        await self.request(
+            "BookViewSet.retrieve",
+            "GET",
+            f"/api/books/{random.choice(self.book_ids)}/",
+        )
+
+    async def search(self) -> None:
+        await self.request(
+            "BookViewSet.list",
+            "GET",
+            "/api/books/",
+            params={"search": random.choice(SEARCH_WORDS)},
+        )
+
+    async def history(self) -> None:
+        await self.request(
+            "BorrowingViewSet.list",
+            "GET",
+            "/api/borrowings/",
+            params={"is_active": "true"},
+        )
+        await self.request("PaymentViewSet.list", "GET", "/api/payments/")
+
+    async def renew(self) -> None:
+        if not self.expired:
+            return await self.history()
+
+        response = await self.request(
+            "PaymentViewSet.renew_session", "GET", "/api/payments/renew/"
+        )
+        if response is not None and response.status_code == 200:
+            self.expired = False
+            await self.request(
+                "PaymentViewSet.success",
+                "GET",
+                "/api/payments/success/",
+                params={"session_id": response.json()["new session id"]},
+            )
+
+    async def borrow(self) -> None:
+        if self.expired:
+            return await self.renew()
+
+        expected_return_date = datetime.now(timezone.utc) + timedelta(days=7)
+        response = await self.request(
+            "BorrowingViewSet.create",
+            "POST",
+            "/api/borrowings/",
+            json={
+                "book": random.choice(self.book_ids),
+                "expected_return_date": expected_return_date.isoformat(),
+            },
+        )
+        if response is not None and response.status_code == 201:
+            self.active.append(response.json()["id"])
+            await self.pay(response.json()["payment"])
+
+    async def return_book(self) -> None:
+        overdue = bool(self.overdue)
+        borrowings = self.overdue if overdue else self.active
+
+        if not borrowings:
+            return await self.borrow()
+
+        borrowing_id = borrowings.pop()
+        response = await self.request(
+            "BorrowingViewSet.return_borrowing",
+            "POST",
+            f"/api/borrowings/{borrowing_id}/return/",
+        )
+        if overdue and response is not None and response.status_code == 200:
+            await self.pay(response.json()["payment"])
+
+    async def run(self, mix: dict, deadline: float) -> None:
+        scenarios = {
+            "browse": self.browse,
+            "search": self.search,
+            "history": self.history,
+            "borrow": self.borrow,
+            "return": self.return_book,
+            "renew": self.renew,
+        }
+        names = list(mix)
+        weights = [mix[name] for name in names]
+
+        while time.monotonic() < deadline:
+            await scenarios[random.choices(names, weights)[0]]()
+
+
+async def scrape_query_counts(client) -> dict:
+    """Per view (sum, count) of the http_request_db_queries histogram."""
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return {}
+
+    counts = defaultdict(lambda: [0.0, 0.0])
+
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "http_request_db_queries":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_sum"):
+                counts[sample.labels["view"]][0] = sample.value
+            if sample.name.endswith("_count"):
+                counts[sample.labels["view"]][1] = sample.value
+
+    return counts
+
+
+def percentile(values: list[float], percent: int) -> float:
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+
+    return values[index]
+
+
+async def run(url, states, book_ids, mix, duration) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=len(states))
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        queries_before = await scrape_query_counts(client)
+        started = time.perf_counter()
+        deadline = time.monotonic() + duration
+        await asyncio.gather(
+            *(
+                VirtualUser(client, recorder, state, book_ids).run(mix, deadline)
+                for state in states
+            )
+        )
+        elapsed = time.perf_counter() - started
+        queries_after = await scrape_query_counts(client)
+
+    endpoints = {}
+
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        before_sum, before_count = queries_before.get(endpoint, (0.0, 0.0))
+        after_sum, after_count = queries_after.get(endpoint, (0.0, 0.0))
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "throughput": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "errors": recorder.errors[endpoint],
+            "statuses": {
+                str(key): value for key, value in recorder.statuses[endpoint].items()
+            },
+            "db_queries_per_request": (
+                round((after_sum - before_sum) / (after_count - before_count), 2)
+                if after_count > before_count
+                else None
+            ),
+        }
+
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+
+    return {
+        "requests": total,
+        "throughput": round(total / elapsed, 2),
+        "errors": sum(recorder.errors.values()),
+        "endpoints": endpoints,
+    }
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    print(
+        f"commit {report['commit']}, mix {report['mix']}, {report['users']} users, "
+        f"{report['requests']} requests, {report['throughput']} req/s, "
+        f"{report['errors']} errors"
+    )
+    print(
+        f"{'endpoint':36} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+        f"{'errors':>6} {'queries':>7}"
+    )
+
+    for endpoint, result in report["endpoints"].items():
+        line = (
+            f"{endpoint:36} {result['throughput']:>8} {result['p50_ms']:>8} "
+            f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['errors']:>6} "
+            f"{str(result['db_queries_per_request']):>7}"
+        )
+        previous = (baseline or {}).get("endpoints", {}).get(endpoint)
+
+        if previous:
+            line += (
+                f"  p95 {result['p95_ms'] - previous['p95_ms']:+.1f} ms, "
+                f"req/s {result['throughput'] - previous['throughput']:+.2f} "
+                f"vs {baseline['commit']}"
+            )
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mix", choices=MIXES, default="default")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--upstream-delay", type=float, default=0.1)
+    parser.add_argument("--stripe-port", type=int, default=12111)
+    parser.add_argument("--telegram-port", type=int, default=12112)
+    parser.add_argument("--webhook-secret", default=VirtualUser.webhook_secret)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="Earlier result to diff with.")
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Recreate the benchmark users and books in the configured database.",
+    )
+    options = parser.parse_args()
+    states, book_ids = seed(options.users, options.books, options.seed, options.yes)
+
+    stubs = [
+        start_stub(
+            StripeStubHandler,
+            options.stripe_port,
+            delay=options.upstream_delay,
+            payment_status="paid",
+        ),
+        start_stub(
+            TelegramStubHandler, options.telegram_port, delay=options.upstream_delay
+        ),
+    ]
+    VirtualUser.webhook_secret = options.webhook_secret
+    result = asyncio.run(
+        run(options.url, states, book_ids, MIXES[options.mix], options.duration)
+    )
+
+    for stub in stubs:
+        stub.shutdown()
+
+    report = {
+        "commit": get_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "mix": options.mix,
+        "users": options.users,
+        "duration": options.duration,
+        "upstream_delay": options.upstream_delay,
+        **result,
+    }
+    output = options.output or RESULTS_DIR / f"lifecycle-{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    baseline = json.loads(options.compare.read_text()) if options.compare else None
+    print_report(report, baseline)
+    print(f"saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Load test for the Stripe bound payment endpoints under a slow upstream.
+
+Starts a local Stripe stub that answers checkout session requests after
+--upstream-delay seconds, prepares a pending payment and fires concurrent
+requests at GET /api/payments/success/. The stub reports the session as
+unpaid, so every request does the full lookup and Stripe round trip without
+changing any data.
+
+Run the app against the stub, for example with the production ASGI profile:
+
+    STRIPE_API_BASE=http://127.0.0.1:12111 \\
+        gunicorn library_service.asgi:application -c gunicorn.conf.py
+
+or with sync workers for comparison:
+
+    STRIPE_API_BASE=http://127.0.0.1:12111 \\
+        gunicorn library_service.wsgi:application -c /dev/null -w 4
+
+and then, with the same database settings as the app:
+
+    python benchmarks/payment_load_test.py --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from stubs import StripeStubHandler, start_stub
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
+
+SESSION_ID = "cs_load_test"
+
+
+def prepare_payment() -> str:
+    """Create the load test user with one pending payment, return its token."""
+    import django
+
+    django.setup()
+
+    from datetime import timedelta
+
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from book.models import Book
+    from borrowing.models import Borrowing
+    from payment.models import Payment
+
+    user, _ = get_user_model().objects.get_or_create(email="load-test@library.test")
+    if not Payment.objects.filter(session_id=SESSION_ID).exists():
+        book = Book.objects.create(
+            title="Load test", author="Load test", inventory=1, daily_fee=1
+        )
+        borrowing = Borrowing.objects.create(
+            book=book,
+            user=user,
+            expected_return_date=timezone.now() + timedelta(days=1),
+        )
+        Payment.objects.create(
+            borrowing=borrowing,
+            status=Payment.StatusChoices.PENDING,
+            type=Payment.TypeChoices.PAYMENT,
+            session_url="https://checkout.stripe.test/pay",
+            session_id=SESSION_ID,
+            money_to_pay=1,
+        )
+
+    return str(AccessToken.for_user(user))
+
+
+async def run_load(
+    url: str,
+    token: str,
+    requests: int,
+    concurrency: int,
+    path: str = "/api/payments/success/",
+    params: dict | None = None,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        headers={"Authorization": f"Bearer {token}"},
+        limits=limits,
+        timeout=60,
+    ) as client:
+
+        async def send() -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(
+                    path,
+                    params={"session_id": SESSION_ID} if params is None else params,
+                )
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "throughput": requests / elapsed,
+        "median": statistics.median(latencies),
+        "p95": statistics.quantiles(latencies, n=20)[-1],
+        "statuses": statuses,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--upstream-delay", type=float, default=0.2)
+    parser.add_argument("--stub-port", type=int, default=12111)
+    options = parser.parse_args()
+
+    stub = start_stub(
+        StripeStubHandler, options.stub_port, delay=options.upstream_delay
+    )
+    token = prepare_payment()
+    result = asyncio.run(
+        run_load(options.url, token, options.requests, options.concurrency)
+    )
+    stub.shutdown()
+
+    print(
+        f"{options.requests} requests, concurrency {options.concurrency}, "
+        f"upstream delay {options.upstream_delay * 1000:.0f} ms"
+    )
+    print(
+        f"throughput {result['throughput']:.1f} req/s, "
+        f"median {result['median'] * 1000:.1f} ms, "
+        f"p95 {result['p95'] * 1000:.1f} ms, "
+        f"statuses {result['statuses']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
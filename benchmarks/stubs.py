@@ -0,0 +1,86 @@
+"""Local stand-ins for Stripe and Telegram used by the benchmarks.
+
+Both answer after a configurable delay, so the app pays a realistic upstream
+round trip without leaving the machine. Point the app at them with:
+
+    STRIPE_API_BASE=http://127.0.0.1:12111
+    TELEGRAM_API_URL=http://127.0.0.1:12112/bot
+"""
+
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay = 0.2
+
+    def send_json(self, data: dict) -> None:
+        time.sleep(self.delay)
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def log_message(self, *args):
+        pass
+
+
+class StripeStubHandler(StubHandler):
+    """Checkout sessions: POST creates one, GET reports payment_status."""
+
+    payment_status = "unpaid"
+
+    def do_GET(self):
+        session_id = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        paid = self.payment_status == "paid"
+        self.send_json(
+            {
+                "id": session_id,
+                "object": "checkout.session",
+                "status": "complete" if paid else "open",
+                "payment_status": self.payment_status,
+            }
+        )
+
+    def do_POST(self):
+        self.read_body()
+        self.send_json(
+            {
+                "id": f"cs_stub_{time.time_ns()}",
+                "object": "checkout.session",
+                "url": "https://checkout.stripe.test/pay",
+                "status": "open",
+                "payment_status": "unpaid",
+            }
+        )
+
+
+class TelegramStubHandler(StubHandler):
+    """Accepts every sendMessage call."""
+
+    def do_POST(self):
+        self.read_body()
+        self.send_json({"ok": True, "result": {"message_id": time.time_ns()}})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_stub(handler: type[StubHandler], port: int, **attrs) -> StubServer:
+    """Serve the handler on 127.0.0.1 in a background thread."""
+    handler = type(handler.__name__, (handler,), attrs)
+    server = StubServer(("127.0.0.1", port), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,107 @@
+import hashlib
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from threading import Lock
+
+from django.core.cache import cache
+from django.db import transaction
+
+from library_service import settings
+
+
+VERSION_KEY = "book:catalog:version"
+
+
+class LocalCache:
+    """Small in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> tuple[bool, object]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LocalCache(settings.BOOK_LOCAL_CACHE_SIZE, settings.BOOK_LOCAL_CACHE_TTL)
+cache_stats = Counter()
+
+
+def get_catalog_version() -> int:
+    found, version = local_cache.get(VERSION_KEY)
+
+    if not found:
+        # A timestamp as the first version never collides with versions used
+        # before the key was evicted from the shared cache.
+        version = cache.get_or_set(VERSION_KEY, time.time_ns(), timeout=None)
+        local_cache.set(VERSION_KEY, version)
+
+    return version
+
+
+def bump_catalog_version() -> None:
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+    cache.incr(VERSION_KEY)
+    local_cache.clear()
+
+
+def invalidate_catalog() -> None:
+    """Drop every cached book page once the current transaction commits."""
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_or_build(key: str, build: Callable[[], object]):
+    digest = hashlib.md5(key.encode()).hexdigest()
+    versioned_key = f"book:catalog:{get_catalog_version()}:{digest}"
+
+    found, value = local_cache.get(versioned_key)
+    if found:
+        cache_stats["local_hits"] += 1
+        return value
+    cache_stats["local_misses"] += 1
+
+    value = cache.get(versioned_key)
+    if value is not None:
+        cache_stats["shared_hits"] += 1
+    else:
+        cache_stats["shared_misses"] += 1
+        value = build()
+        cache.set(versioned_key, value, settings.BOOK_CACHE_TIMEOUT)
+
+    local_cache.set(versioned_key, value)
+
+    return value
+
+
+def clear_catalog_cache() -> None:
+    cache.delete(VERSION_KEY)
+    local_cache.clear()
+    cache_stats.clear()
@@ -0,0 +1,112 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from book.models import Book
+from book.search import search_books
+
+
+SYLLABLES = (
+    "ka lo mi ra to vu se na di per gan tor vel shi mon ar el dur fen "
+    "gol hal ith jor ken lum nor ost pri qua rin sol tam ul wen"
+).split()
+
+SEED_BOOKS_SQL = """
+INSERT INTO book_book (title, author, cover, inventory, daily_fee)
+SELECT
+    initcap(w.words[1] || ' ' || w.words[2] || ' ' || w.words[3]),
+    initcap(w.words[4]) || ' ' || initcap(w.words[5]),
+    CASE WHEN random() < 0.5 THEN 'Hard' ELSE 'Soft' END,
+    floor(random() * 10)::int,
+    round((0.5 + random() * 4.5)::numeric, 2)
+FROM generate_series(1, %(count)s) AS n
+CROSS JOIN LATERAL (
+    SELECT array_agg(
+        s.syllables[1 + floor(random() * cardinality(s.syllables))::int]
+        || s.syllables[1 + floor(random() * cardinality(s.syllables))::int]
+    ) AS words
+    FROM generate_series(1, 5 + n * 0) AS i,
+    (SELECT %(syllables)s::text[] AS syllables) AS s
+) AS w;
+"""
+
+QUERIES = (
+    "kalo",
+    "tordur mi",
+    "fenjor",
+    "shimon velka",
+    "gol",
+    "kalp",
+    "torduur",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed the book table up to --books rows and measure search latency. "
+        "Fails when the p95 latency is above --max-ms. Synthetic books are "
+        "only inserted with --yes, so the command can't fill a real catalog "
+        "by mistake."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--max-ms", type=float, default=10.0)
+        parser.add_argument("--seed", type=float, default=0.42)
+        parser.add_argument(
+            "--yes",
+            action="store_true",
+            help="Insert the synthetic books missing to reach --books.",
+        )
+
+    def seed_books(self, count: int, seed: float) -> None:
+        self.stdout.write(f"Seeding {count} books")
+        params = {"count": count, "syllables": list(SYLLABLES)}
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s)", [seed])
+            cursor.execute(SEED_BOOKS_SQL, params)
+            cursor.execute("ANALYZE book_book")
+
+    def handle(self, *args, **options):
+        missing = options["books"] - Book.objects.count()
+        if missing > 0:
+            if not options["yes"]:
+                raise CommandError(
+                    f"{missing} synthetic books would be added to the "
+                    f"{connection.settings_dict['NAME']} database. "
+                    "Run again with --yes to insert them."
+                )
+            self.seed_books(missing, options["seed"])
+
+        timings = []
+        for text in QUERIES:
+            query_timings = []
+
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                list(search_books(Book.objects.all(), text)[: options["page_size"]])
+                query_timings.append((time.perf_counter() - started) * 1000)
+
+            timings += query_timings
+            self.stdout.write(
+                f"{text!r}: median {statistics.median(query_timings):.2f} ms, "
+                f"max {max(query_timings):.2f} ms"
+            )
+
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        self.stdout.write(
+            f"All queries: median {statistics.median(timings):.2f} ms, "
+            f"p95 {p95:.2f} ms"
+        )
+
+        if p95 > options["max_ms"]:
+            raise CommandError(
+                f"Search p95 {p95:.2f} ms is above {options['max_ms']} ms."
+            )
+
+        self.stdout.write(self.style.SUCCESS("Search benchmark passed."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from library_service.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the OpenAPI schema served at /api/doc/ to API_SCHEMA_DIR as "
+        "YAML and JSON. Run it on every deploy, after the code is updated."
+    )
+
+    def handle(self, *args, **options):
+        for path in write_schema():
+            self.stdout.write(self.style.SUCCESS(f"Schema written to {path}."))
@@ -0,0 +1,244 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from book.management.commands.benchmark_search import SEED_BOOKS_SQL, SYLLABLES
+from book.models import Book
+from borrowing.models import FINE_MULTIPLIER, Borrowing
+from user.models import User
+
+
+SEED_USERS_SQL = """
+INSERT INTO user_user (
+    password, is_superuser, first_name, last_name, is_staff, is_active,
+    date_joined, email
+)
+SELECT
+    %(password)s, false, '', '', false, true,
+    now() - random() * make_interval(days => %(days)s),
+    'seed-' || (%(offset)s + n) || '@library.test'
+FROM generate_series(1, %(count)s) AS n;
+"""
+
+# Numbered copies of the book and user ids, so random row numbers can be
+# joined to real ids whatever gaps the tables have.
+NUMBER_ROWS_SQL = """
+DROP TABLE IF EXISTS seed_book, seed_user;
+CREATE TEMP TABLE seed_book AS
+    SELECT row_number() OVER (ORDER BY id) AS rn, id FROM book_book;
+CREATE TEMP TABLE seed_user AS
+    SELECT row_number() OVER (ORDER BY id) AS rn, id FROM user_user
+    WHERE NOT is_staff;
+CREATE UNIQUE INDEX ON seed_book (rn);
+CREATE UNIQUE INDEX ON seed_user (rn);
+"""
+
+# Popular titles and heavy readers: power() skews the random row numbers
+# towards the first rows. Old loans are all returned, a tenth of them late;
+# some recent loans are still out, many of those overdue.
+SEED_BORROWINGS_SQL = """
+INSERT INTO borrowing_borrowing (
+    borrow_date, expected_return_date, actual_return_date, book_id, user_id
+)
+SELECT
+    r.borrow_date,
+    r.borrow_date + make_interval(days => r.loan_days),
+    CASE
+        WHEN r.borrow_date > now() - interval '60 days' AND r.active < 0.3
+            THEN NULL
+        ELSE least(
+            now(),
+            r.borrow_date + make_interval(
+                days => floor(r.loan_days * (0.3 + 0.7 * r.early))::int
+                + r.late_days
+            )
+        )
+    END,
+    sb.id,
+    su.id
+FROM (
+    SELECT
+        1 + floor(%(books)s * power(random(), 3))::int AS book_rn,
+        1 + floor(%(users)s * power(random(), 2))::int AS user_rn,
+        now() - power(random(), 2) * make_interval(days => %(days)s) AS borrow_date,
+        7 + floor(random() * 24)::int AS loan_days,
+        random() AS active,
+        random() AS early,
+        CASE WHEN random() < 0.1 THEN floor(random() * 30)::int ELSE 0 END
+            AS late_days
+    FROM generate_series(1, %(count)s)
+) AS r
+JOIN seed_book AS sb ON sb.rn = r.book_rn
+JOIN seed_user AS su ON su.rn = r.user_rn;
+"""
+
+# One payment per borrowing, a fine for late returns. Recent loans leave
+# pending sessions and expired sessions behind.
+SEED_PAYMENTS_SQL = """
+INSERT INTO payment_payment (
+    status, type, borrowing_id, session_url, session_id, money_to_pay
+)
+SELECT
+    CASE
+        WHEN b.borrow_date > now() - interval '1 day' AND random() < 0.2
+            THEN 'Pending'
+        WHEN b.borrow_date > now() - interval '90 days' AND random() < 0.05
+            THEN 'Expired'
+        ELSE 'Paid'
+    END,
+    CASE WHEN late THEN 'Fine' ELSE 'Payment' END,
+    b.id,
+    'https://checkout.stripe.com/c/pay/cs_seed_' || b.id,
+    'cs_seed_' || b.id,
+    least(
+        999.99,
+        round(
+            bk.daily_fee * CASE
+                WHEN late THEN %(fine_multiplier)s * (
+                    b.actual_return_date::date - b.expected_return_date::date
+                )
+                ELSE greatest(
+                    b.expected_return_date::date - b.borrow_date::date, 1
+                )
+            END,
+            2
+        )
+    )
+FROM borrowing_borrowing AS b
+JOIN book_book AS bk ON bk.id = b.book_id
+CROSS JOIN LATERAL (
+    SELECT b.actual_return_date::date > b.expected_return_date::date AS late
+) AS l
+WHERE b.id > %(after_id)s;
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed production sized data: books, users and years of borrowings "
+        "with their payments, generated by PostgreSQL from --seed. Tables are "
+        "filled up to the requested number of rows. Rows are only inserted "
+        "with --yes, so the command can't fill a real database by mistake."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=2_000_000)
+        parser.add_argument("--users", type=int, default=200_000)
+        parser.add_argument("--borrowings", type=int, default=4_000_000)
+        parser.add_argument("--days", type=int, default=3 * 365)
+        parser.add_argument("--batch-size", type=int, default=500_000)
+        parser.add_argument("--seed", type=float, default=0.42)
+        parser.add_argument(
+            "--yes",
+            action="store_true",
+            help="Insert the synthetic rows missing to reach the requested counts.",
+        )
+
+    def execute_batches(self, label: str, sql: str, missing: int, **params) -> None:
+        batch_size = self.options["batch_size"]
+
+        for done in range(0, missing, batch_size):
+            count = min(batch_size, missing - done)
+            started = time.perf_counter()
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, {**params, "count": count})
+
+            self.stdout.write(
+                f"{label}: {done + count}/{missing} "
+                f"({count / (time.perf_counter() - started):.0f} rows/s)"
+            )
+
+    def seed_books(self, missing: int) -> None:
+        self.execute_batches(
+            "Books",
+            SEED_BOOKS_SQL,
+            missing,
+            syllables=list(SYLLABLES),
+        )
+
+    def seed_users(self, missing: int) -> None:
+        self.execute_batches(
+            "Users",
+            SEED_USERS_SQL,
+            missing,
+            password=make_password("seed-password"),
+            days=self.options["days"],
+            offset=User.objects.filter(email__startswith="seed-").count(),
+        )
+
+    def seed_borrowings(self, missing: int) -> None:
+        after_id = Borrowing.objects.order_by("-id").values_list("id", flat=True)
+        after_id = after_id.first() or 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(NUMBER_ROWS_SQL)
+            cursor.execute("SELECT count(*) FROM seed_book")
+            books = cursor.fetchone()[0]
+            cursor.execute("SELECT count(*) FROM seed_user")
+            users = cursor.fetchone()[0]
+
+        self.execute_batches(
+            "Borrowings",
+            SEED_BORROWINGS_SQL,
+            missing,
+            books=books,
+            users=users,
+            days=self.options["days"],
+        )
+
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SEED_PAYMENTS_SQL,
+                {"after_id": after_id, "fine_multiplier": FINE_MULTIPLIER},
+            )
+            self.stdout.write(
+                f"Payments: {cursor.rowcount} "
+                f"({cursor.rowcount / (time.perf_counter() - started):.0f} rows/s)"
+            )
+
+    def handle(self, *args, **options):
+        self.options = options
+        started = time.perf_counter()
+        missing_books = options["books"] - Book.objects.count()
+        missing_users = options["users"] - User.objects.filter(is_staff=False).count()
+        missing_borrowings = options["borrowings"] - Borrowing.objects.count()
+        missing = max(missing_books, missing_users, missing_borrowings)
+
+        if missing > 0 and not options["yes"]:
+            raise CommandError(
+                f"{max(missing_books, 0)} books, {max(missing_users, 0)} users and "
+                f"{max(missing_borrowings, 0)} borrowings with their payments "
+                f"would be added to the {connection.settings_dict['NAME']} "
+                "database. Run again with --yes to insert them."
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s)", [options["seed"]])
+
+        if missing_books > 0:
+            self.seed_books(missing_books)
+
+        if missing_users > 0:
+            self.seed_users(missing_users)
+
+        if missing_borrowings > 0:
+            self.seed_borrowings(missing_borrowings)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "ANALYZE book_book, user_user, borrowing_borrowing, payment_payment"
+            )
+
+        call_command("rebuild_payment_summaries", stdout=self.stdout)
+        call_command("rebuild_book_availability", stdout=self.stdout)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Library seeded in {time.perf_counter() - started:.0f} s."
+            )
+        )
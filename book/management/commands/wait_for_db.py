@@ -1,16 +1,31 @@
 import time
 from django.db import connections
+from django.db.utils import OperationalError
 from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
+    help = "Block until the default database accepts connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=0,
+            help="Give up after this many seconds (0 waits forever).",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Waiting for database")
-        connection = None
-        while not connection:
+        deadline = time.monotonic() + options["timeout"]
+        connection = connections["default"]
+        while True:
             try:
-                connection = connections["default"]
-            except CommandError:
+                connection.ensure_connection()
+                break
+            except OperationalError:
+                if options["timeout"] and time.monotonic() >= deadline:
+                    raise CommandError("Database unavailable, giving up")
                 self.stdout.write("Database unavailable, waiting 1 second")
                 time.sleep(1)
 
@@ -1,4 +1,7 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Now
 
 
 class Book(models.Model):
@@ -11,9 +14,27 @@ class Book(models.Model):
     cover = models.CharField(max_length=15, choices=CoverChoices.choices)
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=7, decimal_places=2)
+    # Maintained by the book_search_vector_trigger database trigger.
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         ordering = ("title",)
+        indexes = [
+            models.Index(fields=("title", "id"), name="book_title_id_idx"),
+            GinIndex(fields=("search_vector",), name="book_search_vector_idx"),
+            GinIndex(
+                fields=("title",),
+                opclasses=("gin_trgm_ops",),
+                name="book_title_trgm_idx",
+            ),
+            GinIndex(
+                fields=("author",),
+                opclasses=("gin_trgm_ops",),
+                name="book_author_trgm_idx",
+            ),
+            models.Index(fields=("updated_at",), name="book_updated_at_idx"),
+        ]
 
     def __str__(self):
         return f"{self.title} (author: {self.author}, daily fee: {self.daily_fee})"
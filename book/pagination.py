@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from library_service import settings
+
+
+class BookPagination(CursorPagination):
+    ordering = ("title", "id")
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    cursor_query_description = (
+        "Opaque cursor from the `next`/`previous` link of the previous page."
+    )
+    page_size_query_description = (
+        f"Number of books per page (max {settings.API_MAX_PAGE_SIZE})."
+    )
+
+
+class BookSearchPagination(PageNumberPagination):
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -0,0 +1,56 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramSimilarity,
+)
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Greatest
+
+# Must match the text search configuration of book_search_vector_trigger.
+SEARCH_CONFIG = "simple"
+
+
+def build_prefix_query(text: str) -> SearchQuery | None:
+    terms = re.findall(r"\w+", text.lower())
+
+    if not terms:
+        return None
+
+    return SearchQuery(
+        " & ".join(f"{term}:*" for term in terms),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+
+
+def search_books(queryset: QuerySet, text: str) -> QuerySet:
+    """Rank books matching ``text`` by title and author.
+
+    Full-text prefix matches come from the search_vector GIN index. Only when
+    nothing matches, trigram similarity on title and author is used to find
+    books despite typos.
+    """
+    query = build_prefix_query(text)
+
+    if query is None:
+        return queryset.none()
+
+    matches = queryset.filter(search_vector=query)
+
+    if matches.exists():
+        return matches.annotate(rank=SearchRank(F("search_vector"), query)).order_by(
+            "-rank", "id"
+        )
+
+    return (
+        queryset.annotate(
+            rank=Greatest(
+                TrigramSimilarity("title", text),
+                TrigramSimilarity("author", text),
+            )
+        )
+        .filter(Q(title__trigram_similar=text) | Q(author__trigram_similar=text))
+        .order_by("-rank", "id")
+    )
@@ -1,11 +1,24 @@
+from io import StringIO
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
+from book.cache import cache_stats, clear_catalog_cache
 from book.models import Book
+from book.pagination import BookPagination
 from book.serializers import BookSerializer
+from borrowing.models import Borrowing
+from payment.models import Payment
 
 
 BOOK_URL = reverse("book:book-list")
@@ -20,7 +33,7 @@ book_defaults = {
 
 
 def sample_book(**params) -> Book:
-    defaults = book_defaults
+    defaults = book_defaults.copy()
     defaults.update(params)
     return Book.objects.create(**defaults)
 
@@ -28,18 +41,43 @@ def sample_book(**params) -> Book:
 class UnauthenticatedBookApiTests(TestCase):
     def setUp(self):
         self.client = APIClient()
+        clear_catalog_cache()
 
     def test_unauth_book_list(self):
         sample_book()
         sample_book()
 
         res = self.client.get(BOOK_URL)
-        queryset = Book.objects.all()
+        queryset = Book.objects.order_by("title", "id")
         serializer = BookSerializer(queryset, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
-        self.assertEqual(len(res.data), 2)
+        self.assertEqual(res.data["results"], serializer.data)
+        self.assertEqual(len(res.data["results"]), 2)
+
+    def test_unauth_book_list_cursor_pagination(self):
+        for title in ("C", "A", "B", "A"):
+            sample_book(title=title)
+
+        res = self.client.get(BOOK_URL, {"page_size": 3})
+        next_res = self.client.get(res.data["next"])
+        queryset = Book.objects.order_by("title", "id")
+        serializer = BookSerializer(queryset, many=True)
+
+        self.assertIsNone(res.data["previous"])
+        self.assertEqual(res.data["results"], serializer.data[:3])
+        self.assertEqual(next_res.data["results"], serializer.data[3:])
+        self.assertIsNone(next_res.data["next"])
+
+    @patch.object(BookPagination, "max_page_size", 2)
+    def test_unauth_book_list_page_size_is_capped(self):
+        for _ in range(3):
+            sample_book()
+
+        res = self.client.get(BOOK_URL, {"page_size": 1000})
+
+        self.assertEqual(len(res.data["results"]), 2)
+        self.assertIsNotNone(res.data["next"])
 
     def test_unauth_book_detail(self):
         book = sample_book()
@@ -67,6 +105,7 @@ class UnauthenticatedBookApiTests(TestCase):
 class AuthenticatedBookTestVew(TestCase):
     def setUp(self):
         self.client = APIClient()
+        clear_catalog_cache()
         self.user = get_user_model().objects.create_user(
             email="test1@test1.com",
             password="TestUser1",
@@ -89,6 +128,7 @@ class AuthenticatedBookTestVew(TestCase):
 class AdminBookTestVew(TestCase):
     def setUp(self):
         self.client = APIClient()
+        clear_catalog_cache()
         self.user = get_user_model().objects.create_user(
             email="test1@test1.com",
             password="TestUser1",
@@ -107,3 +147,297 @@ class AdminBookTestVew(TestCase):
         res = self.client.delete(url)
 
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class BookCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            email="admin@test.com",
+            password="TestUser1",
+            is_staff=True,
+        )
+        clear_catalog_cache()
+
+    def test_book_list_is_served_from_cache(self):
+        sample_book(title="Cached")
+        self.client.get(BOOK_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(BOOK_URL)
+
+        self.assertEqual(res.data["results"][0]["title"], "Cached")
+        self.assertEqual(cache_stats["local_hits"], 1)
+        self.assertEqual(cache_stats["shared_misses"], 1)
+
+    def test_book_detail_is_served_from_cache(self):
+        book = sample_book()
+        url = reverse("book:book-detail", args=[book.id])
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+
+        self.assertEqual(res.data["id"], book.id)
+
+    def test_admin_update_invalidates_cache(self):
+        book = sample_book(title="Old title")
+        url = reverse("book:book-detail", args=[book.id])
+        self.client.get(url)
+        self.client.force_authenticate(self.admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"title": "New title"})
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.data["title"], "New title")
+
+    def test_borrowing_invalidates_cache(self):
+        book = sample_book()
+        url = reverse("book:book-detail", args=[book.id])
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Borrowing.book_borrowing(book)
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.data["inventory"], book.inventory - 1)
+
+    @patch("book.cache.local_cache.ttl", 0)
+    def test_shared_cache_is_used_when_local_entry_expires(self):
+        sample_book()
+        self.client.get(BOOK_URL)
+
+        res = self.client.get(BOOK_URL)
+
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertEqual(cache_stats["shared_hits"], 1)
+
+
+class BookConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = sample_book()
+        self.url = reverse("book:book-detail", args=[self.book.id])
+        clear_catalog_cache()
+
+    def test_book_detail_not_modified(self):
+        res = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            res2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        res3 = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=res["Last-Modified"])
+
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2["ETag"], res["ETag"])
+        self.assertEqual(res3.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_borrowing_changes_book_etag(self):
+        updated_at = self.book.updated_at
+        res = self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Borrowing.book_borrowing(self.book)
+
+        res2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+        self.book.refresh_from_db()
+
+        self.assertGreater(self.book.updated_at, updated_at)
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res2["ETag"], res["ETag"])
+        self.assertEqual(res2.data["inventory"], 9)
+
+    def test_book_list_etag_changes_with_new_book(self):
+        res = self.client.get(BOOK_URL)
+        res2 = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+        res3 = self.client.get(BOOK_URL, {"cover": "Hard"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(
+                get_user_model().objects.create_superuser(
+                    email="admin@test.com", password="TestUser1"
+                )
+            )
+            self.client.post(BOOK_URL, book_defaults)
+
+        res4 = self.client.get(BOOK_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(res3["ETag"], res["ETag"])
+        self.assertEqual(res4.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res4.data["results"]), 2)
+
+
+class BookQueryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="reader@test.com", password="TestUser1"
+        )
+        self.client.force_authenticate(self.user)
+        self.book = sample_book()
+        clear_catalog_cache()
+
+    def test_search_vector_is_not_loaded(self):
+        Borrowing.objects.create(
+            book=self.book, user=self.user, expected_return_date=timezone.now()
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(BOOK_URL)
+            self.client.get(reverse("book:book-detail", args=[self.book.id]))
+            self.client.get(reverse("borrowing:borrowing-list"))
+
+        self.assertEqual(len(queries), 3)
+        for query in queries:
+            self.assertNotIn("search_vector", query["sql"])
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        clear_catalog_cache()
+        self.harry = sample_book(
+            title="Harry Potter and the Philosopher's Stone", author="J. K. Rowling"
+        )
+        self.hobbit = sample_book(
+            title="The Hobbit", author="J. R. R. Tolkien", cover="Soft", daily_fee=3
+        )
+        self.rings = sample_book(
+            title="The Lord of the Rings", author="J. R. R. Tolkien", daily_fee=5
+        )
+
+    def search_titles(self, **params) -> list[str]:
+        res = self.client.get(BOOK_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [book["title"] for book in res.data["results"]]
+
+    def test_search_vector_is_kept_current(self):
+        Book.objects.filter(id=self.hobbit.id).update(title="There and Back Again")
+
+        self.assertEqual(
+            self.search_titles(search="there back"), ["There and Back Again"]
+        )
+
+    def test_search_by_title_prefix(self):
+        self.assertEqual(self.search_titles(search="harry pot"), [self.harry.title])
+
+    def test_search_by_author(self):
+        self.assertCountEqual(
+            self.search_titles(search="tolkien"), [self.hobbit.title, self.rings.title]
+        )
+
+    def test_search_tolerates_typos(self):
+        self.assertEqual(self.search_titles(search="The Hobit"), [self.hobbit.title])
+
+    def test_search_ranks_title_above_author_match(self):
+        sample_book(title="Biography", author="Hobbit Lover")
+
+        self.assertEqual(self.search_titles(search="hobbit")[0], self.hobbit.title)
+
+    def test_search_is_page_number_paginated(self):
+        res = self.client.get(BOOK_URL, {"search": "tolkien", "page_size": 1})
+
+        self.assertEqual(res.data["count"], 2)
+        self.assertIn("page=2", res.data["next"])
+
+    def test_filter_by_cover_and_daily_fee(self):
+        self.assertEqual(self.search_titles(cover="Soft"), [self.hobbit.title])
+        self.assertEqual(
+            self.search_titles(daily_fee_min="2.5", daily_fee_max="4"),
+            [self.hobbit.title],
+        )
+
+    def test_invalid_filters(self):
+        res = self.client.get(BOOK_URL, {"cover": "Paper", "daily_fee_min": "x"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch("book.management.commands.wait_for_db.time.sleep")
+class WaitForDbCommandTests(SimpleTestCase):
+    def test_retries_until_database_accepts_connections(self, sleep):
+        with patch(
+            "django.db.backends.base.base.BaseDatabaseWrapper.ensure_connection",
+            side_effect=[OperationalError, OperationalError, None],
+        ) as ensure_connection:
+            call_command("wait_for_db", stdout=StringIO())
+
+        self.assertEqual(ensure_connection.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_gives_up_after_timeout(self, sleep):
+        with patch(
+            "django.db.backends.base.base.BaseDatabaseWrapper.ensure_connection",
+            side_effect=OperationalError,
+        ), patch(
+            "book.management.commands.wait_for_db.time.monotonic",
+            side_effect=[0, 0.5, 2],
+        ):
+            with self.assertRaises(CommandError):
+                call_command("wait_for_db", timeout=1, stdout=StringIO())
+
+        self.assertEqual(sleep.call_count, 1)
+
+
+class BenchmarkSearchCommandTests(TestCase):
+    def test_refuses_to_seed_without_yes(self):
+        with self.assertRaisesMessage(CommandError, "--yes"):
+            call_command("benchmark_search", "--books", "10", stdout=StringIO())
+
+        self.assertFalse(Book.objects.exists())
+
+    def test_seeds_books_with_yes(self):
+        call_command(
+            "benchmark_search",
+            "--books",
+            "50",
+            "--repeat",
+            "1",
+            "--max-ms",
+            "1000",
+            "--yes",
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(Book.objects.count(), 50)
+
+
+class SeedLibraryCommandTests(TestCase):
+    def test_seeds_requested_rows_with_payments(self):
+        call_command(
+            "seed_library",
+            books=30,
+            users=5,
+            borrowings=200,
+            batch_size=80,
+            yes=True,
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(get_user_model().objects.count(), 5)
+        self.assertEqual(Borrowing.objects.count(), 200)
+        self.assertEqual(Payment.objects.count(), 200)
+        self.assertTrue(Payment.objects.filter(type=Payment.TypeChoices.FINE).exists())
+        call_command("rebuild_payment_summaries", verify=True, stdout=StringIO())
+
+    def test_fills_tables_up_to_requested_rows(self):
+        options = {"books": 10, "users": 2, "borrowings": 20, "stdout": StringIO()}
+        call_command("seed_library", yes=True, **options)
+        call_command("seed_library", **options)
+
+        self.assertEqual(Book.objects.count(), 10)
+        self.assertEqual(Borrowing.objects.count(), 20)
+
+    def test_refuses_to_seed_without_yes(self):
+        with self.assertRaisesMessage(CommandError, "10 books, 2 users and 20"):
+            call_command(
+                "seed_library", books=10, users=2, borrowings=20, stdout=StringIO()
+            )
+
+        self.assertFalse(Book.objects.exists())
@@ -1,11 +1,206 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.shortcuts import get_object_or_404
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
+from book.cache import get_or_build, invalidate_catalog
 from book.models import Book
+from book.pagination import BookPagination, BookSearchPagination
 from book.permissions import IsAdminOrReadOnly
+from book.search import search_books
 from book.serializers import BookSerializer
+from borrowing.models import BookAvailability
+from borrowing.serializers import BookAvailabilitySerializer
+from library_service.conditional import (
+    conditional_response,
+    get_page_version,
+    get_version,
+)
 
 
 class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+    # The search vector is only used for filtering, never serialized.
+    queryset = Book.objects.defer("search_vector")
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrReadOnly,)
+    pagination_class = BookPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.request and self.request.query_params.get("search"):
+                self._paginator = BookSearchPagination()
+            else:
+                self._paginator = self.pagination_class()
+
+        return self._paginator
+
+    @staticmethod
+    def _params_to_decimal(name: str, value: str) -> Decimal:
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: "A valid number is required."})
+
+    def get_queryset(self):
+        queryset = self.queryset
+
+        if self.action != "list":
+            return queryset
+
+        search = self.request.query_params.get("search")
+        cover = self.request.query_params.get("cover")
+        daily_fee_min = self.request.query_params.get("daily_fee_min")
+        daily_fee_max = self.request.query_params.get("daily_fee_max")
+
+        if cover:
+            if cover not in Book.CoverChoices.values:
+                raise ValidationError(
+                    {"cover": f"Choose one of: {', '.join(Book.CoverChoices.values)}."}
+                )
+            queryset = queryset.filter(cover=cover)
+
+        if daily_fee_min:
+            queryset = queryset.filter(
+                daily_fee__gte=self._params_to_decimal("daily_fee_min", daily_fee_min)
+            )
+
+        if daily_fee_max:
+            queryset = queryset.filter(
+                daily_fee__lte=self._params_to_decimal("daily_fee_max", daily_fee_max)
+            )
+
+        if search:
+            queryset = search_books(queryset, search)
+
+        return queryset
+
+    def _build_page(self) -> tuple[dict, str]:
+        """Serialized page with its version, cached together so the ETag of
+        a cached page never runs ahead of its content."""
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+
+        return (
+            self.get_paginated_response(serializer.data).data,
+            get_page_version(self.paginator, page, "updated_at"),
+        )
+
+    def _build_book(self) -> tuple[dict, str, datetime]:
+        book = self.get_object()
+
+        return (
+            self.get_serializer(book).data,
+            get_version([book], "updated_at"),
+            book.updated_at,
+        )
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidate_catalog()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate_catalog()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidate_catalog()
+
+    @extend_schema(
+        description="List of books ordered by title. "
+        "Results are cursor paginated: follow the `next`/`previous` links "
+        "and use `page_size` to change the number of books per page. "
+        "With `search` the books are ordered by relevance "
+        "and paginated with the `page` parameter instead.",
+        parameters=[
+            OpenApiParameter(
+                name="search",
+                type=OpenApiTypes.STR,
+                description="Search by title and author prefixes, "
+                "tolerant to typos (ex. ?search=harry pot).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="cover",
+                type=OpenApiTypes.STR,
+                enum=Book.CoverChoices.values,
+                description="Filter by cover (ex. ?cover=Hard).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="daily_fee_min",
+                type=OpenApiTypes.DECIMAL,
+                description="Minimal daily fee (ex. ?daily_fee_min=0.5).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="daily_fee_max",
+                type=OpenApiTypes.DECIMAL,
+                description="Maximal daily fee (ex. ?daily_fee_max=2).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="page",
+                type=OpenApiTypes.INT,
+                description="Page number of search results. Used with `search` only.",
+                required=False,
+            ),
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        data, version = get_or_build(
+            f"page:{request.build_absolute_uri()}", self._build_page
+        )
+
+        return conditional_response(request, version, lambda: Response(data))
+
+    def retrieve(self, request, *args, **kwargs):
+        data, version, updated_at = get_or_build(
+            f"book:{kwargs['pk']}", self._build_book
+        )
+
+        return conditional_response(
+            request, version, lambda: Response(data), last_modified=updated_at
+        )
+
+    @extend_schema(
+        description="Availability forecast of a book: copies on the shelf, "
+        "waiting holds, expected returns of borrowed copies by date and the "
+        "date a new hold is expected to get a copy. Put a hold on the book "
+        "with `/api/borrowings/holds/` to be notified instead of polling.",
+        responses=BookAvailabilitySerializer,
+    )
+    @action(detail=True, methods=["GET"], url_path="availability")
+    def availability(self, request, pk=None):
+        book = get_object_or_404(
+            Book.objects.select_related("availability").only(
+                "id",
+                "inventory",
+                "availability__waiting_holds",
+                "availability__upcoming_returns",
+            ),
+            pk=pk,
+        )
+        availability = getattr(book, "availability", None) or BookAvailability()
+        serializer = BookAvailabilitySerializer(
+            {
+                "book": book.id,
+                "inventory": book.inventory,
+                "waiting_holds": availability.waiting_holds,
+                "upcoming_returns": availability.upcoming_returns,
+                "estimated_available_date": BookAvailability.estimate_available_date(
+                    book.inventory,
+                    availability.waiting_holds,
+                    availability.upcoming_returns,
+                ),
+            }
+        )
+
+        return Response(serializer.data)
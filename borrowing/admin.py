@@ -1,4 +1,7 @@
 from django.contrib import admin
-from borrowing.models import Borrowing
+from borrowing.models import BookAvailability, BookHold, Borrowing, Notification
 
 admin.site.register(Borrowing)
+admin.site.register(Notification)
+admin.site.register(BookHold)
+admin.site.register(BookAvailability)
@@ -1,19 +1,41 @@
+import time
 from datetime import datetime
 
+from django.db import connection
+
 from borrowing.models import Borrowing
-from borrowing.telegram_notifications import send_message
+from borrowing.telegram_notifications import enqueue_messages
+from library_service.query_counter import QueryCounter
+
+
+OVERDUE_CHUNK_SIZE = 2000
 
 
-def check_borrowings_overdue() -> None | str:
+def check_borrowings_overdue() -> dict:
+    started = time.perf_counter()
     today = datetime.today().date()
-    borrowings_overdue = Borrowing.objects.filter(
-        expected_return_date__lte=today,
-        actual_return_date__isnull=True,
-    )
+    messages = []
+    count = 0
+
+    with connection.execute_wrapper(query_counter := QueryCounter()):
+        borrowings_overdue = (
+            Borrowing.objects.filter(
+                expected_return_date__lte=today,
+                actual_return_date__isnull=True,
+            )
+            .select_related("book", "user")
+            .only(
+                "id",
+                "borrow_date",
+                "expected_return_date",
+                "book__title",
+                "user__email",
+            )
+            .iterator(chunk_size=OVERDUE_CHUNK_SIZE)
+        )
 
-    if borrowings_overdue:
         for borrowing in borrowings_overdue:
-            message = (
+            messages.append(
                 f"Borrowing overdue:\n"
                 f"borrowing id: {borrowing.id}\n"
                 f"book: {borrowing.book.title}\n"
@@ -21,14 +43,22 @@ def check_borrowings_overdue() -> None | str:
                 f"borrow_date: {borrowing.borrow_date}\n"
                 f"expected_return_date: {borrowing.expected_return_date}"
             )
+            count += 1
 
-            send_message(message)
+            # Enqueued per chunk, so memory does not grow with the overdue count.
+            if len(messages) == OVERDUE_CHUNK_SIZE:
+                enqueue_messages(messages)
+                messages = []
 
-        message = f"{len(borrowings_overdue)} total borrowings overdue today."
-        send_message(message)
+        if count:
+            messages.append(f"{count} total borrowings overdue today.")
+        else:
+            messages.append("No borrowings overdue today!")
 
-    else:
-        message = "No borrowings overdue today!"
-        send_message(message)
+        enqueue_messages(messages)
 
-    return message
+    return {
+        "count": count,
+        "duration": round(time.perf_counter() - started, 3),
+        "queries": query_counter.count,
+    }
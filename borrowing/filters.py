@@ -0,0 +1,38 @@
+from django.db.models import QuerySet
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+
+BORROWING_FILTER_PARAMETERS = [
+    OpenApiParameter(
+        name="user_id",
+        type=OpenApiTypes.STR,
+        description="Filter by user ID (ex. ?user_id=10). For admin only.",
+        required=False,
+    ),
+    OpenApiParameter(
+        name="is_active",
+        type=OpenApiTypes.STR,
+        description="Filter by active/returned borrowing status."
+        "(ex. ?is_active=true for active "
+        "and ?is_active=false for returned borrowings)",
+        required=False,
+    ),
+]
+
+
+def filter_borrowings(
+    queryset: QuerySet, is_active: str | None, user_id: str | None, prefix: str = ""
+) -> QuerySet:
+    """Filter by active/returned status and by user, as the borrowing list
+    does. `prefix` is the path to the borrowing (ex. "borrowing__")."""
+    if is_active:
+        if is_active.lower() == "true":
+            queryset = queryset.filter(**{f"{prefix}actual_return_date__isnull": True})
+        if is_active.lower() == "false":
+            queryset = queryset.filter(**{f"{prefix}actual_return_date__isnull": False})
+
+    if user_id:
+        queryset = queryset.filter(**{f"{prefix}user__id": user_id})
+
+    return queryset
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from borrowing.models import BookAvailability
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-book availability forecasts from the borrowing and "
+        "hold tables. With --verify only report forecasts that differ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def get_mismatches(self) -> list[int]:
+        computed = BookAvailability.compute()
+        stored = {
+            row.book_id: (row.waiting_holds, row.upcoming_returns)
+            for row in BookAvailability.objects.all()
+        }
+
+        return sorted(
+            book_id
+            for book_id in set(computed) | set(stored)
+            if computed.get(book_id, (0, [])) != stored.get(book_id, (0, []))
+        )
+
+    def handle(self, *args, **options):
+        mismatches = self.get_mismatches()
+
+        if options["verify"]:
+            if mismatches:
+                raise CommandError(
+                    f"{len(mismatches)} book availability forecasts are out of "
+                    f"date, books: {mismatches[:20]}"
+                )
+
+            self.stdout.write(
+                self.style.SUCCESS("Book availability forecasts are up to date.")
+            )
+            return
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(mismatches), batch_size):
+            BookAvailability.refresh(mismatches[start : start + batch_size])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {len(mismatches)} book availability forecasts."
+            )
+        )
@@ -0,0 +1,106 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book", "0003_book_search"),
+        ("borrowing", "0008_borrowing_borrowing_active_user_idx_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookAvailability",
+            fields=[
+                (
+                    "book",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="availability",
+                        serialize=False,
+                        to="book.book",
+                    ),
+                ),
+                ("waiting_holds", models.PositiveIntegerField(default=0)),
+                ("upcoming_returns", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "book availability",
+            },
+        ),
+        migrations.CreateModel(
+            name="BookHold",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("Waiting", "Waiting"),
+                            ("Ready", "Ready"),
+                            ("Fulfilled", "Fulfilled"),
+                            ("Expired", "Expired"),
+                            ("Cancelled", "Cancelled"),
+                        ],
+                        default="Waiting",
+                        max_length=15,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("claim_expires_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holds",
+                        to="book.book",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holds",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("created_at", "id"),
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "Waiting")),
+                        fields=["book", "created_at", "id"],
+                        name="bookhold_waiting_idx",
+                    ),
+                    models.Index(
+                        condition=models.Q(("status", "Ready")),
+                        fields=["claim_expires_at"],
+                        name="bookhold_ready_expiry_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status__in", ("Waiting", "Ready"))),
+                        fields=("book", "user"),
+                        name="bookhold_active_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,8 +1,13 @@
-from datetime import datetime
+from collections import Counter
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Now, RowNumber, TruncDate
+from django.utils import timezone
 
+from book.cache import invalidate_catalog
 from book.models import Book
 from library_service import settings
 
@@ -18,17 +23,128 @@ class Borrowing(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="borrowing"
     )
+    # Set by the bulk update paths too; reports are refreshed from it.
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    # Set when the borrowing takes a copy held for the user's book hold,
+    # which is no longer counted in the book inventory.
+    from_hold = False
 
     class Meta:
         ordering = ("borrow_date",)
+        indexes = [
+            models.Index(
+                fields=("borrow_date", "id"), name="borrowing_borrow_date_id_idx"
+            ),
+            models.Index(
+                fields=("user", "borrow_date", "id"),
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_active_user_idx",
+            ),
+            models.Index(
+                fields=("expected_return_date",),
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_active_due_idx",
+            ),
+            models.Index(
+                fields=("actual_return_date",),
+                condition=models.Q(actual_return_date__isnull=False),
+                name="borrowing_returned_idx",
+            ),
+            models.Index(fields=("updated_at",), name="borrowing_updated_at_idx"),
+        ]
 
     def __str__(self):
         return f"Borrowing book {self.book.title} by user {self.user} on {self.borrow_date})"
 
     @staticmethod
-    def book_borrowing(book) -> None:
-        book.inventory -= 1
-        book.save()
+    def book_borrowing(book) -> bool:
+        reserved = Book.objects.filter(id=book.id, inventory__gt=0).update(
+            inventory=F("inventory") - 1, updated_at=timezone.now()
+        )
+
+        if reserved:
+            invalidate_catalog()
+
+        return bool(reserved)
+
+    @staticmethod
+    def book_returning(book) -> None:
+        Borrowing.books_returning([book.id])
+
+    @staticmethod
+    def books_borrowing(book_ids: list[int]) -> list[Book | None]:
+        """Reserve one copy per requested book id with a single UPDATE.
+
+        Returns the reserved book for each requested id, or None when the
+        book does not exist or has no copies left. The books are locked in
+        id order, so concurrent bulk requests can't deadlock each other.
+        """
+        books = {
+            book.id: book
+            for book in Book.objects.select_for_update()
+            .defer("search_vector")
+            .filter(id__in=set(book_ids))
+            .order_by("id")
+        }
+        reserved = Counter()
+        result = []
+
+        for book_id in book_ids:
+            book = books.get(book_id)
+
+            if book is None or reserved[book_id] >= book.inventory:
+                result.append(None)
+                continue
+
+            reserved[book_id] += 1
+            result.append(book)
+
+        if reserved:
+            Book.objects.filter(id__in=reserved).update(
+                inventory=F("inventory") - Borrowing.count_by_book(reserved),
+                updated_at=timezone.now(),
+            )
+            invalidate_catalog()
+
+        return result
+
+    @staticmethod
+    def books_returning(book_ids: list[int]) -> None:
+        """Put returned copies back on the shelf or hand them to book holds.
+
+        The inventory update locks the book rows, so the first waiting holds
+        are picked while no other return, hold or claim of the same books can
+        run. Copies given to holds are taken off the inventory again.
+        """
+        returned = Counter(book_ids)
+
+        if returned:
+            Book.objects.filter(id__in=returned).update(
+                inventory=F("inventory") + Borrowing.count_by_book(returned),
+                updated_at=timezone.now(),
+            )
+            held = BookHold.assign_copies(returned)
+
+            if held:
+                Book.objects.filter(id__in=held).update(
+                    inventory=F("inventory") - Borrowing.count_by_book(held),
+                    updated_at=timezone.now(),
+                )
+
+            BookAvailability.refresh(returned)
+            invalidate_catalog()
+
+    @staticmethod
+    def count_by_book(counts: Counter, field: str = "id") -> Case:
+        return Case(
+            *[
+                When(**{field: book_id}, then=Value(count))
+                for book_id, count in counts.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
 
     @staticmethod
     def validate_borrowing(inventory, error_to_raise) -> None:
@@ -38,17 +154,21 @@ class Borrowing(models.Model):
             )
 
     def clean(self) -> None:
-        Borrowing.validate_borrowing(self.book.inventory, ValueError)
+        if self._state.adding and not self.from_hold:
+            Borrowing.validate_borrowing(self.book.inventory, ValueError)
 
     def save(self, *args, **kwargs) -> None:
         self.clean()
-        return super().save(*args, **kwargs)
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+
+        if adding:
+            BookAvailability.refresh([self.book_id])
 
     def return_book(self) -> None:
-        self.book.inventory += 1
-        self.book.save()
         self.actual_return_date = datetime.today()
-        self.save()
+        self.save(update_fields=("actual_return_date", "updated_at"))
+        Borrowing.book_returning(self.book)
 
     def get_borrowing_days(self) -> int:
         last_date = self.expected_return_date.date()
@@ -70,3 +190,296 @@ class Borrowing(models.Model):
         fine_multiplier = Decimal(FINE_MULTIPLIER)
 
         return self.get_overdue_days() * daily_fee * fine_multiplier
+
+
+class Notification(models.Model):
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Set while a worker is sending the message, so others skip it.
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("id",)
+
+    def __str__(self):
+        return f"Notification {self.id} created at {self.created_at}"
+
+
+class BookHold(models.Model):
+    """A member's place in the queue for a book with no copies left.
+
+    Returned copies go to the oldest waiting hold, which can then borrow the
+    book until claim_expires_at. An unclaimed copy moves on to the next hold.
+    """
+
+    class StatusChoices(models.TextChoices):
+        WAITING = "Waiting"
+        READY = "Ready"
+        FULFILLED = "Fulfilled"
+        EXPIRED = "Expired"
+        CANCELLED = "Cancelled"
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="holds"
+    )
+    status = models.CharField(
+        max_length=15, choices=StatusChoices.choices, default=StatusChoices.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("created_at", "id")
+        constraints = [
+            models.UniqueConstraint(
+                fields=("book", "user"),
+                condition=models.Q(status__in=("Waiting", "Ready")),
+                name="bookhold_active_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=("book", "created_at", "id"),
+                condition=models.Q(status="Waiting"),
+                name="bookhold_waiting_idx",
+            ),
+            models.Index(
+                fields=("claim_expires_at",),
+                condition=models.Q(status="Ready"),
+                name="bookhold_ready_expiry_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Hold {self.id} of book {self.book_id} by user {self.user_id}"
+
+    @staticmethod
+    def lock_book(book_id: int) -> Book:
+        return Book.objects.select_for_update().defer("search_vector").get(id=book_id)
+
+    @staticmethod
+    def assign_copies(returned: Counter) -> Counter:
+        """Make the oldest waiting holds of the returned books ready to claim.
+
+        The caller must hold the lock on the book rows. Returns the number
+        of copies given to holds per book.
+        """
+        from borrowing.telegram_notifications import enqueue_messages
+
+        candidates = (
+            BookHold.objects.filter(
+                book_id__in=returned, status=BookHold.StatusChoices.WAITING
+            )
+            .annotate(
+                position=models.Window(
+                    RowNumber(),
+                    partition_by=F("book_id"),
+                    order_by=(F("created_at").asc(), F("id").asc()),
+                )
+            )
+            .filter(position__lte=max(returned.values()))
+            .select_related("book", "user")
+            .only("id", "book_id", "book__title", "user__email")
+        )
+        holds = [hold for hold in candidates if hold.position <= returned[hold.book_id]]
+
+        if not holds:
+            return Counter()
+
+        claim_expires_at = timezone.now() + timedelta(
+            hours=settings.BOOK_HOLD_CLAIM_HOURS
+        )
+        BookHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+            status=BookHold.StatusChoices.READY, claim_expires_at=claim_expires_at
+        )
+        enqueue_messages(
+            f"Book hold ready:\n"
+            f"hold id: {hold.id}\n"
+            f"book: {hold.book.title}\n"
+            f"user: {hold.user}\n"
+            f"claim before: {claim_expires_at}"
+            for hold in holds
+        )
+
+        return Counter(hold.book_id for hold in holds)
+
+    @staticmethod
+    def claim(user, book: Book) -> bool:
+        """Fulfil the user's ready hold of the book, taking its held copy."""
+        return bool(
+            BookHold.objects.filter(
+                user=user,
+                book=book,
+                status=BookHold.StatusChoices.READY,
+                claim_expires_at__gte=timezone.now(),
+            ).update(status=BookHold.StatusChoices.FULFILLED)
+        )
+
+    @staticmethod
+    def has_claim(user, book: Book) -> bool:
+        return BookHold.objects.filter(
+            user=user,
+            book=book,
+            status=BookHold.StatusChoices.READY,
+            claim_expires_at__gte=timezone.now(),
+        ).exists()
+
+    @transaction.atomic
+    def cancel(self) -> bool:
+        """Cancel a waiting or ready hold. Returns False if it was no longer
+        active, e.g. already fulfilled, expired or cancelled."""
+        BookHold.lock_book(self.book_id)
+        status = (
+            BookHold.objects.filter(id=self.id).values_list("status", flat=True).get()
+        )
+
+        if status not in (BookHold.StatusChoices.WAITING, BookHold.StatusChoices.READY):
+            return False
+
+        self.status = BookHold.StatusChoices.CANCELLED
+        self.save(update_fields=("status",))
+
+        if status == BookHold.StatusChoices.READY:
+            Borrowing.books_returning([self.book_id])
+        else:
+            BookAvailability.refresh([self.book_id])
+
+        return True
+
+    @staticmethod
+    @transaction.atomic
+    def expire_claims() -> int:
+        """Expire unclaimed ready holds and pass their copies on."""
+        expired = list(
+            BookHold.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=BookHold.StatusChoices.READY,
+                claim_expires_at__lt=timezone.now(),
+            )
+            .values_list("id", "book_id")
+        )
+
+        if expired:
+            BookHold.objects.filter(id__in=[hold_id for hold_id, _ in expired]).update(
+                status=BookHold.StatusChoices.EXPIRED
+            )
+            Borrowing.books_returning([book_id for _, book_id in expired])
+
+        return len(expired)
+
+
+# Most upcoming return dates kept in a book's availability forecast.
+AVAILABILITY_FORECAST_SIZE = 30
+
+
+class BookAvailability(models.Model):
+    """Waiting holds and upcoming returns of a book, kept up to date wherever
+    a borrowing or hold changes.
+
+    The availability endpoint reads this row with the book by primary key
+    instead of aggregating the book's borrowings and holds.
+    """
+
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="availability",
+    )
+    waiting_holds = models.PositiveIntegerField(default=0)
+    # [{"date": "2024-05-01", "copies": 2}, ...] ordered by date, overdue first.
+    upcoming_returns = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "book availability"
+
+    def __str__(self):
+        return f"Book {self.book_id} has {self.waiting_holds} waiting holds"
+
+    @staticmethod
+    def compute(book_ids=None) -> dict[int, tuple[int, list[dict]]]:
+        holds = BookHold.objects.filter(status=BookHold.StatusChoices.WAITING)
+        borrowings = Borrowing.objects.filter(actual_return_date__isnull=True)
+
+        if book_ids is not None:
+            holds = holds.filter(book__in=book_ids)
+            borrowings = borrowings.filter(book__in=book_ids)
+
+        computed = {}
+
+        for row in holds.values("book").annotate(count=Count("id")).order_by():
+            computed[row["book"]] = (row["count"], [])
+
+        returns = (
+            borrowings.annotate(date=TruncDate("expected_return_date"))
+            .values("book", "date")
+            .annotate(copies=Count("id"))
+            .order_by("book", "date")
+        )
+        for row in returns:
+            waiting_holds, upcoming_returns = computed.setdefault(row["book"], (0, []))
+
+            if len(upcoming_returns) < AVAILABILITY_FORECAST_SIZE:
+                upcoming_returns.append(
+                    {"date": row["date"].isoformat(), "copies": row["copies"]}
+                )
+
+        return computed
+
+    @staticmethod
+    def refresh(book_ids) -> None:
+        """Recompute the availability of the given books.
+
+        Must run in the transaction that changed the borrowings or holds.
+        The availability rows are locked before counting, like
+        PaymentSummary.refresh.
+        """
+        book_ids = sorted(set(book_ids))
+
+        if not book_ids:
+            return
+
+        with transaction.atomic(savepoint=False):
+            BookAvailability.objects.bulk_create(
+                [BookAvailability(book_id=book_id) for book_id in book_ids],
+                ignore_conflicts=True,
+            )
+            rows = list(
+                BookAvailability.objects.select_for_update()
+                .filter(book__in=book_ids)
+                .order_by("book")
+            )
+            computed = BookAvailability.compute(book_ids)
+            updated_at = timezone.now()
+
+            for row in rows:
+                row.updated_at = updated_at
+                row.waiting_holds, row.upcoming_returns = computed.get(
+                    row.book_id, (0, [])
+                )
+
+            BookAvailability.objects.bulk_update(
+                rows, ("waiting_holds", "upcoming_returns", "updated_at")
+            )
+
+    @staticmethod
+    def estimate_available_date(
+        inventory: int, waiting_holds: int, upcoming_returns: list[dict]
+    ) -> date | None:
+        """First date a new hold would get a copy, from the return forecast."""
+        today = timezone.localdate()
+        needed = waiting_holds + 1 - inventory
+
+        if needed <= 0:
+            return today
+
+        for upcoming in upcoming_returns:
+            needed -= upcoming["copies"]
+
+            if needed <= 0:
+                return max(date.fromisoformat(upcoming["date"]), today)
+
+        return None
@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+from library_service import settings
+
+
+class BorrowingPagination(CursorPagination):
+    ordering = ("borrow_date", "id")
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    cursor_query_description = (
+        "Opaque cursor from the `next`/`previous` link of the previous page."
+    )
+    page_size_query_description = (
+        f"Number of borrowings per page (max {settings.API_MAX_PAGE_SIZE})."
+    )
@@ -1,11 +1,42 @@
+from datetime import datetime
+
 from django.db.transaction import atomic
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from book.models import Book
 from book.serializers import BookSerializer
-from borrowing.models import Borrowing
-from payment.models import Payment
-from payment.stripe_payment import create_stripe_session
+from borrowing.models import BookAvailability, BookHold, Borrowing
+from library_service import settings
+from payment.models import Payment, PaymentSummary
+from payment.stripe_payment import request_stripe_session, request_stripe_sessions
+
+
+def validate_no_pending_payment(user) -> None:
+    summary = (
+        PaymentSummary.objects.select_related("blocking_payment__borrowing__book")
+        .defer("blocking_payment__borrowing__book__search_vector")
+        .filter(user=user, open_payments__gt=0, blocking_payment__isnull=False)
+        .first()
+    )
+    pending_payment = summary.blocking_payment if summary else None
+
+    if pending_payment:
+        raise ValidationError(
+            {
+                "You cannot borrow new books until pending/expired payment exist. "
+                "Detail of your the payment:": [
+                    f"id: {pending_payment.id}",
+                    f"status: {pending_payment.status}",
+                    f"type: {pending_payment.type}",
+                    f"money to pay: {pending_payment.money_to_pay}",
+                    f"session id: {pending_payment.session_id}",
+                    f"session url: {pending_payment.session_url}",
+                    f"borrowing book: {pending_payment.borrowing.book}",
+                ]
+            }
+        )
 
 
 class BorrowingSerializer(serializers.ModelSerializer):
@@ -25,73 +56,65 @@ class BorrowingSerializer(serializers.ModelSerializer):
 
 
 class BorrowingCreateSerializer(serializers.ModelSerializer):
+    book = serializers.PrimaryKeyRelatedField(
+        queryset=Book.objects.defer("search_vector")
+    )
+    payment = serializers.PrimaryKeyRelatedField(read_only=True)
+
     class Meta:
         model = Borrowing
         fields = (
             "id",
             "book",
             "expected_return_date",
+            "payment",
         )
 
     def validate(self, attrs):
         data = super(BorrowingCreateSerializer, self).validate(attrs)
-
         user = self.context["request"].user
-        pending_payment = Payment.objects.filter(
-            borrowing__user=user,
-            status__in=(
-                Payment.StatusChoices.PENDING,
-                Payment.StatusChoices.EXPIRED,
-            ),
-        ).first()
-
-        if pending_payment:
-            raise ValidationError(
-                {
-                    "You cannot borrow new books until pending/expired payment exist. "
-                    "Detail of your the payment:": [
-                        f"id: {pending_payment.id}",
-                        f"status: {pending_payment.status}",
-                        f"type: {pending_payment.type}",
-                        f"money to pay: {pending_payment.money_to_pay}",
-                        f"session id: {pending_payment.session_id}",
-                        f"session url: {pending_payment.session_url}",
-                        f"borrowing book: {pending_payment.borrowing.book}",
-                    ]
-                }
-            )
+        book = attrs["book"]
 
-        Borrowing.validate_borrowing(
-            attrs["book"].inventory, serializers.ValidationError
-        )
+        validate_no_pending_payment(user)
+
+        if book.inventory == 0 and not BookHold.has_claim(user, book):
+            Borrowing.validate_borrowing(book.inventory, serializers.ValidationError)
 
         return data
 
     @atomic
     def create(self, validated_data):
         book = validated_data["book"]
-        Borrowing.book_borrowing(book)
 
-        borrowing = Borrowing.objects.create(**validated_data)
+        from_hold = BookHold.claim(validated_data["user"], book)
+
+        if not (from_hold or Borrowing.book_borrowing(book)):
+            raise serializers.ValidationError(
+                {"book": "You can't borrowing this book, all copies are borrowed."}
+            )
+
+        borrowing = Borrowing(**validated_data)
+        borrowing.from_hold = from_hold
+        borrowing.save()
         request = self.context.get("request")
-        borrowing_days = borrowing.get_borrowing_days()
         borrowing_price = borrowing.get_price()
 
-        create_stripe_session(
+        request_stripe_session(
             borrowing,
             request,
             Payment.TypeChoices.PAYMENT,
             borrowing_price,
-            borrowing_days,
         )
 
         return borrowing
 
 
 class BorrowingReturnSerializer(serializers.ModelSerializer):
+    payment = serializers.PrimaryKeyRelatedField(read_only=True)
+
     class Meta:
         model = Borrowing
-        fields = ("id",)
+        fields = ("id", "payment")
 
     def validate(self, attrs):
         data = super(BorrowingReturnSerializer, self).validate(attrs)
@@ -113,12 +136,182 @@ class BorrowingReturnSerializer(serializers.ModelSerializer):
 
         if instance.actual_return_date.date() > instance.expected_return_date.date():
             request = self.context["request"]
-
-            overdue_days = instance.get_overdue_days()
             overdue_price = instance.get_overdue_price()
 
-            create_stripe_session(
-                instance, request, Payment.TypeChoices.FINE, overdue_price, overdue_days
+            request_stripe_session(
+                instance, request, Payment.TypeChoices.FINE, overdue_price
             )
 
         return instance
+
+
+class BorrowingBulkCreateSerializer(serializers.Serializer):
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.BORROWING_BULK_MAX_ITEMS,
+        write_only=True,
+    )
+    expected_return_date = serializers.DateTimeField(write_only=True)
+    results = serializers.ListField(child=serializers.DictField(), read_only=True)
+
+    def validate(self, attrs):
+        validate_no_pending_payment(self.context["request"].user)
+
+        return attrs
+
+    @atomic
+    def create(self, validated_data):
+        book_ids = validated_data["books"]
+        reserved_books = Borrowing.books_borrowing(book_ids)
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=validated_data["user"],
+                expected_return_date=validated_data["expected_return_date"],
+            )
+            for book in reserved_books
+            if book is not None
+        )
+        BookAvailability.refresh(borrowing.book_id for borrowing in borrowings)
+        payments = request_stripe_sessions(
+            [(borrowing, borrowing.get_price()) for borrowing in borrowings],
+            self.context["request"],
+            Payment.TypeChoices.PAYMENT,
+        )
+
+        created = iter(zip(borrowings, payments))
+        results = []
+
+        for book_id, book in zip(book_ids, reserved_books):
+            if book is None:
+                results.append(
+                    {
+                        "book": book_id,
+                        "error": "You can't borrowing this book, "
+                        "it does not exist or all copies are borrowed.",
+                    }
+                )
+                continue
+
+            borrowing, payment = next(created)
+            results.append(
+                {"book": book_id, "borrowing": borrowing.id, "payment": payment.id}
+            )
+
+        return {"results": results, "created": len(borrowings)}
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=settings.BORROWING_BULK_MAX_ITEMS,
+        write_only=True,
+    )
+    results = serializers.ListField(child=serializers.DictField(), read_only=True)
+
+    @atomic
+    def create(self, validated_data):
+        borrowing_ids = validated_data["borrowings"]
+        borrowings = {
+            borrowing.id: borrowing
+            for borrowing in self.context["queryset"]
+            .select_for_update(of=("self",))
+            .filter(id__in=set(borrowing_ids))
+            .order_by("id")
+        }
+        actual_return_date = datetime.today()
+        returned = {}
+        results = []
+
+        for borrowing_id in borrowing_ids:
+            borrowing = borrowings.get(borrowing_id)
+
+            if borrowing is None:
+                results.append({"borrowing": borrowing_id, "error": "Not found."})
+            elif borrowing.actual_return_date:
+                results.append(
+                    {
+                        "borrowing": borrowing_id,
+                        "error": "The borrowing already returned on "
+                        f"{borrowing.actual_return_date}.",
+                    }
+                )
+            else:
+                borrowing.actual_return_date = actual_return_date
+                returned[borrowing_id] = borrowing
+                results.append({"borrowing": borrowing_id, "payment": None})
+
+        Borrowing.objects.filter(id__in=returned).update(
+            actual_return_date=actual_return_date, updated_at=timezone.now()
+        )
+        Borrowing.books_returning(
+            [borrowing.book_id for borrowing in returned.values()]
+        )
+
+        overdue = []
+        for borrowing in returned.values():
+            if borrowing.get_overdue_days() > 0:
+                overdue.append((borrowing, borrowing.get_overdue_price()))
+
+        fines = request_stripe_sessions(
+            overdue, self.context["request"], Payment.TypeChoices.FINE
+        )
+        fine_by_borrowing = {fine.borrowing_id: fine.id for fine in fines}
+
+        for result in results:
+            if "payment" in result:
+                result["payment"] = fine_by_borrowing.get(result["borrowing"])
+
+        return {"results": results, "returned": len(returned)}
+
+
+class BookHoldSerializer(serializers.ModelSerializer):
+    position = serializers.IntegerField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = BookHold
+        fields = (
+            "id",
+            "book",
+            "status",
+            "position",
+            "created_at",
+            "claim_expires_at",
+        )
+        read_only_fields = ("status", "created_at", "claim_expires_at")
+
+    @atomic
+    def create(self, validated_data):
+        book = BookHold.lock_book(validated_data["book"].id)
+        user = validated_data["user"]
+
+        if book.inventory > 0:
+            raise ValidationError(
+                {"book": "The book has copies left, you can borrow it now."}
+            )
+
+        if BookHold.objects.filter(
+            book=book,
+            user=user,
+            status__in=(BookHold.StatusChoices.WAITING, BookHold.StatusChoices.READY),
+        ).exists():
+            raise ValidationError({"book": "You already have a hold on this book."})
+
+        hold = BookHold.objects.create(book=book, user=user)
+        BookAvailability.refresh([book.id])
+        # Holds are created under the book lock, so the new one is the last.
+        hold.position = BookHold.objects.filter(
+            book=book, status=BookHold.StatusChoices.WAITING
+        ).count()
+
+        return hold
+
+
+class BookAvailabilitySerializer(serializers.Serializer):
+    book = serializers.IntegerField()
+    inventory = serializers.IntegerField()
+    waiting_holds = serializers.IntegerField()
+    upcoming_returns = serializers.ListField(child=serializers.DictField())
+    estimated_available_date = serializers.DateField(allow_null=True)
@@ -1,25 +1,38 @@
-import stripe
+import requests
 
 from borrowing.borrowing_overdue import check_borrowings_overdue
+from borrowing.models import BookHold
+from borrowing.telegram_notifications import OUTBOX_BATCH_SIZE, deliver_notifications
 from celery import shared_task
 
-from library_service import settings
-from payment.models import Payment
+from payment.reconciliation import SessionReconciler
 
 
 @shared_task
-def check_borrowings() -> None:
+def check_borrowings() -> dict:
     return check_borrowings_overdue()
 
 
 @shared_task
-def check_stripe_session_status():
-    pending_payments = Payment.objects.filter(status="PENDING")
+def expire_book_holds() -> int:
+    """Pass copies of holds that were not claimed in time to the next hold."""
+    return BookHold.expire_claims()
 
-    for payment in pending_payments:
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        session = stripe.checkout.Session.retrieve(payment.session_id)
 
-        if session["status"] == "expired":
-            payment.status = Payment.StatusChoices.EXPIRED
-            payment.save()
+@shared_task(bind=True, max_retries=5)
+def send_notifications(self) -> int:
+    try:
+        delivered = deliver_notifications()
+    except requests.RequestException as exc:
+        raise self.retry(exc=exc, countdown=2**self.request.retries * 10)
+
+    if delivered == OUTBOX_BATCH_SIZE:
+        send_notifications.delay()
+
+    return delivered
+
+
+@shared_task
+def check_stripe_session_status() -> dict:
+    """Reconcile pending payments whose webhook events were missed."""
+    return SessionReconciler().run()
@@ -1,20 +1,194 @@
 import os
+import time
+from collections.abc import Iterable, Iterator
+from datetime import timedelta
+
 import requests
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from dotenv import load_dotenv
+from kombu.exceptions import OperationalError
+
+from borrowing.models import Notification
+from library_service.metrics import track_external
 
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
-API_URL = "https://api.telegram.org/bot"
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+MESSAGE_MAX_LENGTH = 4096
+MESSAGE_SEPARATOR = "\n\n"
+# Telegram allows about one message per second in a chat
+# and 20 messages per minute in a group.
+SEND_INTERVAL = float(os.getenv("TELEGRAM_SEND_INTERVAL", 1.0))
+REQUEST_TIMEOUT = 10
+MAX_ATTEMPTS = 5
+BACKOFF_FACTOR = 1.0
+OUTBOX_BATCH_SIZE = 500
+# Claimed messages are picked again after this long, e.g. if the worker died.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+session = requests.Session()
+_last_sent_at = 0.0
+
+
+def pack_messages(
+    messages: Iterable[str], limit: int = MESSAGE_MAX_LENGTH
+) -> Iterator[tuple[str, int]]:
+    """Pack messages into as few Telegram messages as possible.
+
+    Yields every chunk with the number of messages that are complete once
+    it and the chunks before it are sent.
+    """
+    current = ""
+    complete = 0
+
+    for message in messages:
+        pieces = [message[i : i + limit] for i in range(0, len(message), limit)]
+
+        for piece in pieces:
+            if current and len(current) + len(MESSAGE_SEPARATOR) + len(piece) <= limit:
+                current += MESSAGE_SEPARATOR + piece
+                continue
+
+            if current:
+                yield current, complete
+            current = piece
+
+        complete += 1
 
+    if current:
+        yield current, complete
 
-def send_message(message):
+
+def chunk_messages(
+    messages: Iterable[str], limit: int = MESSAGE_MAX_LENGTH
+) -> list[str]:
+    return [chunk for chunk, _ in pack_messages(messages, limit)]
+
+
+def _wait_for_rate_limit() -> None:
+    global _last_sent_at
+
+    delay = _last_sent_at + SEND_INTERVAL - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+    _last_sent_at = time.monotonic()
+
+
+def _get_retry_after(response: requests.Response, attempt: int) -> float:
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return BACKOFF_FACTOR * 2**attempt
+
+
+def send_message(message: str) -> None:
     url = f"{API_URL}{TELEGRAM_BOT_TOKEN}/sendMessage"
     data = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
 
-    response = requests.post(url, data=data)
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        _wait_for_rate_limit()
+
+        try:
+            with track_external("telegram"):
+                response = session.post(url, data=data, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if last_attempt:
+                raise
+            time.sleep(BACKOFF_FACTOR * 2**attempt)
+            continue
+
+        if response.status_code == 429 and not last_attempt:
+            time.sleep(_get_retry_after(response, attempt))
+            continue
+
+        if response.status_code >= 500 and not last_attempt:
+            time.sleep(BACKOFF_FACTOR * 2**attempt)
+            continue
+
+        response.raise_for_status()
+        return
+
+
+def schedule_delivery() -> None:
+    """Queue the outbox delivery task.
+
+    If the broker is down the messages stay in the outbox and are sent by
+    the send-notifications beat task, so the request does not fail.
+    """
+    from borrowing.tasks import send_notifications
+
+    try:
+        send_notifications.delay()
+    except OperationalError:
+        pass
+
+
+def enqueue_messages(messages: Iterable[str]) -> None:
+    """Store messages in the outbox and schedule their delivery."""
+    Notification.objects.bulk_create(
+        [Notification(text=text) for text in chunk_messages(messages)]
+    )
+    transaction.on_commit(schedule_delivery)
+
+
+def enqueue_message(message: str) -> None:
+    enqueue_messages([message])
+
+
+def claim_notifications() -> list[Notification]:
+    """Lease a batch of pending outbox messages to this worker.
+
+    The rows are locked only while the lease is taken, so no transaction
+    stays open while the messages are sent.
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        notifications = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .only("id", "text")[:OUTBOX_BATCH_SIZE]
+        )
+        Notification.objects.filter(
+            id__in=[notification.id for notification in notifications]
+        ).update(claimed_until=now + CLAIM_TIMEOUT)
+
+    return notifications
+
+
+def deliver_notifications() -> int:
+    """Send pending outbox messages packed into as few Telegram messages as possible.
+
+    Messages are marked sent after every chunk that Telegram accepted. On a
+    failure the lease of the unsent messages is released for the retry, so
+    only the chunk that failed can be delivered twice.
+    """
+    notifications = claim_notifications()
+    sent = 0
+
+    try:
+        for chunk, complete in pack_messages(
+            notification.text for notification in notifications
+        ):
+            send_message(chunk)
+            Notification.objects.filter(
+                id__in=[
+                    notification.id for notification in notifications[sent:complete]
+                ]
+            ).update(sent_at=timezone.now())
+            sent = complete
+    finally:
+        Notification.objects.filter(
+            id__in=[notification.id for notification in notifications[sent:]]
+        ).update(claimed_until=None)
 
-    if response.status_code != 200:
-        raise Exception(f"Error sending message: {response.text}")
+    return len(notifications)
@@ -1,19 +1,59 @@
-from datetime import datetime, timedelta
+import csv
+import json
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Barrier, Thread
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+import requests
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.utils import timezone
 from freezegun import freeze_time
+from kombu.exceptions import OperationalError
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-from borrowing.models import Borrowing, FINE_MULTIPLIER
+from borrowing.borrowing_overdue import check_borrowings_overdue
+from borrowing.models import (
+    BookAvailability,
+    BookHold,
+    Borrowing,
+    FINE_MULTIPLIER,
+    Notification,
+)
 from borrowing.serializers import BorrowingSerializer
+from borrowing.tasks import expire_book_holds
+from borrowing.telegram_notifications import (
+    MESSAGE_MAX_LENGTH,
+    MESSAGE_SEPARATOR,
+    chunk_messages,
+    deliver_notifications,
+    enqueue_message,
+    send_message,
+)
+from book.models import Book
 from book.tests import sample_book
-from payment.models import Payment
+from library_service import settings
+from library_service.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from payment.models import Payment, PaymentSummary
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
+BULK_BORROWING_URL = reverse("borrowing:borrowing-bulk-borrowing")
+BULK_RETURN_URL = reverse("borrowing:borrowing-bulk-return")
+HOLD_URL = reverse("borrowing:bookhold-list")
+EXPORT_URL = reverse("borrowing:borrowing-export")
 
 
 def sample_user():
@@ -77,12 +117,12 @@ class AuthenticatedBorrowingApiTests(TestCase):
         res = self.client.get(BORROWING_URL)
         serializer = BorrowingSerializer(borrowing, many=True)
 
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
 
         all_borrowings = Borrowing.objects.all()
         serializer = BorrowingSerializer(all_borrowings, many=True)
 
-        self.assertNotEqual(res.data, serializer.data)
+        self.assertNotEqual(res.data["results"], serializer.data)
 
     def test_auth_borrowing_create(self):
         book = sample_book()
@@ -157,6 +197,84 @@ class AuthenticatedBorrowingApiTests(TestCase):
             )
 
 
+class IdempotentBorrowingApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+        self.book = sample_book()
+        self.expected_return_date = datetime.today() + timedelta(days=14)
+
+    def post(self, url: str, payload: dict, key: str = "key-1"):
+        with patch(
+            "payment.tasks.create_checkout_session.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                url, payload, format="json", headers={IDEMPOTENCY_HEADER: key}
+            )
+
+        return res, delay
+
+    def borrowing_payload(self) -> dict:
+        return {
+            "book": self.book.id,
+            "expected_return_date": self.expected_return_date,
+        }
+
+    def test_repeated_create_is_replayed(self):
+        res, delay = self.post(BORROWING_URL, self.borrowing_payload())
+        res2, delay2 = self.post(BORROWING_URL, self.borrowing_payload())
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.data, res.data)
+        self.assertEqual(res2[REPLAYED_HEADER], "true")
+        self.assertEqual(Borrowing.objects.count(), 1)
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 9)
+        delay.assert_called_once()
+        delay2.assert_not_called()
+
+    def test_create_with_another_key_runs_again(self):
+        self.post(BORROWING_URL, self.borrowing_payload())
+        Payment.objects.update(status=Payment.StatusChoices.PAID)
+        PaymentSummary.refresh([self.user.id])
+
+        res, _ = self.post(BORROWING_URL, self.borrowing_payload(), key="key-2")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn(REPLAYED_HEADER, res)
+        self.assertEqual(Borrowing.objects.count(), 2)
+
+    def test_key_reused_with_another_payload(self):
+        self.post(BORROWING_URL, self.borrowing_payload())
+        payload = self.borrowing_payload()
+        payload["book"] = sample_book().id
+
+        res, _ = self.post(BORROWING_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+    def test_repeated_return_is_replayed(self):
+        borrowing = sample_borrowing(user=self.user)
+        return_url = reverse(
+            "borrowing:borrowing-return-borrowing", args=[borrowing.id]
+        )
+
+        with freeze_time(datetime.today() + timedelta(days=17)):
+            res, delay = self.post(return_url, {})
+            res2, delay2 = self.post(return_url, {})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertEqual(res2.data, res.data)
+        self.assertEqual(Book.objects.get(id=borrowing.book_id).inventory, 11)
+        self.assertEqual(Payment.objects.filter(borrowing=borrowing).count(), 1)
+        delay.assert_called_once()
+        delay2.assert_not_called()
+
+
 class AdminBorrowingTestVew(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -172,11 +290,24 @@ class AdminBorrowingTestVew(TestCase):
         sample_borrowing(user=self.user)
         sample_borrowing(user=self.admin_user)
 
-        borrowings = Borrowing.objects.all()
+        borrowings = Borrowing.objects.order_by("borrow_date", "id")
         serializer = BorrowingSerializer(borrowings, many=True)
         res = self.client.get(BORROWING_URL)
 
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data["results"], serializer.data)
+
+    def test_admin_borrowing_list_cursor_pagination(self):
+        for _ in range(3):
+            sample_borrowing(user=self.user)
+
+        res = self.client.get(BORROWING_URL, {"page_size": 2})
+        next_res = self.client.get(res.data["next"])
+        borrowings = Borrowing.objects.order_by("borrow_date", "id")
+        serializer = BorrowingSerializer(borrowings, many=True)
+
+        self.assertEqual(res.data["results"], serializer.data[:2])
+        self.assertEqual(next_res.data["results"], serializer.data[2:])
+        self.assertIsNone(next_res.data["next"])
 
     def test_admin_other_user_borrowing_detail(self):
         borrowing = sample_borrowing(user=self.user)
@@ -185,3 +316,735 @@ class AdminBorrowingTestVew(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class BorrowingConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+        self.borrowing = sample_borrowing(self.user)
+        self.url = detail_borrowing_url(self.borrowing.id)
+
+    def test_detail_not_modified_is_not_serialized(self):
+        res = self.client.get(self.url)
+
+        with patch.object(BorrowingSerializer, "to_representation") as serialize:
+            res2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+            res3 = self.client.get(
+                self.url, HTTP_IF_MODIFIED_SINCE=res["Last-Modified"]
+            )
+
+        serialize.assert_not_called()
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2["ETag"], res["ETag"])
+        self.assertEqual(res3.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_etag_changes_on_return(self):
+        res = self.client.get(self.url)
+        self.client.post(
+            reverse("borrowing:borrowing-return-borrowing", args=[self.borrowing.id])
+        )
+
+        res2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res2["ETag"], res["ETag"])
+        self.assertIsNotNone(res2.data["actual_return_date"])
+
+    def test_list_etag_changes_with_book_inventory(self):
+        res = self.client.get(BORROWING_URL)
+        res2 = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        Borrowing.book_borrowing(self.borrowing.book)
+        res3 = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res3.status_code, status.HTTP_200_OK)
+        self.assertEqual(res3.data["results"][0]["book"]["inventory"], 9)
+
+    def test_list_etag_changes_with_new_borrowing(self):
+        res = self.client.get(BORROWING_URL)
+        sample_borrowing(self.user)
+
+        res2 = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res2.data["results"]), 2)
+
+    def test_etag_changes_with_user_email(self):
+        res = self.client.get(self.url)
+        res2 = self.client.get(BORROWING_URL)
+        self.user.email = "renamed@test.com"
+        self.user.save()
+
+        res3 = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+        res4 = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=res2["ETag"])
+
+        self.assertEqual(res3.status_code, status.HTTP_200_OK)
+        self.assertEqual(res3.data["user"], "renamed@test.com")
+        self.assertEqual(res4.status_code, status.HTTP_200_OK)
+        self.assertEqual(res4.data["results"][0]["user"], "renamed@test.com")
+
+
+class BorrowingExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.admin_user = get_user_model().objects.create_user(
+            email="test1@test1.com",
+            password="TestUser1",
+            is_staff=True,
+        )
+        self.client.force_authenticate(self.admin_user)
+        self.active = sample_borrowing(user=self.user)
+        self.returned = sample_borrowing(user=self.user)
+        self.returned.actual_return_date = datetime.now()
+        self.returned.save()
+        sample_borrowing(user=self.admin_user)
+
+    def test_export_csv_with_filters(self):
+        res = self.client.get(
+            EXPORT_URL, {"user_id": self.user.id, "is_active": "true"}
+        )
+        rows = list(csv.reader(StringIO(b"".join(res.streaming_content).decode())))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn('filename="borrowings.csv"', res["Content-Disposition"])
+        self.assertEqual(
+            rows[0][:4],
+            ["id", "borrow_date", "expected_return_date", "actual_return_date"],
+        )
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.active.id)])
+        self.assertEqual(rows[1][-2], self.user.email)
+
+    def test_export_ndjson(self):
+        res = self.client.get(EXPORT_URL, {"export_format": "ndjson"})
+        lines = b"".join(res.streaming_content).decode().splitlines()
+        row = json.loads(lines[0])
+
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(row["book_title"], self.active.book.title)
+        self.assertEqual(
+            datetime.fromisoformat(row["borrow_date"]), self.active.borrow_date
+        )
+
+    def test_export_invalid_format(self):
+        res = self.client.get(EXPORT_URL, {"export_format": "xml"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_for_admin_only(self):
+        self.client.force_authenticate(self.user)
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_export_streams_under_asgi(self):
+        token = AccessToken.for_user(self.admin_user)
+        res = await AsyncClient().get(
+            EXPORT_URL,
+            {"is_active": "false"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        chunks = [chunk async for chunk in res.streaming_content]
+
+        self.assertTrue(res.is_async)
+        self.assertEqual(
+            [line.split(",")[0] for line in b"".join(chunks).decode().splitlines()],
+            ["id", str(self.returned.id)],
+        )
+
+
+class BulkBorrowingApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+
+    def bulk_borrow(self, book_ids: list[int]):
+        payload = {
+            "books": book_ids,
+            "expected_return_date": datetime.today() + timedelta(days=7),
+        }
+
+        with patch(
+            "payment.tasks.create_checkout_session.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_BORROWING_URL, payload, format="json")
+
+        return res, delay
+
+    def test_bulk_borrowing_reports_every_book(self):
+        book = sample_book(inventory=1)
+        empty_book = sample_book(inventory=0)
+
+        res, delay = self.bulk_borrow([book.id, empty_book.id, book.id, 999999])
+        results = res.data["results"]
+        payments = Payment.objects.order_by("id")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(results[0]["payment"], payments.get().id)
+        self.assertEqual([("error" in result) for result in results[1:]], [True] * 3)
+        self.assertEqual(Book.objects.get(id=book.id).inventory, 0)
+        self.assertEqual(payments.get().status, Payment.StatusChoices.CREATING)
+        delay.assert_called_once()
+
+    def test_bulk_borrowing_uses_one_stripe_session(self):
+        books = [sample_book() for _ in range(3)]
+
+        res, delay = self.bulk_borrow([book.id for book in books])
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Borrowing.objects.filter(user=self.user).count(), 3)
+        delay.assert_called_once()
+        self.assertEqual(
+            delay.call_args.args[0],
+            [result["payment"] for result in res.data["results"]],
+        )
+        for book in books:
+            book.refresh_from_db()
+            self.assertEqual(book.inventory, 9)
+
+    def test_bulk_borrowing_query_count_is_constant(self):
+        books = [sample_book() for _ in range(30)]
+
+        with CaptureQueriesContext(connection) as one_book:
+            self.bulk_borrow([books[0].id])
+        Payment.objects.update(status=Payment.StatusChoices.PAID)
+        PaymentSummary.refresh([self.user.id])
+
+        with CaptureQueriesContext(connection) as many_books:
+            res, delay = self.bulk_borrow([book.id for book in books[1:]])
+
+        self.assertEqual(len(res.data["results"]), 29)
+        self.assertEqual(len(many_books), len(one_book))
+
+    def test_bulk_borrowing_with_pending_payment(self):
+        self.bulk_borrow([sample_book().id])
+
+        res, delay = self.bulk_borrow([sample_book().id])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        delay.assert_not_called()
+
+    def test_bulk_borrowing_without_available_books(self):
+        res, delay = self.bulk_borrow([sample_book(inventory=0).id])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrowing.objects.exists())
+
+    @freeze_time("2026-01-15 12:00:00")
+    def test_bulk_return_creates_fines_in_one_session(self):
+        on_time = sample_borrowing(user=self.user)
+        overdue = Borrowing.objects.create(
+            **payload_for_borrowing(
+                self.user, expected_return_date=datetime.today() - timedelta(days=2)
+            )
+        )
+        other_user_borrowing = sample_borrowing(
+            user=get_user_model().objects.create_user(
+                email="other@test.com", password="TestUser"
+            )
+        )
+        payload = {
+            "borrowings": [on_time.id, overdue.id, overdue.id, other_user_borrowing.id]
+        }
+
+        with patch(
+            "payment.tasks.create_checkout_session.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_RETURN_URL, payload, format="json")
+        results = res.data["results"]
+        fine = Payment.objects.get(type=Payment.TypeChoices.FINE)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(results[0]["payment"])
+        self.assertEqual(results[1]["payment"], fine.id)
+        self.assertIn("error", results[2])
+        self.assertIn("error", results[3])
+        self.assertEqual(fine.borrowing, overdue)
+        self.assertEqual(
+            fine.money_to_pay,
+            Borrowing.objects.get(id=overdue.id).get_overdue_price(),
+        )
+        delay.assert_called_once_with(
+            [fine.id],
+            "http://testserver" + reverse("payment:payment-success"),
+            "http://testserver" + reverse("payment:payment-cancel"),
+        )
+        self.assertEqual(Book.objects.get(id=on_time.book_id).inventory, 11)
+        self.assertIsNone(
+            Borrowing.objects.get(id=other_user_borrowing.id).actual_return_date
+        )
+
+
+class BookHoldApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.other_user = get_user_model().objects.create_user(
+            email="other@test.com", password="TestUser"
+        )
+        self.book = sample_book(inventory=1)
+        self.borrowing = Borrowing.objects.create(
+            **payload_for_borrowing(self.user, book=self.book)
+        )
+        Borrowing.book_borrowing(self.book)
+
+    def hold(self, user) -> dict:
+        self.client.force_authenticate(user)
+        res = self.client.post(HOLD_URL, {"book": self.book.id})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        return res.data
+
+    def return_borrowing(self):
+        self.client.force_authenticate(self.user)
+
+        return self.client.post(
+            reverse("borrowing:borrowing-return-borrowing", args=[self.borrowing.id])
+        )
+
+    def test_holds_queue_in_order(self):
+        first = self.hold(self.user)
+        second = self.hold(self.other_user)
+
+        res = self.client.post(HOLD_URL, {"book": self.book.id})
+        holds = self.client.get(HOLD_URL).data
+
+        self.assertEqual((first["position"], second["position"]), (1, 2))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([hold["position"] for hold in holds], [2])
+        self.assertEqual(BookAvailability.objects.get(book=self.book).waiting_holds, 2)
+
+    def test_hold_of_available_book(self):
+        self.client.force_authenticate(self.user)
+
+        res = self.client.post(HOLD_URL, {"book": sample_book().id})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_returned_copy_is_held_for_first_hold(self):
+        self.hold(self.other_user)
+        notifications = Notification.objects.count()
+
+        self.assertEqual(self.return_borrowing().status_code, status.HTTP_200_OK)
+
+        hold = BookHold.objects.get()
+        self.assertEqual(hold.status, BookHold.StatusChoices.READY)
+        self.assertIsNotNone(hold.claim_expires_at)
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 0)
+        self.assertEqual(Notification.objects.count(), notifications + 1)
+
+        payload = {
+            "book": self.book.id,
+            "expected_return_date": datetime.today() + timedelta(days=7),
+        }
+        self.client.force_authenticate(self.user)
+        res = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(self.other_user)
+        res = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, BookHold.StatusChoices.FULFILLED)
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 0)
+
+    def test_unclaimed_copy_goes_to_next_hold(self):
+        self.hold(self.other_user)
+        third_user = get_user_model().objects.create_user(
+            email="third@test.com", password="TestUser"
+        )
+        self.hold(third_user)
+        self.return_borrowing()
+
+        with freeze_time(datetime.today() + timedelta(days=3)):
+            self.assertEqual(BookHold.expire_claims(), 1)
+
+            self.assertEqual(
+                list(BookHold.objects.values_list("status", flat=True)),
+                [BookHold.StatusChoices.EXPIRED, BookHold.StatusChoices.READY],
+            )
+
+            self.assertEqual(BookHold.expire_claims(), 0)
+
+        with freeze_time(datetime.today() + timedelta(days=6)):
+            BookHold.expire_claims()
+
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 1)
+
+    def test_expire_book_holds_is_scheduled(self):
+        self.assertEqual(
+            settings.CELERY_BEAT_SCHEDULE["expire-book-holds"]["task"],
+            expire_book_holds.name,
+        )
+
+    def test_cancelled_ready_hold_passes_copy_on(self):
+        hold = self.hold(self.other_user)
+        self.return_borrowing()
+
+        self.client.force_authenticate(self.other_user)
+        res = self.client.delete(
+            reverse("borrowing:bookhold-detail", args=[hold["id"]])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            BookHold.objects.get().status, BookHold.StatusChoices.CANCELLED
+        )
+        self.assertEqual(Book.objects.get(id=self.book.id).inventory, 1)
+
+    def test_inactive_hold_cannot_be_cancelled(self):
+        hold = self.hold(self.other_user)
+        BookHold.objects.filter(id=hold["id"]).update(
+            status=BookHold.StatusChoices.EXPIRED
+        )
+
+        self.client.force_authenticate(self.other_user)
+        res = self.client.delete(
+            reverse("borrowing:bookhold-detail", args=[hold["id"]])
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(BookHold.objects.get().status, BookHold.StatusChoices.EXPIRED)
+
+    def test_book_availability(self):
+        self.hold(self.other_user)
+        url = reverse("book:book-detail", args=[self.book.id]) + "availability/"
+        self.client.force_authenticate(None)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["inventory"], 0)
+        self.assertEqual(res.data["waiting_holds"], 1)
+        self.assertEqual(
+            res.data["upcoming_returns"],
+            [
+                {
+                    "date": self.borrowing.expected_return_date.date().isoformat(),
+                    "copies": 1,
+                }
+            ],
+        )
+        self.assertIsNone(res.data["estimated_available_date"])
+
+    def test_estimate_available_date(self):
+        returns = [
+            {"date": (date.today() + timedelta(days=days)).isoformat(), "copies": 1}
+            for days in (-2, 3, 5)
+        ]
+        estimate = BookAvailability.estimate_available_date
+
+        self.assertEqual(estimate(1, 0, returns), date.today())
+        self.assertEqual(estimate(0, 0, returns), date.today())
+        self.assertEqual(estimate(0, 2, returns), date.today() + timedelta(days=5))
+        self.assertIsNone(estimate(0, 3, returns))
+
+    def test_rebuild_book_availability(self):
+        BookAvailability.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_book_availability", "--verify", stdout=StringIO())
+
+        call_command("rebuild_book_availability", stdout=StringIO())
+        call_command("rebuild_book_availability", "--verify", stdout=StringIO())
+
+        self.assertEqual(
+            BookAvailability.objects.get(book=self.book).upcoming_returns[0]["copies"],
+            1,
+        )
+
+
+class BookInventoryReservationTests(TransactionTestCase):
+    def test_concurrent_borrowing_never_oversells(self):
+        book = sample_book(inventory=5)
+        threads = 20
+        barrier = Barrier(threads)
+
+        def reserve(_) -> bool:
+            try:
+                barrier.wait()
+                return Borrowing.book_borrowing(book)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(reserve, range(threads)))
+
+        book.refresh_from_db()
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(book.inventory, 0)
+
+    def test_reservation_fails_on_zero_inventory(self):
+        book = sample_book(inventory=0)
+
+        self.assertFalse(Borrowing.book_borrowing(book))
+        book.refresh_from_db()
+        self.assertEqual(book.inventory, 0)
+
+    def test_return_book_increments_inventory_in_database(self):
+        user = sample_user()
+        borrowing = sample_borrowing(user=user)
+        Book.objects.filter(id=borrowing.book_id).update(inventory=0)
+
+        borrowing.return_book()
+        borrowing.book.refresh_from_db()
+
+        self.assertEqual(borrowing.book.inventory, 1)
+        self.assertIsNotNone(borrowing.actual_return_date)
+
+
+class BorrowingsOverdueTests(TestCase):
+    def sample_overdue_borrowings(self, count: int) -> None:
+        start = get_user_model().objects.count()
+
+        for index in range(start, start + count):
+            user = get_user_model().objects.create_user(
+                email=f"overdue{index}@test.com", password="TestUser"
+            )
+            Borrowing.objects.create(
+                **payload_for_borrowing(
+                    user, expected_return_date=datetime.today() - timedelta(days=1)
+                )
+            )
+
+    def test_no_borrowings_overdue(self):
+        sample_borrowing(user=sample_user())
+
+        stats = check_borrowings_overdue()
+
+        self.assertEqual(stats["count"], 0)
+        self.assertEqual(
+            Notification.objects.get().text, "No borrowings overdue today!"
+        )
+
+    def test_borrowings_overdue_are_aggregated_in_outbox(self):
+        self.sample_overdue_borrowings(3)
+
+        stats = check_borrowings_overdue()
+        notification = Notification.objects.get()
+
+        self.assertEqual(stats["count"], 3)
+        self.assertIn("overdue0@test.com", notification.text)
+        self.assertTrue(notification.text.endswith("3 total borrowings overdue today."))
+        self.assertIsNone(notification.sent_at)
+
+    @patch("borrowing.borrowing_overdue.OVERDUE_CHUNK_SIZE", 2)
+    def test_borrowings_overdue_are_enqueued_per_chunk(self):
+        self.sample_overdue_borrowings(3)
+
+        stats = check_borrowings_overdue()
+        notifications = list(Notification.objects.all())
+
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(len(notifications), 2)
+        self.assertEqual(notifications[0].text.count("Borrowing overdue"), 2)
+        self.assertTrue(
+            notifications[1].text.endswith("3 total borrowings overdue today.")
+        )
+
+    def test_borrowings_overdue_query_count_is_constant(self):
+        self.sample_overdue_borrowings(2)
+        small_stats = check_borrowings_overdue()
+
+        self.sample_overdue_borrowings(10)
+
+        with self.assertNumQueries(small_stats["queries"]):
+            stats = check_borrowings_overdue()
+
+        self.assertEqual(stats["count"], 12)
+        self.assertEqual(stats["queries"], small_stats["queries"])
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """Local stand-in for the Telegram Bot API recording sent messages."""
+
+    def __init__(self, responses: list[tuple[int, dict]] = None):
+        super().__init__(("127.0.0.1", 0), FakeTelegramHandler)
+        self.responses = list(responses or [])
+        self.messages = []
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/bot"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        data = parse_qs(self.rfile.read(length).decode())
+        status_code, body = (
+            self.server.responses.pop(0) if self.server.responses else (200, {})
+        )
+
+        if status_code == 200:
+            self.server.messages.append(data["text"][0])
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"ok": status_code == 200, **body}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@patch.multiple("borrowing.telegram_notifications", SEND_INTERVAL=0, BACKOFF_FACTOR=0)
+class TelegramNotificationTests(TestCase):
+    def test_chunk_messages_respects_telegram_limit(self):
+        messages = ["a" * 3000, "b" * 2000, "c" * 10, "d" * 5000]
+
+        chunks = chunk_messages(messages)
+
+        self.assertTrue(all(len(chunk) <= MESSAGE_MAX_LENGTH for chunk in chunks))
+        self.assertEqual(
+            "".join(chunks).replace(MESSAGE_SEPARATOR, ""), "".join(messages)
+        )
+        self.assertEqual(len(chunks), 4)
+
+    def test_deliver_notifications_batches_outbox(self):
+        Notification.objects.bulk_create(
+            [Notification(text=f"message {index}") for index in range(5)]
+        )
+
+        with FakeTelegramServer() as server, patch(
+            "borrowing.telegram_notifications.API_URL", server.url
+        ):
+            delivered = deliver_notifications()
+
+        self.assertEqual(delivered, 5)
+        self.assertEqual(len(server.messages), 1)
+        self.assertIn("message 4", server.messages[0])
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_send_message_retries_after_rate_limit(self):
+        responses = [
+            (429, {"parameters": {"retry_after": 0}}),
+            (502, {}),
+        ]
+
+        with FakeTelegramServer(responses) as server, patch(
+            "borrowing.telegram_notifications.API_URL", server.url
+        ):
+            send_message("hello")
+
+        self.assertEqual(server.messages, ["hello"])
+
+    def test_deliver_notifications_keeps_outbox_on_failure(self):
+        Notification.objects.create(text="hello")
+        responses = [(400, {"description": "Bad Request"})]
+
+        with FakeTelegramServer(responses) as server, patch(
+            "borrowing.telegram_notifications.API_URL", server.url
+        ), self.assertRaises(requests.HTTPError):
+            deliver_notifications()
+
+        self.assertTrue(Notification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_deliver_notifications_marks_chunks_sent_before_failure(self):
+        first, second = Notification.objects.bulk_create(
+            [Notification(text="a" * 3000), Notification(text="b" * 3000)]
+        )
+        responses = [(200, {}), (400, {"description": "Bad Request"})]
+
+        with FakeTelegramServer(responses) as server, patch(
+            "borrowing.telegram_notifications.API_URL", server.url
+        ), self.assertRaises(requests.HTTPError):
+            deliver_notifications()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+
+        self.assertIsNotNone(first.sent_at)
+        self.assertIsNone(second.sent_at)
+        self.assertIsNone(second.claimed_until)
+
+    def test_deliver_notifications_skips_claimed_messages(self):
+        Notification.objects.create(
+            text="hello", claimed_until=timezone.now() + timedelta(minutes=1)
+        )
+        Notification.objects.create(
+            text="stale", claimed_until=timezone.now() - timedelta(minutes=1)
+        )
+
+        with FakeTelegramServer() as server, patch(
+            "borrowing.telegram_notifications.API_URL", server.url
+        ):
+            delivered = deliver_notifications()
+
+        self.assertEqual(delivered, 1)
+        self.assertEqual(server.messages, ["stale"])
+
+    def test_enqueue_message_keeps_outbox_when_broker_is_down(self):
+        with patch(
+            "borrowing.tasks.send_notifications.delay", side_effect=OperationalError
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            enqueue_message("hello")
+
+        delay.assert_called_once_with()
+        self.assertTrue(
+            Notification.objects.filter(text="hello", sent_at__isnull=True).exists()
+        )
+
+
+class BorrowingIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"index{index}@test.com") for index in range(20)
+        )
+        cls.user = users[0]
+        book = sample_book()
+        today = datetime.today()
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=users[index % len(users)],
+                expected_return_date=today + timedelta(days=index % 30 - 15),
+                actual_return_date=None if index % 7 == 0 else today,
+            )
+            for index in range(1000)
+        )
+
+    def assert_uses_index(self, queryset, index_name: str) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE borrowing_borrowing")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        self.assertIn(index_name, queryset.explain())
+
+    def test_active_borrowings_of_user_use_partial_index(self):
+        self.assert_uses_index(
+            Borrowing.objects.filter(
+                actual_return_date__isnull=True, user=self.user
+            ).order_by("borrow_date", "id"),
+            "borrowing_active_user_idx",
+        )
+
+    def test_overdue_borrowings_use_partial_index(self):
+        self.assert_uses_index(
+            Borrowing.objects.filter(
+                expected_return_date__lte=datetime.today(),
+                actual_return_date__isnull=True,
+            ),
+            "borrowing_active_due_idx",
+        )
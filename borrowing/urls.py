@@ -1,12 +1,14 @@
 from rest_framework import routers
 
 from borrowing.views import (
+    BookHoldViewSet,
     BorrowingViewSet,
 )
 
 app_name = "borrowing"
 
 router = routers.DefaultRouter()
+router.register("holds", BookHoldViewSet)
 router.register("", BorrowingViewSet)
 
 urlpatterns = router.urls
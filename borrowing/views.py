@@ -1,45 +1,80 @@
+from django.db.models import Case, Count, OuterRef, Q, Subquery, When
 from django.db.transaction import atomic
-from drf_spectacular.types import OpenApiTypes
-from drf_spectacular.utils import extend_schema, OpenApiParameter
-from rest_framework import viewsets, status
+from drf_spectacular.utils import extend_schema
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
-from borrowing.models import Borrowing
+from borrowing.models import BookHold, Borrowing
+from borrowing.pagination import BorrowingPagination
 from borrowing.serializers import (
     BorrowingSerializer,
     BorrowingCreateSerializer,
     BorrowingReturnSerializer,
+    BorrowingBulkCreateSerializer,
+    BorrowingBulkReturnSerializer,
+    BookHoldSerializer,
 )
+from borrowing.filters import BORROWING_FILTER_PARAMETERS, filter_borrowings
+from library_service.conditional import (
+    conditional_response,
+    get_page_version,
+    get_version,
+)
+from library_service.exports import (
+    EXPORT_FORMAT_PARAMETER,
+    EXPORT_RESPONSES,
+    export_response,
+)
+from library_service.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+
+
+BORROWING_EXPORT_FIELDS = (
+    "id",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+    "book__id",
+    "book__title",
+    "user__id",
+    "user__email",
+    "updated_at",
+)
+# Everything BorrowingSerializer renders that can change. The user has no
+# modification date, so the email is part of the version instead.
+BORROWING_VERSION_FIELDS = ("updated_at", "book.updated_at", "user.email")
 
 
 class BorrowingViewSet(viewsets.ModelViewSet):
-    queryset = Borrowing.objects.all().select_related("book", "user")
+    queryset = (
+        Borrowing.objects.all()
+        .select_related("book", "user")
+        .defer("book__search_vector")
+    )
     serializer_class = BorrowingSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = BorrowingPagination
 
     def get_serializer_class(self):
         if self.action == "create":
             return BorrowingCreateSerializer
         if self.action == "return_borrowing":
             return BorrowingReturnSerializer
+        if self.action == "bulk_borrowing":
+            return BorrowingBulkCreateSerializer
+        if self.action == "bulk_return":
+            return BorrowingBulkReturnSerializer
         return BorrowingSerializer
 
     def get_queryset(self):
-        queryset = self.queryset
         is_active = self.request.query_params.get("is_active")
         user_id = self.request.query_params.get("user_id")
         user = self.request.user
-
-        if is_active:
-            if is_active.lower() == "true":
-                queryset = queryset.filter(actual_return_date__isnull=True)
-            if is_active.lower() == "false":
-                queryset = queryset.filter(actual_return_date__isnull=False)
-
-        if user_id and user.is_staff:
-            queryset = queryset.filter(user__id=user_id)
+        queryset = filter_borrowings(
+            self.queryset, is_active, user_id if user.is_staff else None
+        )
 
         if not user.is_staff:
             return queryset.filter(user=user).select_related("user")
@@ -48,7 +83,12 @@ class BorrowingViewSet(viewsets.ModelViewSet):
 
     @extend_schema(
         description="Create new borrowing." "Validate no pending and expired payments.",
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
     )
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         user = self.request.user
         serializer.save(user=user)
@@ -56,12 +96,14 @@ class BorrowingViewSet(viewsets.ModelViewSet):
     @extend_schema(
         description="Return borrowing by add actual_return_date."
         "Check borrowing overdue and if exist add overdue payments.",
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
     )
     @action(
         detail=True,
         methods=["POST"],
         url_path="return",
     )
+    @idempotent
     @atomic
     def return_borrowing(self, request, pk=None):
         borrowing = self.get_object()
@@ -76,22 +118,166 @@ class BorrowingViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @extend_schema(
-        parameters=[
-            OpenApiParameter(
-                name="user_id",
-                type=OpenApiTypes.STR,
-                description="Filter by user ID (ex. ?user_id=10). For admin only.",
-                required=False,
-            ),
-            OpenApiParameter(
-                name="is_active",
-                type=OpenApiTypes.STR,
-                description="Filter by active/returned borrowing status."
-                "(ex. ?is_active=true for active "
-                "and ?is_active=false for returned borrowings)",
-                required=False,
+        description="Borrow several books at once. "
+        "Validate no pending and expired payments once, reserve all books "
+        "with one update and pay for them in one Stripe session. "
+        "Returns the borrowing and payment or the error for every book.",
+    )
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="bulk",
+    )
+    def bulk_borrowing(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+
+        if not serializer.instance["created"]:
+            return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        description="Return several borrowings at once. "
+        "Fines for all overdue borrowings are paid in one Stripe session. "
+        "Returns the fine payment or the error for every borrowing.",
+    )
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="bulk-return",
+    )
+    def bulk_return(self, request):
+        serializer = BorrowingBulkReturnSerializer(
+            data=request.data,
+            context={"request": request, "queryset": self.get_queryset()},
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        if not serializer.instance["returned"]:
+            return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        description="List of borrowings ordered by borrow date. "
+        "Results are cursor paginated: follow the `next`/`previous` links "
+        "and use `page_size` to change the number of borrowings per page.",
+        parameters=BORROWING_FILTER_PARAMETERS,
+    )
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+
+        return conditional_response(
+            request,
+            get_page_version(self.paginator, page, *BORROWING_VERSION_FIELDS),
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data
             ),
-        ]
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        borrowing = self.get_object()
+
+        return conditional_response(
+            request,
+            get_version([borrowing], *BORROWING_VERSION_FIELDS),
+            lambda: Response(self.get_serializer(borrowing).data),
+            last_modified=max(borrowing.updated_at, borrowing.book.updated_at),
+        )
+
+    @extend_schema(
+        description="Download borrowings ordered by borrow date as a CSV or "
+        "NDJSON file, for admin only. The file is streamed while it is read "
+        "from the database, so exports of any size start at once.",
+        parameters=[*BORROWING_FILTER_PARAMETERS, EXPORT_FORMAT_PARAMETER],
+        responses=EXPORT_RESPONSES,
+    )
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="export",
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        return export_response(
+            request,
+            self.get_queryset().order_by("borrow_date", "id"),
+            BORROWING_EXPORT_FIELDS,
+            "borrowings",
+        )
+
+
+class BookHoldViewSet(
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.CreateModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    queryset = BookHold.objects.all()
+    serializer_class = BookHoldSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        queryset = self.queryset
+        user = self.request.user
+
+        if not user.is_staff:
+            queryset = queryset.filter(user=user)
+
+        if self.action in ("list", "retrieve"):
+            ahead = (
+                BookHold.objects.filter(
+                    book=OuterRef("book"), status=BookHold.StatusChoices.WAITING
+                )
+                .filter(
+                    Q(created_at__lt=OuterRef("created_at"))
+                    | Q(created_at=OuterRef("created_at"), id__lte=OuterRef("id"))
+                )
+                .order_by()
+                .values("book")
+                .annotate(count=Count("id"))
+                .values("count")
+            )
+            queryset = queryset.annotate(
+                position=Case(
+                    When(status=BookHold.StatusChoices.WAITING, then=Subquery(ahead))
+                )
+            )
+
+        return queryset
+
+    @extend_schema(
+        description="Put a hold on a book with no copies left. "
+        "Returned copies go to the holds in FIFO order: the hold becomes "
+        "`Ready` and the member can borrow the book until `claim_expires_at`, "
+        "after that the copy goes to the next hold.",
+    )
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @extend_schema(
+        description="List of user's book holds with their place in the queue. "
+        "Admin have access to all users holds.",
     )
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
+
+    @extend_schema(
+        description="Cancel a hold. A copy held for it goes to the next hold. "
+        "Holds that are already fulfilled, expired or cancelled can't be cancelled.",
+    )
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        if not instance.cancel():
+            raise ValidationError(
+                {"status": "Only waiting and ready holds can be cancelled."}
+            )
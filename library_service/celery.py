@@ -2,6 +2,8 @@ import os
 
 from celery import Celery
 
+from library_service import metrics  # noqa: F401 connects the task metrics signals
+
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
 
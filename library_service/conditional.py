@@ -0,0 +1,74 @@
+import hashlib
+from collections.abc import Callable, Iterable
+from datetime import datetime
+from operator import attrgetter
+
+from django.http import HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.pagination import BasePagination
+
+
+def get_version(objects: Iterable, *fields: str) -> str:
+    """Digest of the id and the updated_at fields of every object.
+
+    It changes whenever one of the objects is replaced or saved, so it
+    stands in for the serialized objects without serializing them.
+    """
+    getters = [attrgetter(field) for field in ("id", *fields)]
+    digest = hashlib.md5()
+
+    for obj in objects:
+        digest.update(repr([getter(obj) for getter in getters]).encode())
+
+    return digest.hexdigest()
+
+
+def get_page_version(paginator: BasePagination, page: list, *fields: str) -> str:
+    """Version of a page of objects and of its pagination links and count,
+    which change when objects are added or removed around the page."""
+    envelope = paginator.get_paginated_response([]).data
+
+    return hashlib.md5(
+        f"{get_version(page, *fields)}:{envelope!r}".encode()
+    ).hexdigest()
+
+
+def get_etag(request, version: str) -> str:
+    """Another page or format of the same objects is another representation,
+    so the URL and the renderer are part of the ETag."""
+    digest = hashlib.md5(
+        f"{request.get_full_path()}:{request.accepted_renderer.format}:{version}".encode()
+    )
+
+    return f'"{digest.hexdigest()}"'
+
+
+def conditional_response(
+    request,
+    version: str,
+    build: Callable[[], HttpResponseBase],
+    last_modified: datetime | None = None,
+) -> HttpResponseBase:
+    """Response with an ETag, and a Last-Modified date if given.
+
+    If the client's copy is still current, 304 Not Modified is returned
+    without calling build, so an unchanged resource is not serialized.
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    etag = get_etag(request, version)
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()),
+    )
+
+    if response is None:
+        response = build()
+
+    response["ETag"] = etag
+
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+
+    return response
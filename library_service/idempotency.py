@@ -0,0 +1,154 @@
+import hashlib
+import json
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+from library_service import settings
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    name=IDEMPOTENCY_HEADER,
+    type=OpenApiTypes.STR,
+    location=OpenApiParameter.HEADER,
+    description="Unique key of the request (ex. a UUID). Retries with the same "
+    "key get the first response back instead of running again.",
+    required=False,
+)
+
+
+class IdempotentRequest:
+    """Cache entries of one Idempotency-Key, scoped to the user and the view.
+
+    The first request takes a lock with cache.add, so a duplicate sent while
+    it is still running gets 409 instead of doing the work twice. Responses
+    below 500 are stored for IDEMPOTENCY_KEY_TTL seconds and replayed for
+    every duplicate with the same payload.
+    """
+
+    def __init__(self, request, key: str):
+        scope = hashlib.sha256(
+            f"{request.user.pk}:{request.method}:{request.path}:{key}".encode()
+        ).hexdigest()
+        self.response_key = f"idempotency:response:{scope}"
+        self.lock_key = f"idempotency:lock:{scope}"
+        self.fingerprint = hashlib.sha256(
+            json.dumps(request.data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def replay(self, stored: dict) -> Response:
+        if stored["fingerprint"] != self.fingerprint:
+            return Response(
+                {
+                    "detail": f"{IDEMPOTENCY_HEADER} was already used "
+                    "with a different request."
+                },
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+
+        response = Response(stored["data"], status=stored["status"])
+        response[REPLAYED_HEADER] = "true"
+
+        return response
+
+    def to_store(self, response: Response) -> dict | None:
+        if response.status_code >= 500:
+            return None
+
+        return {
+            "fingerprint": self.fingerprint,
+            "status": response.status_code,
+            "data": response.data,
+        }
+
+    @staticmethod
+    def in_progress() -> Response:
+        return Response(
+            {"detail": "A request with this Idempotency-Key is in progress."},
+            status=status.HTTP_409_CONFLICT,
+        )
+
+
+def get_request_key(request) -> str | None:
+    key = request.headers.get(IDEMPOTENCY_HEADER, "").strip()
+
+    return key[:MAX_KEY_LENGTH] or None
+
+
+def idempotent(view_method):
+    """Replay the stored response of a view action for a repeated Idempotency-Key.
+
+    Requests without the header run as usual. Works for sync and async
+    actions; apply it outside @atomic, so the response is stored only after
+    the transaction has committed.
+    """
+    if iscoroutinefunction(view_method):
+
+        @wraps(view_method)
+        async def wrapper(self, request, *args, **kwargs):
+            key = get_request_key(request)
+            if key is None:
+                return await view_method(self, request, *args, **kwargs)
+
+            entry = IdempotentRequest(request, key)
+            stored = await cache.aget(entry.response_key)
+            if stored is not None:
+                return entry.replay(stored)
+            if not await cache.aadd(
+                entry.lock_key, True, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT
+            ):
+                return entry.in_progress()
+
+            try:
+                response = await view_method(self, request, *args, **kwargs)
+                if to_store := entry.to_store(response):
+                    await cache.aset(
+                        entry.response_key,
+                        to_store,
+                        timeout=settings.IDEMPOTENCY_KEY_TTL,
+                    )
+            finally:
+                await cache.adelete(entry.lock_key)
+
+            return response
+
+    else:
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = get_request_key(request)
+            if key is None:
+                return view_method(self, request, *args, **kwargs)
+
+            entry = IdempotentRequest(request, key)
+            stored = cache.get(entry.response_key)
+            if stored is not None:
+                return entry.replay(stored)
+            if not cache.add(
+                entry.lock_key, True, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT
+            ):
+                return entry.in_progress()
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+                if to_store := entry.to_store(response):
+                    cache.set(
+                        entry.response_key,
+                        to_store,
+                        timeout=settings.IDEMPOTENCY_KEY_TTL,
+                    )
+            finally:
+                cache.delete(entry.lock_key)
+
+            return response
+
+    return wrapper
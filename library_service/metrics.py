@@ -0,0 +1,268 @@
+import hmac
+import ipaddress
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_ready,
+)
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+from library_service import settings
+from library_service.query_counter import QueryCounter
+
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf"))
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by view and action.",
+    ["view", "method", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL queries run while handling a request.",
+    ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in SQL while handling a request.",
+    ["view"],
+)
+REQUEST_EXTERNAL_DURATION = Histogram(
+    "http_request_external_duration_seconds",
+    "Time spent calling an external service while handling a request.",
+    ["view", "service"],
+)
+EXTERNAL_CALL_DURATION = Histogram(
+    "external_call_duration_seconds",
+    "Duration of calls to external services such as Stripe and Telegram.",
+    ["service"],
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Celery task run time.",
+    ["task", "state"],
+)
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Time between publishing a Celery task and a worker starting it.",
+    ["task"],
+)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = QueryCounter()
+        self.external = Counter()
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    request_metrics = current_request.get()
+
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+
+    return request_metrics.queries(execute, sql, params, many, context)
+
+
+def instrument_connection(connection) -> None:
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(
+    lambda sender, connection, **kwargs: instrument_connection(connection),
+    weak=False,
+    dispatch_uid="library_service.metrics",
+)
+
+
+@contextmanager
+def track_external(service: str):
+    """Time a call to an external service, also per request when in one."""
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        EXTERNAL_CALL_DURATION.labels(service).observe(duration)
+        request_metrics = current_request.get()
+
+        if request_metrics is not None:
+            request_metrics.external[service] += duration
+
+
+def get_view_name(request) -> str:
+    """Name a request by its view class and action, e.g. BookViewSet.list."""
+    match = getattr(request, "resolver_match", None)
+
+    if match is None:
+        return "unresolved"
+
+    func = match.func
+    view_class = getattr(func, "cls", None) or getattr(func, "view_class", None)
+
+    if view_class is None:
+        return match.view_name or f"{func.__module__}.{func.__name__}"
+
+    method = request.method.lower()
+    actions = getattr(func, "actions", None) or {}
+
+    return f"{view_class.__name__}.{actions.get(method, method)}"
+
+
+class MetricsMiddleware:
+    """Record latency, SQL and external call time for every request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        started = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        self.observe(request, response, request_metrics, started)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        started = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        self.observe(request, response, request_metrics, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, request_metrics, started) -> None:
+        view = get_view_name(request)
+
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        REQUEST_DB_QUERIES.labels(view).observe(request_metrics.queries.count)
+        REQUEST_DB_DURATION.labels(view).observe(request_metrics.queries.duration)
+
+        for service, duration in request_metrics.external.items():
+            REQUEST_EXTERNAL_DURATION.labels(view, service).observe(duration)
+
+
+def get_registry() -> CollectorRegistry:
+    """Aggregate all worker processes when PROMETHEUS_MULTIPROC_DIR is set."""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+
+    return registry
+
+
+def is_metrics_client(request) -> bool:
+    """Whether the request comes from METRICS_ALLOWED_IPS or carries
+    METRICS_TOKEN, as the metrics show traffic and internals of the service."""
+    authorization = request.headers.get("Authorization", "")
+
+    if settings.METRICS_TOKEN and hmac.compare_digest(
+        authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+    ):
+        return True
+
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def metrics_view(request):
+    if not is_metrics_client(request):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+@before_task_publish.connect(weak=False)
+def add_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+@task_prerun.connect(weak=False)
+def start_task_timer(task=None, **kwargs):
+    published_at = getattr(task.request, "published_at", None)
+
+    if published_at is not None:
+        TASK_QUEUE_WAIT.labels(task.name).observe(max(time.time() - published_at, 0))
+
+    task.request.metrics_started = time.perf_counter()
+
+
+@task_postrun.connect(weak=False)
+def observe_task_duration(task=None, state=None, **kwargs):
+    started = getattr(task.request, "metrics_started", None)
+
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started
+        )
+
+
+@worker_ready.connect(weak=False)
+def start_worker_metrics_server(**kwargs):
+    port = os.getenv("CELERY_METRICS_PORT")
+
+    if port:
+        start_http_server(int(port), registry=get_registry())
@@ -0,0 +1,25 @@
+import time
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run on a connection and their time.
+
+    Usage:
+        with connection.execute_wrapper(counter := QueryCounter()):
+            ...
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+            self.queries.append(sql)
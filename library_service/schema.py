@@ -0,0 +1,119 @@
+import hashlib
+from pathlib import Path
+from threading import Lock
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.http import require_safe
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+from library_service import settings
+
+
+SCHEMA_RENDERERS = {
+    "yaml": OpenApiYamlRenderer,
+    "json": OpenApiJsonRenderer,
+}
+
+_schemas: dict[str, tuple[bytes, str]] = {}
+_lock = Lock()
+
+
+def render_schema() -> dict[str, bytes]:
+    """Generate the OpenAPI schema and render it in every format."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF
+    )
+    schema = generator.get_schema(request=None, public=True)
+
+    return {
+        schema_format: renderer().render(schema, renderer_context={})
+        for schema_format, renderer in SCHEMA_RENDERERS.items()
+    }
+
+
+def get_schema_path(schema_format: str) -> Path:
+    return Path(settings.API_SCHEMA_DIR) / f"openapi.{schema_format}"
+
+
+def write_schema() -> list[Path]:
+    paths = []
+    Path(settings.API_SCHEMA_DIR).mkdir(parents=True, exist_ok=True)
+
+    for schema_format, content in render_schema().items():
+        path = get_schema_path(schema_format)
+        path.write_bytes(content)
+        paths.append(path)
+
+    return paths
+
+
+def load_schemas() -> dict[str, tuple[bytes, str]]:
+    """Schema files written by generate_schema, or a schema rendered now if
+    they are missing, with the ETag of each format."""
+    paths = {
+        schema_format: get_schema_path(schema_format)
+        for schema_format in SCHEMA_RENDERERS
+    }
+
+    if all(path.is_file() for path in paths.values()):
+        contents = {
+            schema_format: path.read_bytes() for schema_format, path in paths.items()
+        }
+    else:
+        contents = render_schema()
+
+    return {
+        schema_format: (content, f'"{hashlib.sha256(content).hexdigest()}"')
+        for schema_format, content in contents.items()
+    }
+
+
+def get_schema(schema_format: str) -> tuple[bytes, str]:
+    """Content and ETag of the schema, loaded once per process."""
+    if not _schemas:
+        with _lock:
+            if not _schemas:
+                _schemas.update(load_schemas())
+
+    return _schemas[schema_format]
+
+
+def clear_schema_cache() -> None:
+    _schemas.clear()
+
+
+def get_schema_format(request) -> str:
+    if request.GET.get("format") in SCHEMA_RENDERERS:
+        return request.GET["format"]
+
+    if "json" in request.headers.get("Accept", ""):
+        return "json"
+
+    return "yaml"
+
+
+@require_safe
+def schema_view(request):
+    """OpenAPI schema generated once per deploy rather than on every request.
+
+    Served with an ETag, so clients revalidating an unchanged schema get
+    304 Not Modified, and cached for API_SCHEMA_MAX_AGE seconds.
+    """
+    schema_format = get_schema_format(request)
+    content, etag = get_schema(schema_format)
+    renderer = SCHEMA_RENDERERS[schema_format]
+    content_type = renderer.media_type
+
+    if renderer.charset:
+        content_type += f"; charset={renderer.charset}"
+
+    response = get_conditional_response(request, etag=etag) or HttpResponse(
+        content, content_type=content_type
+    )
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.API_SCHEMA_MAX_AGE}"
+    patch_vary_headers(response, ("Accept",))
+
+    return response
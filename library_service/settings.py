@@ -44,16 +44,19 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "book",
     "user",
     "borrowing",
     "django_celery_beat",
     "payment",
+    "reports",
     "drf_spectacular",
 ]
 
 MIDDLEWARE = [
+    "library_service.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -87,6 +90,12 @@ WSGI_APPLICATION = "library_service.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# DB_POOL=true uses the psycopg connection pool of each process (recommended
+# for the ASGI profile). Otherwise connections persist for DB_CONN_MAX_AGE
+# seconds. Behind PgBouncer in transaction mode set DB_POOL=false,
+# DB_CONN_MAX_AGE=0 and DB_DISABLE_SERVER_SIDE_CURSORS=true.
+DB_POOL = os.getenv("DB_POOL", "false").lower() == "true"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -95,9 +104,50 @@ DATABASES = {
         "NAME": os.environ["POSTGRES_NAME"],
         "USER": os.environ["POSTGRES_USER"],
         "PASSWORD": os.environ["POSTGRES_PASSWORD"],
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": (
+            os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS", "false").lower() == "true"
+        ),
+        "OPTIONS": {},
     }
 }
 
+if DB_POOL:
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+        "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_CACHE_URL = os.getenv("REDIS_CACHE_URL")
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+BOOK_CACHE_TIMEOUT = int(os.getenv("BOOK_CACHE_TIMEOUT", 15 * 60))
+BOOK_LOCAL_CACHE_TTL = float(os.getenv("BOOK_LOCAL_CACHE_TTL", 5))
+BOOK_LOCAL_CACHE_SIZE = int(os.getenv("BOOK_LOCAL_CACHE_SIZE", 256))
+
+# Responses stored for replaying requests with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -153,6 +203,16 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 20))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 100))
+BORROWING_BULK_MAX_ITEMS = int(os.getenv("BORROWING_BULK_MAX_ITEMS", 30))
+# Rows fetched from the server-side cursor and sent per chunk by exports
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+# Longest period a report may cover
+REPORTS_MAX_DAYS = int(os.getenv("REPORTS_MAX_DAYS", 366))
+# Hours a member has to borrow a copy returned for their book hold
+BOOK_HOLD_CLAIM_HOURS = int(os.getenv("BOOK_HOLD_CLAIM_HOURS", 48))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=120),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -164,12 +224,64 @@ CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_TIMEZONE = "Europe/Kyiv"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# Run tasks in the calling process, e.g. for local benchmarks without a worker
+CELERY_TASK_ALWAYS_EAGER = (
+    os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() == "true"
+)
+CELERY_TASK_ROUTES = {
+    "borrowing.tasks.send_notifications": {"queue": "notifications"},
+}
+CELERY_BEAT_SCHEDULE = {
+    "refresh-report-rollups": {
+        "task": "reports.tasks.refresh_report_rollups",
+        "schedule": int(os.getenv("REPORTS_REFRESH_INTERVAL", 15 * 60)),
+    },
+    "expire-book-holds": {
+        "task": "borrowing.tasks.expire_book_holds",
+        "schedule": int(os.getenv("BOOK_HOLD_EXPIRY_INTERVAL", 15 * 60)),
+    },
+    "send-notifications": {
+        "task": "borrowing.tasks.send_notifications",
+        "schedule": int(os.getenv("NOTIFICATION_SEND_INTERVAL", 5 * 60)),
+    },
+    "expire-stale-payments": {
+        "task": "payment.tasks.expire_stale_payments",
+        "schedule": int(os.getenv("PAYMENT_SWEEP_INTERVAL", 5 * 60)),
+    },
+}
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+STRIPE_TIMEOUT = int(os.getenv("STRIPE_TIMEOUT", 10))
+# Stripe allows 100 read requests per second in live mode and 25 in test mode.
+STRIPE_RATE_LIMIT = float(os.getenv("STRIPE_RATE_LIMIT", 20))
+STRIPE_RECONCILE_WORKERS = int(os.getenv("STRIPE_RECONCILE_WORKERS", 8))
+STRIPE_RECONCILE_BATCH_SIZE = int(os.getenv("STRIPE_RECONCILE_BATCH_SIZE", 500))
+# Payments still creating a checkout session after this many seconds are
+# expired, well after the session task has used up its retries.
+PAYMENT_CREATING_TIMEOUT = int(os.getenv("PAYMENT_CREATING_TIMEOUT", 15 * 60))
+
+# /metrics is served to these addresses or networks, and to requests with
+# "Authorization: Bearer <METRICS_TOKEN>" when the token is set.
+METRICS_ALLOWED_IPS = [
+    address.strip()
+    for address in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+    if address.strip()
+]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# OpenAPI schema files written by `manage.py generate_schema` on deploy
+API_SCHEMA_DIR = os.getenv("API_SCHEMA_DIR") or BASE_DIR / "schema"
+API_SCHEMA_MAX_AGE = int(os.getenv("API_SCHEMA_MAX_AGE", 300))
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library service API",
     "DESCRIPTION": "Documentation for Library service API",
     "VERSION": "1.0.0",
     "SERVE_INCLUDE_SCHEMA": False,
+    "ENUM_NAME_OVERRIDES": {
+        "PaymentStatusEnum": "payment.models.Payment.StatusChoices",
+        "BookHoldStatusEnum": "borrowing.models.BookHold.StatusChoices",
+    },
 }
@@ -0,0 +1,305 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from book.cache import clear_catalog_cache
+from book.models import Book
+from book.tests import BOOK_URL
+from borrowing.models import Borrowing
+from borrowing.tasks import check_borrowings
+from borrowing.tests import BORROWING_URL, sample_borrowing, sample_user
+from library_service.metrics import RequestMetrics, current_request, track_external
+from library_service.schema import clear_schema_cache, render_schema
+from payment.models import Payment
+
+
+METRICS_URL = reverse("metrics")
+PAYMENT_URL = reverse("payment:payment-list")
+SCHEMA_URL = reverse("schema")
+
+# Most queries a list or detail endpoint may run, whatever the number of rows.
+# Authentication is forced, so token and user lookups are not counted.
+QUERY_BUDGETS = {
+    "BookViewSet.list": 1,
+    "BookViewSet.retrieve": 1,
+    "BorrowingViewSet.list": 1,
+    "BorrowingViewSet.retrieve": 1,
+    "PaymentViewSet.list": 1,
+    "PaymentViewSet.retrieve": 1,
+}
+
+
+def sample_value(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_request_metrics_by_view_and_action(self):
+        user = sample_user()
+        sample_borrowing(user)
+        self.client.force_authenticate(user)
+        labels = {"view": "BorrowingViewSet.list"}
+        requests_before = sample_value("http_request_db_queries_count", **labels)
+        queries_before = sample_value("http_request_db_queries_sum", **labels)
+
+        res = self.client.get(BORROWING_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sample_value("http_request_db_queries_count", **labels),
+            requests_before + 1,
+        )
+        self.assertGreater(
+            sample_value("http_request_db_queries_sum", **labels), queries_before
+        )
+        self.assertGreater(
+            sample_value(
+                "http_request_duration_seconds_count",
+                method="GET",
+                status="200",
+                **labels,
+            ),
+            0,
+        )
+
+    def test_external_calls_are_added_to_the_current_request(self):
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        calls_before = sample_value(
+            "external_call_duration_seconds_count", service="stripe"
+        )
+
+        try:
+            with track_external("stripe"):
+                pass
+        finally:
+            current_request.reset(token)
+
+        self.assertIn("stripe", request_metrics.external)
+        self.assertEqual(
+            sample_value("external_call_duration_seconds_count", service="stripe"),
+            calls_before + 1,
+        )
+
+    def test_celery_task_duration(self):
+        labels = {"task": check_borrowings.name, "state": "SUCCESS"}
+        runs_before = sample_value("celery_task_duration_seconds_count", **labels)
+
+        check_borrowings.apply()
+
+        self.assertEqual(
+            sample_value("celery_task_duration_seconds_count", **labels),
+            runs_before + 1,
+        )
+
+    def test_metrics_endpoint(self):
+        self.client.get(BOOK_URL)
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(b'view="BookViewSet.list"', res.content)
+        self.assertIn(b"celery_task_queue_wait_seconds", res.content)
+
+    def test_metrics_endpoint_rejects_other_addresses(self):
+        res = self.client.get(METRICS_URL, REMOTE_ADDR="203.0.113.7")
+
+        with patch("library_service.metrics.settings.METRICS_TOKEN", "secret"):
+            res2 = self.client.get(
+                METRICS_URL,
+                REMOTE_ADDR="203.0.113.7",
+                HTTP_AUTHORIZATION="Bearer wrong",
+            )
+            res3 = self.client.get(
+                METRICS_URL,
+                REMOTE_ADDR="203.0.113.7",
+                HTTP_AUTHORIZATION="Bearer secret",
+            )
+
+        with patch(
+            "library_service.metrics.settings.METRICS_ALLOWED_IPS", ["203.0.113.0/24"]
+        ):
+            res4 = self.client.get(METRICS_URL, REMOTE_ADDR="203.0.113.7")
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(res2.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(res3.status_code, status.HTTP_200_OK)
+        self.assertEqual(res4.status_code, status.HTTP_200_OK)
+
+
+class QueryBudgetTests(TestCase):
+    """Every endpoint stays within its budget with 1 and with 500 rows."""
+
+    SIZES = (1, 500)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email="budget@test.com", password="TestUser"
+        )
+        cls.admin = get_user_model().objects.create_superuser(
+            email="budget-admin@test.com", password="TestUser"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seeded = 0
+
+    def seed(self, count: int) -> None:
+        expected_return_date = timezone.now() + timedelta(days=7)
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"Budget book {self.seeded + i}",
+                author="Author",
+                cover="Hard",
+                inventory=5,
+                daily_fee=1,
+            )
+            for i in range(count)
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book, user=self.user, expected_return_date=expected_return_date
+            )
+            for book in books
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                borrowing=borrowing,
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+                session_url="https://checkout.stripe.test/pay",
+                session_id=f"cs_budget_{borrowing.id}",
+                money_to_pay=1,
+            )
+            for borrowing in borrowings
+        )
+        self.seeded += count
+
+    def assertQueryBudget(self, view: str, get_url, users=(None,)) -> None:
+        budget = QUERY_BUDGETS[view]
+
+        for size in self.SIZES:
+            self.seed(size - self.seeded)
+            url = get_url()
+
+            for user in users:
+                self.client.force_authenticate(user)
+                clear_catalog_cache()
+
+                with CaptureQueriesContext(connection) as context:
+                    res = self.client.get(url)
+
+                self.assertEqual(res.status_code, status.HTTP_200_OK, url)
+
+                if len(context.captured_queries) > budget:
+                    queries = "\n".join(
+                        f"{number}. {query['sql']}"
+                        for number, query in enumerate(context.captured_queries, 1)
+                    )
+                    self.fail(
+                        f"{view} ran {len(context.captured_queries)} queries "
+                        f"with {size} rows for {user}, budget is {budget}:\n"
+                        f"{queries}"
+                    )
+
+    def test_book_list(self):
+        self.assertQueryBudget("BookViewSet.list", lambda: BOOK_URL)
+
+    def test_book_retrieve(self):
+        self.assertQueryBudget(
+            "BookViewSet.retrieve",
+            lambda: reverse("book:book-detail", args=[Book.objects.last().id]),
+        )
+
+    def test_borrowing_list(self):
+        self.assertQueryBudget(
+            "BorrowingViewSet.list", lambda: BORROWING_URL, (self.user, self.admin)
+        )
+
+    def test_borrowing_retrieve(self):
+        self.assertQueryBudget(
+            "BorrowingViewSet.retrieve",
+            lambda: reverse(
+                "borrowing:borrowing-detail", args=[Borrowing.objects.last().id]
+            ),
+            (self.user,),
+        )
+
+    def test_payment_list(self):
+        self.assertQueryBudget(
+            "PaymentViewSet.list", lambda: PAYMENT_URL, (self.user, self.admin)
+        )
+
+    def test_payment_retrieve(self):
+        self.assertQueryBudget(
+            "PaymentViewSet.retrieve",
+            lambda: reverse("payment:payment-detail", args=[Payment.objects.last().id]),
+            (self.user,),
+        )
+
+
+class SchemaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.schema_dir = TemporaryDirectory()
+        patcher = patch(
+            "library_service.schema.settings.API_SCHEMA_DIR", self.schema_dir.name
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.schema_dir.cleanup)
+        self.addCleanup(clear_schema_cache)
+        clear_schema_cache()
+
+    def test_schema_rendered_once(self):
+        with patch(
+            "library_service.schema.render_schema", wraps=render_schema
+        ) as render:
+            res = self.client.get(SCHEMA_URL)
+            res2 = self.client.get(SCHEMA_URL, {"format": "json"})
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(
+            res["Content-Type"], "application/vnd.oai.openapi; charset=utf-8"
+        )
+        self.assertIn("/api/borrowings/export/", json.loads(res2.content)["paths"])
+
+    def test_schema_not_modified(self):
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT="application/json")
+        res2 = self.client.get(
+            SCHEMA_URL, HTTP_ACCEPT="application/json", HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+
+        self.assertEqual(res["Content-Type"], "application/vnd.oai.openapi+json")
+        self.assertEqual(res["Cache-Control"], "public, max-age=300")
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2.content, b"")
+
+    def test_generate_schema_command(self):
+        call_command("generate_schema", stdout=StringIO())
+        path = Path(self.schema_dir.name) / "openapi.yaml"
+        path.write_bytes(path.read_bytes() + b"# deployed\n")
+
+        with patch("library_service.schema.render_schema") as render:
+            res = self.client.get(SCHEMA_URL)
+
+        render.assert_not_called()
+        self.assertEqual(res.content, path.read_bytes())
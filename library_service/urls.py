@@ -17,14 +17,14 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-    SpectacularRedocView,
-)
+from drf_spectacular.views import SpectacularSwaggerView, SpectacularRedocView
+
+from library_service.metrics import metrics_view
+from library_service.schema import schema_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
     path(
         "api/books/",
         include("book.urls", namespace="book"),
@@ -32,7 +32,8 @@ urlpatterns = [
     path("api/users/", include("user.urls", namespace="user")),
     path("api/borrowings/", include("borrowing.urls", namespace="borrowing")),
     path("api/payments/", include("payment.urls", namespace="payment")),
-    path("api/doc/", SpectacularAPIView.as_view(), name="schema"),
+    path("api/reports/", include("reports.urls", namespace="reports")),
+    path("api/doc/", schema_view, name="schema"),
     path(
         "api/doc/swagger/",
         SpectacularSwaggerView.as_view(url_name="schema"),
@@ -1,6 +1,11 @@
 from django.contrib import admin
 
-from payment.models import Payment
+from payment.models import Payment, PaymentSummary
 
 
-admin.site.register(Payment)
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_select_related = ("borrowing__user",)
+
+
+admin.site.register(PaymentSummary)
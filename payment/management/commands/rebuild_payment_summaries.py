@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payment.models import PaymentSummary
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-user payment summaries from the payment table. "
+        "With --verify only report summaries that differ from the payments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def get_mismatches(self) -> list[int]:
+        computed = PaymentSummary.compute()
+        stored = {
+            summary.user_id: (summary.open_payments, summary.blocking_payment_id)
+            for summary in PaymentSummary.objects.all()
+        }
+
+        return sorted(
+            user_id
+            for user_id in set(computed) | set(stored)
+            if computed.get(user_id, (0, None)) != stored.get(user_id, (0, None))
+        )
+
+    def handle(self, *args, **options):
+        mismatches = self.get_mismatches()
+
+        if options["verify"]:
+            if mismatches:
+                raise CommandError(
+                    f"{len(mismatches)} payment summaries are out of date, "
+                    f"users: {mismatches[:20]}"
+                )
+
+            self.stdout.write(self.style.SUCCESS("Payment summaries are up to date."))
+            return
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(mismatches), batch_size):
+            PaymentSummary.refresh(mismatches[start : start + batch_size])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {len(mismatches)} payment summaries.")
+        )
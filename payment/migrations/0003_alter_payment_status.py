@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payment", "0002_alter_payment_session_url"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("Creating", "Creating"),
+                    ("Pending", "Pending"),
+                    ("Paid", "Paid"),
+                    ("Expired", "Expired"),
+                ],
+                max_length=15,
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0008_borrowing_borrowing_active_user_idx_and_more"),
+        ("payment", "0003_alter_payment_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status__in", ("Creating", "Pending", "Expired"))),
+                fields=["status", "borrowing"],
+                name="payment_open_status_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("session_id", ""), _negated=True),
+                fields=("session_id",),
+                name="payment_session_id_unique",
+            ),
+        ),
+    ]
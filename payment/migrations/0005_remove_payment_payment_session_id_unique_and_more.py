@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0008_borrowing_borrowing_active_user_idx_and_more"),
+        ("payment", "0004_payment_payment_open_status_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="payment",
+            name="payment_session_id_unique",
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("session_id", ""), _negated=True),
+                fields=["session_id"],
+                name="payment_session_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def build_payment_summaries(apps, schema_editor):
+    Payment = apps.get_model("payment", "Payment")
+    PaymentSummary = apps.get_model("payment", "PaymentSummary")
+    rows = (
+        Payment.objects.filter(status__in=("Creating", "Pending", "Expired"))
+        .values("borrowing__user")
+        .annotate(open_payments=Count("id"), blocking_payment=Min("id"))
+        .order_by()
+    )
+    PaymentSummary.objects.bulk_create(
+        PaymentSummary(
+            user_id=row["borrowing__user"],
+            open_payments=row["open_payments"],
+            blocking_payment_id=row["blocking_payment"],
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payment", "0005_remove_payment_payment_session_id_unique_and_more"),
+        ("user", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="payment_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("open_payments", models.PositiveIntegerField(default=0)),
+                (
+                    "blocking_payment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="payment.payment",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "payment summaries",
+            },
+        ),
+        migrations.RunPython(build_payment_summaries, migrations.RunPython.noop),
+    ]
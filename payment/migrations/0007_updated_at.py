@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 22:02
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0010_updated_at"),
+        ("payment", "0006_paymentsummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_default=django.db.models.functions.datetime.Now()
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["updated_at"], name="payment_updated_at_idx"),
+        ),
+    ]
@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Min
+from django.db.models.functions import Now
 
 from borrowing.models import Borrowing
+from library_service import settings
 
 
 class Payment(models.Model):
     class StatusChoices(models.TextChoices):
+        CREATING = "Creating"
         PENDING = "Pending"
         PAID = "Paid"
         EXPIRED = "Expired"
@@ -19,8 +23,117 @@ class Payment(models.Model):
     session_url = models.URLField(max_length=500)
     session_id = models.CharField(max_length=255)
     money_to_pay = models.DecimalField(max_digits=5, decimal_places=2)
+    # Set by the bulk update paths too; reports are refreshed from it.
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("session_id",),
+                condition=~models.Q(session_id=""),
+                name="payment_session_id_idx",
+            ),
+            models.Index(
+                fields=("status", "borrowing"),
+                condition=models.Q(status__in=("Creating", "Pending", "Expired")),
+                name="payment_open_status_idx",
+            ),
+            models.Index(fields=("updated_at",), name="payment_updated_at_idx"),
+        ]
 
     def __str__(self):
         return (
             f"Payment id {self.id}, status {self.status} by user {self.borrowing.user}"
         )
+
+    def save(self, *args, **kwargs) -> None:
+        super().save(*args, **kwargs)
+        PaymentSummary.refresh([self.borrowing.user_id])
+
+
+OPEN_STATUSES = (
+    Payment.StatusChoices.CREATING,
+    Payment.StatusChoices.PENDING,
+    Payment.StatusChoices.EXPIRED,
+)
+
+
+class PaymentSummary(models.Model):
+    """Open payments of a user, kept up to date wherever a status changes.
+
+    The borrowing gate reads this row by primary key instead of scanning
+    the user's payments.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="payment_summary",
+    )
+    open_payments = models.PositiveIntegerField(default=0)
+    blocking_payment = models.ForeignKey(
+        Payment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    class Meta:
+        verbose_name_plural = "payment summaries"
+
+    def __str__(self):
+        return f"User {self.user_id} has {self.open_payments} open payments"
+
+    @staticmethod
+    def compute(user_ids=None) -> dict[int, tuple[int, int]]:
+        payments = Payment.objects.filter(status__in=OPEN_STATUSES)
+
+        if user_ids is not None:
+            payments = payments.filter(borrowing__user__in=user_ids)
+
+        rows = (
+            payments.values("borrowing__user")
+            .annotate(open_payments=Count("id"), blocking_payment=Min("id"))
+            .order_by()
+        )
+
+        return {
+            row["borrowing__user"]: (row["open_payments"], row["blocking_payment"])
+            for row in rows
+        }
+
+    @staticmethod
+    def refresh(user_ids) -> None:
+        """Recompute the summaries of the given users from their payments.
+
+        Must run in the transaction that changed the payments. The summary
+        rows are locked before the payments are counted, so a concurrent
+        refresh of the same user waits and then counts the committed state.
+        """
+        user_ids = sorted(set(user_ids))
+
+        if not user_ids:
+            return
+
+        with transaction.atomic(savepoint=False):
+            PaymentSummary.objects.bulk_create(
+                [PaymentSummary(user_id=user_id) for user_id in user_ids],
+                ignore_conflicts=True,
+            )
+            summaries = list(
+                PaymentSummary.objects.select_for_update()
+                .filter(user__in=user_ids)
+                .order_by("user")
+            )
+            computed = PaymentSummary.compute(user_ids)
+
+            for summary in summaries:
+                summary.open_payments, summary.blocking_payment_id = computed.get(
+                    summary.user_id, (0, None)
+                )
+
+            PaymentSummary.objects.bulk_update(
+                summaries, ("open_payments", "blocking_payment")
+            )
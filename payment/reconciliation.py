@@ -0,0 +1,148 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import stripe
+from django.core.cache import cache
+
+from library_service import settings
+from library_service.metrics import track_external
+from payment.models import Payment
+from payment.stripe_payment import apply_session_statuses, get_session_status
+
+
+CHECKPOINT_KEY = "payment:reconciliation:checkpoint"
+LOCK_KEY = "payment:reconciliation:lock"
+CHECKPOINT_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 60 * 60
+MAX_ATTEMPTS = 4
+BACKOFF_FACTOR = 0.5
+TRANSIENT_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class SessionReconciler:
+    """Fetch the Stripe status of every pending payment session in parallel.
+
+    Pending payments are read in id order, one batch at a time. The sessions
+    of a batch are retrieved by a bounded thread pool behind a token bucket,
+    then applied with apply_session_statuses and the last payment id is
+    saved as a checkpoint, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.STRIPE_RECONCILE_BATCH_SIZE,
+        workers: int = settings.STRIPE_RECONCILE_WORKERS,
+        rate: float = settings.STRIPE_RATE_LIMIT,
+    ):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.stats = Counter()
+        self._stats_lock = Lock()
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def retrieve_status(self, session_id: str) -> str | None:
+        for attempt in range(MAX_ATTEMPTS):
+            self.bucket.acquire()
+
+            try:
+                with track_external("stripe"):
+                    session = stripe.checkout.Session.retrieve(session_id)
+            except TRANSIENT_ERRORS:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                self.count("retries")
+                time.sleep(BACKOFF_FACTOR * 2**attempt)
+                continue
+
+            return get_session_status(session)
+
+    def fetch_status(self, session_id: str) -> tuple[str, str | None]:
+        try:
+            return session_id, self.retrieve_status(session_id)
+        except stripe.StripeError:
+            self.count("errors")
+            return session_id, None
+
+    def get_batch(self, after_id: int) -> list[tuple[int, str]]:
+        return list(
+            Payment.objects.filter(
+                status=Payment.StatusChoices.PENDING, id__gt=after_id
+            )
+            .exclude(session_id="")
+            .order_by("id")
+            .values_list("id", "session_id")[: self.batch_size]
+        )
+
+    def run(self) -> dict:
+        if not cache.add(LOCK_KEY, True, timeout=LOCK_TIMEOUT):
+            return {"skipped": "another reconciliation is running"}
+
+        started = time.perf_counter()
+        checkpoint = resumed_from = cache.get(CHECKPOINT_KEY, 0)
+
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                while batch := self.get_batch(checkpoint):
+                    session_ids = list(dict.fromkeys(session for _, session in batch))
+                    statuses = {
+                        session_id: session_status
+                        for session_id, session_status in executor.map(
+                            self.fetch_status, session_ids
+                        )
+                        if session_status
+                    }
+
+                    self.count("sessions", len(session_ids))
+                    self.count("updated", apply_session_statuses(statuses))
+                    checkpoint = batch[-1][0]
+                    cache.set(CHECKPOINT_KEY, checkpoint, timeout=CHECKPOINT_TIMEOUT)
+
+            cache.delete(CHECKPOINT_KEY)
+        finally:
+            cache.delete(LOCK_KEY)
+
+        duration = time.perf_counter() - started
+
+        return {
+            "sessions": self.stats["sessions"],
+            "updated": self.stats["updated"],
+            "errors": self.stats["errors"],
+            "retries": self.stats["retries"],
+            "resumed_from": resumed_from,
+            "duration": round(duration, 3),
+            "throughput": round(self.stats["sessions"] / duration, 1),
+        }
@@ -1,57 +1,378 @@
+import asyncio
+import hashlib
+import json
 from decimal import Decimal
 
 import stripe
+from django.db import transaction
+from django.db.models import QuerySet
 from django.urls import reverse
+from django.utils import timezone
+from kombu.exceptions import OperationalError
 from rest_framework.request import Request
 
 from borrowing.models import Borrowing
+from borrowing.telegram_notifications import enqueue_message
 from library_service import settings
-from payment.models import Payment
+from library_service.metrics import track_external
+from payment.models import Payment, PaymentSummary
 
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.default_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT)
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
+
+SESSION_EVENT_TYPES = (
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+    "checkout.session.expired",
+)
+
+
+def get_payment_urls(request: Request) -> tuple[str, str]:
+    success_url = request.build_absolute_uri(reverse("payment:payment-success"))
+    cancel_url = request.build_absolute_uri(reverse("payment:payment-cancel"))
+
+    return success_url, cancel_url
+
+
+def get_payment_days(borrowing: Borrowing, payment_type: Payment.TypeChoices) -> int:
+    if payment_type == Payment.TypeChoices.FINE:
+        return borrowing.get_overdue_days()
+
+    return borrowing.get_borrowing_days()
+
+
+def get_line_item(payment: Payment) -> dict:
+    borrowing = payment.borrowing
+    days = get_payment_days(borrowing, payment.type)
+
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": f"{payment.type} fee for book: '{borrowing.book.title}'",
+                "description": f"User '{borrowing.user.email}' "
+                f"book detail '{borrowing.book}' "
+                f"for '{days}' days.",
+            },
+            "unit_amount": int(payment.money_to_pay * 100),
+        },
+        "quantity": 1,
+    }
+
+
+def get_session_params(
+    payments: list[Payment],
+    success_url: str,
+    cancel_url: str,
+) -> dict:
+    return {
+        "line_items": [get_line_item(payment) for payment in payments],
+        "mode": "payment",
+        "success_url": success_url + "?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": cancel_url,
+    }
+
+
+def get_session_idempotency_key(payments: list[Payment], params: dict) -> str:
+    """Stripe idempotency key of a checkout session for these payments.
+
+    The key is derived from the payments, the session they are replacing
+    (empty for new payments) and the session params, so a retried task or
+    request gets the session Stripe already created, while a renewal or a
+    fine for the same payment gets a new one.
+    """
+    payload = json.dumps(
+        {
+            "payments": [
+                (payment.id, payment.type, payment.session_id) for payment in payments
+            ],
+            "params": params,
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+    return f"checkout-session-{hashlib.sha256(payload.encode()).hexdigest()}"
 
 
 def create_stripe_session(
+    payments: list[Payment],
+    success_url: str,
+    cancel_url: str,
+) -> stripe.checkout.Session:
+    params = get_session_params(payments, success_url, cancel_url)
+
+    with track_external("stripe"):
+        return stripe.checkout.Session.create(
+            idempotency_key=get_session_idempotency_key(payments, params),
+            **params,
+        )
+
+
+_async_client = (None, None)
+
+
+def get_async_stripe_client() -> stripe.StripeClient:
+    """Stripe client with an httpx connection pool for the running event loop.
+
+    The pool can't be shared between event loops, so a new client is built
+    whenever the loop changes. Under ASGI every worker keeps one loop and
+    reuses its connections to Stripe.
+    """
+    global _async_client
+
+    loop = asyncio.get_running_loop()
+    client_loop, client = _async_client
+
+    if client_loop is not loop:
+        base_addresses = {}
+        if settings.STRIPE_API_BASE:
+            base_addresses["api"] = settings.STRIPE_API_BASE
+
+        client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY or "",
+            base_addresses=base_addresses,
+            http_client=stripe.HTTPXClient(timeout=settings.STRIPE_TIMEOUT),
+        )
+        _async_client = (loop, client)
+
+    return client
+
+
+async def create_stripe_session_async(
+    payments: list[Payment],
+    success_url: str,
+    cancel_url: str,
+) -> stripe.checkout.Session:
+    params = get_session_params(payments, success_url, cancel_url)
+
+    with track_external("stripe"):
+        return await get_async_stripe_client().checkout.sessions.create_async(
+            params=params,
+            options={"idempotency_key": get_session_idempotency_key(payments, params)},
+        )
+
+
+async def retrieve_stripe_session_async(session_id: str) -> stripe.checkout.Session:
+    with track_external("stripe"):
+        return await get_async_stripe_client().checkout.sessions.retrieve_async(
+            session_id
+        )
+
+
+def request_stripe_sessions(
+    borrowings: list[tuple[Borrowing, Decimal]],
+    request: Request,
+    payment_type: Payment.TypeChoices,
+) -> list[Payment]:
+    """Save one creating payment per borrowing and build a single Stripe
+    session for all of them after commit.
+
+    The payments are written with one upsert, and the Stripe round trip runs
+    in a Celery task, so the borrowing transaction and the HTTP request never
+    wait on Stripe. The session URL shows up on the payments once the task
+    has finished.
+    """
+    if not borrowings:
+        return []
+
+    payments = Payment.objects.bulk_create(
+        [
+            Payment(
+                borrowing=borrowing,
+                session_url="",
+                session_id="",
+                money_to_pay=price,
+                type=payment_type,
+                status=Payment.StatusChoices.CREATING,
+            )
+            for borrowing, price in borrowings
+        ],
+        update_conflicts=True,
+        unique_fields=("borrowing",),
+        update_fields=(
+            "session_url",
+            "session_id",
+            "money_to_pay",
+            "type",
+            "status",
+            "updated_at",
+        ),
+    )
+    PaymentSummary.refresh(borrowing.user_id for borrowing, _ in borrowings)
+    payment_ids = [payment.id for payment in payments]
+    success_url, cancel_url = get_payment_urls(request)
+    transaction.on_commit(
+        lambda: enqueue_checkout_session(payment_ids, success_url, cancel_url)
+    )
+
+    return payments
+
+
+def enqueue_checkout_session(
+    payment_ids: list[int], success_url: str, cancel_url: str
+) -> None:
+    """Start the checkout session task, or expire the payments if the broker
+    is unreachable, so the member can renew them."""
+    from payment.tasks import create_checkout_session
+
+    try:
+        create_checkout_session.delay(payment_ids, success_url, cancel_url)
+    except OperationalError:
+        expire_creating_payments(Payment.objects.filter(id__in=payment_ids))
+
+
+def expire_creating_payments(payments: QuerySet) -> int:
+    """Expire payments still waiting for a checkout session.
+
+    Used when the session could not be created. Nothing else moves a
+    payment out of creating, while an expired payment can be renewed.
+    """
+    with transaction.atomic():
+        payments = payments.filter(status=Payment.StatusChoices.CREATING)
+        user_ids = set(payments.values_list("borrowing__user", flat=True))
+        expired = payments.update(
+            status=Payment.StatusChoices.EXPIRED, updated_at=timezone.now()
+        )
+        PaymentSummary.refresh(user_ids)
+
+    return expired
+
+
+def request_stripe_session(
     borrowing: Borrowing,
     request: Request,
     payment_type: Payment.TypeChoices,
     price: Decimal,
-    days: int,
-) -> stripe.checkout.Session:
-    success_url = request.build_absolute_uri(reverse("payment:payment-success"))
-    cancel_url = request.build_absolute_uri(reverse("payment:payment-cancel"))
+) -> Payment:
+    return request_stripe_sessions([(borrowing, price)], request, payment_type)[0]
 
-    session = stripe.checkout.Session.create(
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": f"{payment_type} fee for book: '{borrowing.book.title}'",
-                        "description": f"User '{borrowing.user.email}' "
-                        f"book detail '{borrowing.book}' "
-                        f"for '{days}' days.",
-                    },
-                    "unit_amount": int(price * 100),
-                },
-                "quantity": 1,
-            }
-        ],
-        mode="payment",
-        success_url=success_url + "?session_id={CHECKOUT_SESSION_ID}",
-        cancel_url=cancel_url,
-    )
-
-    Payment.objects.update_or_create(
-        borrowing=borrowing,
-        defaults={
-            "session_url": session.url,
-            "session_id": session.id,
-            "money_to_pay": price,
-            "type": payment_type,
-            "status": "Pending",
-        },
+
+def construct_webhook_event(payload: bytes, signature: str) -> stripe.Event:
+    return stripe.Webhook.construct_event(
+        payload, signature, settings.STRIPE_WEBHOOK_SECRET
+    )
+
+
+def get_session_status(session: stripe.checkout.Session) -> str | None:
+    if session["status"] == "expired":
+        return Payment.StatusChoices.EXPIRED
+    if session["payment_status"] == "paid":
+        return Payment.StatusChoices.PAID
+
+    return None
+
+
+def apply_session_statuses(session_statuses: dict[str, str]) -> int:
+    """Move pending payments to the statuses reported by Stripe.
+
+    Runs one UPDATE per target status and only touches payments that are
+    still pending, so replayed or out of order events are no-ops.
+    """
+    updated = 0
+
+    with transaction.atomic():
+        user_ids = Payment.objects.filter(
+            session_id__in=session_statuses,
+            status=Payment.StatusChoices.PENDING,
+        ).values_list("borrowing__user", flat=True)
+        user_ids = set(user_ids)
+
+        for new_status in set(session_statuses.values()):
+            session_ids = [
+                session_id
+                for session_id, session_status in session_statuses.items()
+                if session_status == new_status
+            ]
+            updated += Payment.objects.filter(
+                session_id__in=session_ids,
+                status=Payment.StatusChoices.PENDING,
+            ).update(status=new_status, updated_at=timezone.now())
+
+        PaymentSummary.refresh(user_ids)
+
+    return updated
+
+
+def get_session_payments(session_id: str) -> list[Payment]:
+    return list(
+        Payment.objects.select_related("borrowing__book", "borrowing__user")
+        .defer("borrowing__book__search_vector")
+        .filter(
+            session_id=session_id,
+            status=Payment.StatusChoices.PENDING,
+            type=Payment.TypeChoices.PAYMENT,
+        )
+        .order_by("id")
+    )
+
+
+@transaction.atomic
+def pay_session_payments(payments: list[Payment]) -> None:
+    Payment.objects.filter(id__in=[payment.id for payment in payments]).update(
+        status=Payment.StatusChoices.PAID, updated_at=timezone.now()
+    )
+    PaymentSummary.refresh(payment.borrowing.user_id for payment in payments)
+
+    for payment in payments:
+        payment.status = Payment.StatusChoices.PAID
+
+    borrowings = "\n".join(
+        f"book: {payment.borrowing.book} "
+        f"user: {payment.borrowing.user}\n"
+        f"borrow date: {payment.borrowing.borrow_date.date()}\n"
+        f"expected return date: "
+        f"{payment.borrowing.expected_return_date.date()}"
+        for payment in payments
+    )
+    money_to_pay = sum(payment.money_to_pay for payment in payments)
+    message = (
+        f"Successful payment:\n"
+        f"${money_to_pay} USD\n"
+        f"Borrowing details:\n"
+        f"{borrowings}"
+    )
+    enqueue_message(message)
+
+
+def get_expired_session_payments(user) -> list[Payment]:
+    """Expired payments of the user's oldest expired session.
+
+    Payments of a bulk borrowing share one session, so they are renewed
+    together.
+    """
+    payments = (
+        Payment.objects.select_related("borrowing__book", "borrowing__user")
+        .defer("borrowing__book__search_vector")
+        .filter(status=Payment.StatusChoices.EXPIRED, borrowing__user=user)
+    )
+    payment = payments.order_by("id").first()
+
+    if payment is None or not payment.session_id:
+        return [payment] if payment else []
+
+    return list(payments.filter(session_id=payment.session_id).order_by("id"))
+
+
+@transaction.atomic
+def renew_session_payments(
+    payments: list[Payment], session: stripe.checkout.Session
+) -> None:
+    Payment.objects.filter(
+        id__in=[payment.id for payment in payments],
+        status=Payment.StatusChoices.EXPIRED,
+    ).update(
+        session_url=session.url,
+        session_id=session.id,
+        status=Payment.StatusChoices.PENDING,
+        updated_at=timezone.now(),
     )
+    PaymentSummary.refresh(payment.borrowing.user_id for payment in payments)
 
-    return session
+    for payment in payments:
+        payment.session_url = session.url
+        payment.session_id = session.id
+        payment.status = Payment.StatusChoices.PENDING
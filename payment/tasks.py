@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+import stripe
+from celery import shared_task
+from django.utils import timezone
+
+from library_service import settings
+from payment.models import Payment
+from payment.stripe_payment import create_stripe_session, expire_creating_payments
+
+
+@shared_task(bind=True, max_retries=5)
+def create_checkout_session(
+    self, payment_ids: list[int], success_url: str, cancel_url: str
+):
+    payments = list(
+        Payment.objects.select_related("borrowing__book", "borrowing__user")
+        .defer("borrowing__book__search_vector")
+        .filter(id__in=payment_ids, status=Payment.StatusChoices.CREATING)
+        .order_by("id")
+    )
+
+    if not payments:
+        return None
+
+    try:
+        session = create_stripe_session(payments, success_url, cancel_url)
+    except (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError) as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc, countdown=2**self.request.retries * 5)
+
+        expire_creating_payments(Payment.objects.filter(id__in=payment_ids))
+        raise
+    except stripe.StripeError:
+        expire_creating_payments(Payment.objects.filter(id__in=payment_ids))
+        raise
+
+    Payment.objects.filter(
+        id__in=[payment.id for payment in payments],
+        status=Payment.StatusChoices.CREATING,
+    ).update(
+        session_url=session.url,
+        session_id=session.id,
+        status=Payment.StatusChoices.PENDING,
+        updated_at=timezone.now(),
+    )
+
+    return session.id
+
+
+@shared_task
+def expire_stale_payments() -> int:
+    """Expire payments left creating, e.g. by a worker that died mid task."""
+    return expire_creating_payments(
+        Payment.objects.filter(
+            updated_at__lt=timezone.now()
+            - timedelta(seconds=settings.PAYMENT_CREATING_TIMEOUT)
+        )
+    )
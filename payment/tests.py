@@ -1,20 +1,52 @@
+import hmac
+import json
+import time
+from io import StringIO
 from datetime import datetime, timedelta
+from hashlib import sha256
 from urllib.parse import urlencode
 
+import stripe
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
-from unittest.mock import patch
+from django.utils import timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from kombu.exceptions import OperationalError
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
-from payment.models import Payment
+from borrowing.models import Borrowing, Notification
+from borrowing.serializers import validate_no_pending_payment
+from borrowing.tasks import check_stripe_session_status
+from payment.models import Payment, PaymentSummary
+from payment.reconciliation import (
+    CHECKPOINT_KEY,
+    SessionReconciler,
+    TokenBucket,
+)
+from library_service.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from payment.stripe_payment import (
+    apply_session_statuses,
+    enqueue_checkout_session,
+    get_expired_session_payments,
+    get_session_idempotency_key,
+    get_session_params,
+)
+from payment.tasks import create_checkout_session, expire_stale_payments
 from payment.serializers import PaymentSerializer
 from borrowing.tests import sample_user, sample_borrowing, BORROWING_URL
 from book.tests import sample_book
 
 
 PAYMENT_URL = reverse("payment:payment-list")
+WEBHOOK_URL = reverse("payment:payment-webhook")
+EXPORT_URL = reverse("payment:payment-export")
+WEBHOOK_SECRET = "whsec_test"
 
 
 def payload_for_payment(user: get_user_model(), **kwargs) -> dict:
@@ -24,7 +56,7 @@ def payload_for_payment(user: get_user_model(), **kwargs) -> dict:
         "type": Payment.TypeChoices.PAYMENT,
         "borrowing": borrowing,
         "session_url": "test_url",
-        "session_id": "test_id",
+        "session_id": f"test_id_{borrowing.id}",
         "money_to_pay": 1,
     }
     payload.update(kwargs)
@@ -36,12 +68,40 @@ def detail_payment_url(payment_id: int):
     return reverse("payment:payment-detail", kwargs={"pk": payment_id})
 
 
-def sample_payment(user: get_user_model()) -> Payment:
-    defaults = payload_for_payment(user)
+def sample_payment(user: get_user_model(), **kwargs) -> Payment:
+    defaults = payload_for_payment(user, **kwargs)
 
     return Payment.objects.create(**defaults)
 
 
+def sign_stripe_payload(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), sha256
+    ).hexdigest()
+
+    return f"t={timestamp},v1={signature}"
+
+
+def stripe_session_event(event_type: str, session_id: str, **session) -> str:
+    session = {
+        "id": session_id,
+        "object": "checkout.session",
+        "status": "complete",
+        "payment_status": "paid",
+        **session,
+    }
+
+    return json.dumps(
+        {
+            "id": "evt_test",
+            "object": "event",
+            "type": event_type,
+            "data": {"object": session},
+        }
+    )
+
+
 class MockedStripeCheckoutSessionRetrieve:
     def __init__(self, session_id: str):
         self.session_id = session_id
@@ -95,10 +155,32 @@ class AuthenticatedUserPaymentTestView(TestCase):
             "book": book.id,
             "expected_return_date": datetime.today() + timedelta(days=1),
         }
-        res = self.client.post(BORROWING_URL, payload)
+        with patch(
+            "payment.tasks.create_checkout_session.delay"
+        ) as delay, self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BORROWING_URL, payload)
+
+        payment = Payment.objects.get()
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(res.data["payment"], payment.id)
+        self.assertEqual(payment.status, Payment.StatusChoices.CREATING)
+        delay.assert_called_once_with(
+            [payment.id],
+            "http://testserver" + reverse("payment:payment-success"),
+            "http://testserver" + reverse("payment:payment-cancel"),
+        )
+
+    def test_auth_user_cannot_borrow_while_payment_is_creating(self):
+        sample_payment(self.auth_user, status=Payment.StatusChoices.CREATING)
+        payload = {
+            "book": sample_book().id,
+            "expected_return_date": datetime.today() + timedelta(days=1),
+        }
+
+        res = self.client.post(BORROWING_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_auth_other_user_payment_detail(self):
         payment = sample_payment(self.user)
@@ -108,7 +190,10 @@ class AuthenticatedUserPaymentTestView(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
-    @patch("stripe.checkout.Session.retrieve", MockedStripeCheckoutSessionRetrieve)
+    @patch(
+        "stripe.checkout.SessionService.retrieve_async",
+        AsyncMock(side_effect=MockedStripeCheckoutSessionRetrieve),
+    )
     def test_auth_user_success_payment(self):
         payment = sample_payment(self.auth_user)
         query_params = {"session_id": payment.session_id}
@@ -118,9 +203,34 @@ class AuthenticatedUserPaymentTestView(TestCase):
         updated_payment = Payment.objects.get(id=payment.id)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([data["id"] for data in res.data], [payment.id])
         self.assertEqual(updated_payment.status, Payment.StatusChoices.PAID)
+        self.assertIn("Successful payment", Notification.objects.get().text)
+
+    @patch(
+        "stripe.checkout.SessionService.retrieve_async",
+        AsyncMock(side_effect=MockedStripeCheckoutSessionRetrieve),
+    )
+    def test_auth_user_success_payment_of_bulk_session(self):
+        payments = [
+            sample_payment(self.auth_user, session_id="cs_bulk") for _ in range(2)
+        ]
+        query_params = {"session_id": "cs_bulk"}
+        success_url = reverse("payment:payment-success")
+
+        res = self.client.get(success_url + "?" + urlencode(query_params))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), len(payments))
+        self.assertEqual(
+            Payment.objects.filter(status=Payment.StatusChoices.PAID).count(), 2
+        )
+        self.assertIn("$2.00 USD", Notification.objects.get().text)
 
-    @patch("stripe.checkout.Session.retrieve", MockedStripeCheckoutSessionRetrieve)
+    @patch(
+        "stripe.checkout.SessionService.retrieve_async",
+        AsyncMock(side_effect=MockedStripeCheckoutSessionRetrieve),
+    )
     def test_auth_user_success_payment_already_done(self):
         payment = sample_payment(self.auth_user)
         query_params = {"session_id": payment.session_id}
@@ -136,6 +246,68 @@ class AuthenticatedUserPaymentTestView(TestCase):
 
         self.assertEqual(res2.status_code, status.HTTP_404_NOT_FOUND)
 
+    @patch("stripe.checkout.SessionService.create_async")
+    def test_auth_user_renew_expired_session(self, create_async):
+        create_async.return_value = MagicMock(id="cs_renewed", url="https://s/cs")
+        payments = [
+            sample_payment(
+                self.auth_user,
+                session_id="cs_expired",
+                status=Payment.StatusChoices.EXPIRED,
+            )
+            for _ in range(2)
+        ]
+
+        res = self.client.get(reverse("payment:payment-renew-session"))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["renewed payments"], [p.id for p in payments])
+        self.assertEqual(len(create_async.call_args.kwargs["params"]["line_items"]), 2)
+        self.assertEqual(
+            Payment.objects.filter(
+                session_id="cs_renewed", status=Payment.StatusChoices.PENDING
+            ).count(),
+            2,
+        )
+        self.assertEqual(
+            PaymentSummary.objects.get(user=self.auth_user).blocking_payment,
+            payments[0],
+        )
+
+    @patch("stripe.checkout.SessionService.create_async")
+    def test_auth_user_repeated_renew_is_replayed(self, create_async):
+        create_async.return_value = MagicMock(id="cs_renewed", url="https://s/cs")
+        sample_payment(
+            self.auth_user,
+            session_id="cs_expired",
+            status=Payment.StatusChoices.EXPIRED,
+        )
+        cache.clear()
+        headers = {IDEMPOTENCY_HEADER: "renew-1"}
+
+        res = self.client.get(reverse("payment:payment-renew-session"), headers=headers)
+        res2 = self.client.get(
+            reverse("payment:payment-renew-session"), headers=headers
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertEqual(res2.data["new session id"], "cs_renewed")
+        self.assertEqual(res2[REPLAYED_HEADER], "true")
+        create_async.assert_called_once()
+        self.assertTrue(
+            create_async.call_args.kwargs["options"]["idempotency_key"].startswith(
+                "checkout-session-"
+            )
+        )
+
+    def test_auth_user_renew_without_expired_session(self):
+        sample_payment(self.auth_user)
+
+        res = self.client.get(reverse("payment:payment-renew-session"))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_auth_user_cancel_payment(self):
         payment = sample_payment(self.auth_user)
         query_params = {"session_id": payment.session_id}
@@ -169,6 +341,36 @@ class AdminPaymentTestVew(TestCase):
 
         self.assertEqual(res.data, serializer.data)
 
+    def test_admin_payment_export(self):
+        payment = sample_payment(user=self.user)
+        sample_payment(user=self.admin_user)
+
+        res = self.client.get(
+            EXPORT_URL, {"user_id": self.user.id, "export_format": "ndjson"}
+        )
+        rows = [
+            json.loads(line)
+            for line in b"".join(res.streaming_content).decode().splitlines()
+        ]
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "id": payment.id,
+                    "status": payment.status,
+                    "type": payment.type,
+                    "money_to_pay": "1.00",
+                    "borrowing_id": payment.borrowing_id,
+                    "borrowing_user_id": self.user.id,
+                    "borrowing_user_email": self.user.email,
+                    "session_id": payment.session_id,
+                    "updated_at": rows[0]["updated_at"],
+                }
+            ],
+        )
+
     def test_admin_other_user_payment_detail(self):
         payment = sample_payment(user=self.user)
 
@@ -176,3 +378,437 @@ class AdminPaymentTestVew(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@patch("payment.stripe_payment.settings.STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+
+    def post_event(self, payload: str, signature: str = None):
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature or sign_stripe_payload(payload),
+        )
+
+    def test_webhook_completed_marks_payment_paid(self):
+        payment = sample_payment(self.user)
+        payload = stripe_session_event("checkout.session.completed", payment.session_id)
+
+        res = self.post_event(payload)
+        payment.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["updated"], 1)
+        self.assertEqual(payment.status, Payment.StatusChoices.PAID)
+
+    def test_webhook_expired_marks_payment_expired(self):
+        payment = sample_payment(self.user)
+        payload = stripe_session_event(
+            "checkout.session.expired",
+            payment.session_id,
+            status="expired",
+            payment_status="unpaid",
+        )
+
+        res = self.post_event(payload)
+        payment.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(payment.status, Payment.StatusChoices.EXPIRED)
+
+    def test_webhook_replayed_event_is_idempotent(self):
+        payment = sample_payment(self.user)
+        payload = stripe_session_event("checkout.session.completed", payment.session_id)
+        self.post_event(payload)
+
+        expired_payload = stripe_session_event(
+            "checkout.session.expired",
+            payment.session_id,
+            status="expired",
+            payment_status="unpaid",
+        )
+        res = self.post_event(payload)
+        expired_res = self.post_event(expired_payload)
+        payment.refresh_from_db()
+
+        self.assertEqual(res.data["updated"], 0)
+        self.assertEqual(expired_res.data["updated"], 0)
+        self.assertEqual(payment.status, Payment.StatusChoices.PAID)
+
+    def test_webhook_invalid_signature(self):
+        payment = sample_payment(self.user)
+        payload = stripe_session_event("checkout.session.completed", payment.session_id)
+
+        res = self.post_event(payload, sign_stripe_payload(payload, "whsec_wrong"))
+        payment.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(payment.status, Payment.StatusChoices.PENDING)
+
+
+@patch("payment.reconciliation.time.sleep")
+class StripeSessionReconciliationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_check_stripe_session_status_updates_in_bulk(self, sleep):
+        user = sample_user()
+        expired = sample_payment(user, session_id="cs_expired")
+        paid = sample_payment(user, session_id="cs_paid")
+        open_payment = sample_payment(user, session_id="cs_open")
+        sessions = {
+            "cs_expired": {"status": "expired", "payment_status": "unpaid"},
+            "cs_paid": {"status": "complete", "payment_status": "paid"},
+            "cs_open": {"status": "open", "payment_status": "unpaid"},
+        }
+
+        with patch(
+            "stripe.checkout.Session.retrieve", side_effect=sessions.__getitem__
+        ), self.assertNumQueries(11):
+            report = check_stripe_session_status()
+
+        for payment in (expired, paid, open_payment):
+            payment.refresh_from_db()
+
+        self.assertEqual(report["sessions"], 3)
+        self.assertEqual(report["updated"], 2)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(expired.status, Payment.StatusChoices.EXPIRED)
+        self.assertEqual(paid.status, Payment.StatusChoices.PAID)
+        self.assertEqual(open_payment.status, Payment.StatusChoices.PENDING)
+        self.assertEqual(user.payment_summary.open_payments, 2)
+
+    def test_transient_errors_are_retried_per_session(self, sleep):
+        payment = sample_payment(sample_user(), session_id="cs_flaky")
+        retrieve = MagicMock(
+            side_effect=[
+                stripe.APIConnectionError("timeout"),
+                stripe.RateLimitError("slow down"),
+                {"status": "complete", "payment_status": "paid"},
+            ]
+        )
+
+        with patch("stripe.checkout.Session.retrieve", retrieve):
+            report = SessionReconciler().run()
+
+        payment.refresh_from_db()
+        self.assertEqual(report["retries"], 2)
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(payment.status, Payment.StatusChoices.PAID)
+
+    def test_failed_session_does_not_abort_the_run(self, sleep):
+        user = sample_user()
+        missing = sample_payment(user, session_id="cs_missing")
+        paid = sample_payment(user, session_id="cs_paid")
+
+        def retrieve(session_id):
+            if session_id == "cs_missing":
+                raise stripe.InvalidRequestError("No such session", "id")
+            return {"status": "complete", "payment_status": "paid"}
+
+        with patch("stripe.checkout.Session.retrieve", side_effect=retrieve):
+            report = SessionReconciler().run()
+
+        missing.refresh_from_db()
+        paid.refresh_from_db()
+        self.assertEqual(report["errors"], 1)
+        self.assertEqual(report["updated"], 1)
+        self.assertEqual(missing.status, Payment.StatusChoices.PENDING)
+        self.assertEqual(paid.status, Payment.StatusChoices.PAID)
+
+    def test_resumes_from_checkpoint(self, sleep):
+        user = sample_user()
+        done = sample_payment(user, session_id="cs_done")
+        remaining = sample_payment(user, session_id="cs_remaining")
+        cache.set(CHECKPOINT_KEY, done.id)
+        retrieve = MagicMock(return_value={"status": "expired", "payment_status": ""})
+
+        with patch("stripe.checkout.Session.retrieve", retrieve):
+            report = SessionReconciler(batch_size=1).run()
+
+        remaining.refresh_from_db()
+        retrieve.assert_called_once_with("cs_remaining")
+        self.assertEqual(report["resumed_from"], done.id)
+        self.assertEqual(remaining.status, Payment.StatusChoices.EXPIRED)
+        self.assertIsNone(cache.get(CHECKPOINT_KEY))
+
+    def test_token_bucket_limits_rate(self, sleep):
+        bucket = TokenBucket(rate=50, capacity=1)
+
+        started = time.monotonic()
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.035)
+        sleep.assert_called()
+
+
+class PaymentSummaryTests(TestCase):
+    def setUp(self):
+        self.user = sample_user()
+
+    def test_summary_follows_payment_status(self):
+        first = sample_payment(self.user)
+        second = sample_payment(self.user, status=Payment.StatusChoices.CREATING)
+
+        self.assertEqual(self.user.payment_summary.open_payments, 2)
+        self.assertEqual(self.user.payment_summary.blocking_payment, first)
+
+        apply_session_statuses({first.session_id: Payment.StatusChoices.PAID})
+        self.user.payment_summary.refresh_from_db()
+
+        self.assertEqual(self.user.payment_summary.open_payments, 1)
+        self.assertEqual(self.user.payment_summary.blocking_payment, second)
+
+        second.status = Payment.StatusChoices.PAID
+        second.save()
+        self.user.payment_summary.refresh_from_db()
+
+        self.assertEqual(self.user.payment_summary.open_payments, 0)
+        self.assertIsNone(self.user.payment_summary.blocking_payment)
+
+    def test_borrowing_gate_is_one_query(self):
+        payment = sample_payment(self.user)
+
+        with self.assertNumQueries(1), self.assertRaises(ValidationError) as error:
+            validate_no_pending_payment(self.user)
+
+        self.assertIn(f"id: {payment.id}", str(error.exception.detail))
+
+    def test_rebuild_payment_summaries(self):
+        sample_payment(self.user)
+        PaymentSummary.objects.update(open_payments=0, blocking_payment=None)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_payment_summaries", "--verify", stdout=StringIO())
+
+        call_command("rebuild_payment_summaries", stdout=StringIO())
+        call_command("rebuild_payment_summaries", "--verify", stdout=StringIO())
+
+        self.assertEqual(PaymentSummary.objects.get().open_payments, 1)
+
+
+class CreateCheckoutSessionTaskTests(TestCase):
+    def setUp(self):
+        self.payment = sample_payment(
+            sample_user(),
+            status=Payment.StatusChoices.CREATING,
+            session_url="",
+            session_id="",
+        )
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_fills_payment(self, session_create):
+        session_create.return_value = MagicMock(id="cs_new", url="https://stripe/cs")
+
+        session_id = create_checkout_session(
+            [self.payment.id], "https://app/success/", "https://app/cancel/"
+        )
+        self.payment.refresh_from_db()
+
+        self.assertEqual(session_id, "cs_new")
+        self.assertEqual(self.payment.status, Payment.StatusChoices.PENDING)
+        self.assertEqual(self.payment.session_id, "cs_new")
+        self.assertEqual(self.payment.session_url, "https://stripe/cs")
+        self.assertEqual(
+            session_create.call_args.kwargs["success_url"],
+            "https://app/success/?session_id={CHECKOUT_SESSION_ID}",
+        )
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_consolidates_payments(self, session_create):
+        session_create.return_value = MagicMock(id="cs_bulk", url="https://stripe/cs")
+        other_payment = sample_payment(
+            self.payment.borrowing.user,
+            status=Payment.StatusChoices.CREATING,
+            session_url="",
+            session_id="",
+        )
+
+        create_checkout_session(
+            [self.payment.id, other_payment.id], "https://app/s/", "https://app/c/"
+        )
+
+        session_create.assert_called_once()
+        self.assertEqual(len(session_create.call_args.kwargs["line_items"]), 2)
+        self.assertEqual(
+            Payment.objects.filter(
+                session_id="cs_bulk", status=Payment.StatusChoices.PENDING
+            ).count(),
+            2,
+        )
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_retry_reuses_stripe_key(self, session_create):
+        session_create.side_effect = [
+            stripe.APIConnectionError("timeout"),
+            MagicMock(id="cs_new", url="https://stripe/cs"),
+        ]
+
+        create_checkout_session.apply(
+            args=([self.payment.id], "https://app/s/", "https://app/c/")
+        )
+
+        first, retry = session_create.call_args_list
+        self.assertEqual(
+            first.kwargs["idempotency_key"], retry.kwargs["idempotency_key"]
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.session_id, "cs_new")
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_expires_payment_after_last_retry(
+        self, session_create
+    ):
+        session_create.side_effect = stripe.APIConnectionError("timeout")
+
+        result = create_checkout_session.apply(
+            args=([self.payment.id], "https://app/s/", "https://app/c/"),
+            retries=create_checkout_session.max_retries,
+        )
+        self.payment.refresh_from_db()
+
+        self.assertIsInstance(result.result, stripe.APIConnectionError)
+        self.assertEqual(self.payment.status, Payment.StatusChoices.EXPIRED)
+        self.assertEqual(
+            get_expired_session_payments(self.payment.borrowing.user), [self.payment]
+        )
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_expires_payment_on_stripe_error(
+        self, session_create
+    ):
+        session_create.side_effect = stripe.InvalidRequestError("invalid", "amount")
+
+        create_checkout_session.apply(
+            args=([self.payment.id], "https://app/s/", "https://app/c/")
+        )
+        self.payment.refresh_from_db()
+
+        session_create.assert_called_once()
+        self.assertEqual(self.payment.status, Payment.StatusChoices.EXPIRED)
+
+    def test_unreachable_broker_expires_payment(self):
+        with patch(
+            "payment.tasks.create_checkout_session.delay",
+            side_effect=OperationalError("broker down"),
+        ):
+            enqueue_checkout_session(
+                [self.payment.id], "https://app/s/", "https://app/c/"
+            )
+
+        self.payment.refresh_from_db()
+
+        self.assertEqual(self.payment.status, Payment.StatusChoices.EXPIRED)
+
+    def test_expire_stale_payments(self):
+        fresh = sample_payment(
+            self.payment.borrowing.user,
+            status=Payment.StatusChoices.CREATING,
+            session_url="",
+            session_id="",
+        )
+        Payment.objects.filter(id=self.payment.id).update(
+            updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        expired = expire_stale_payments()
+        fresh.refresh_from_db()
+
+        self.assertEqual(expired, 1)
+        self.assertEqual(fresh.status, Payment.StatusChoices.CREATING)
+        self.assertEqual(
+            Payment.objects.get(id=self.payment.id).status,
+            Payment.StatusChoices.EXPIRED,
+        )
+
+    def test_stripe_key_changes_for_renewal_and_fine(self):
+        params = get_session_params([self.payment], "https://app/s/", "https://app/c/")
+        key = get_session_idempotency_key([self.payment], params)
+
+        self.assertEqual(key, get_session_idempotency_key([self.payment], params))
+
+        self.payment.session_id = "cs_expired"
+        self.assertNotEqual(key, get_session_idempotency_key([self.payment], params))
+
+        self.payment.session_id = ""
+        self.payment.type = Payment.TypeChoices.FINE
+        self.assertNotEqual(key, get_session_idempotency_key([self.payment], params))
+
+    @patch("stripe.checkout.Session.create")
+    def test_create_checkout_session_skips_created_payment(self, session_create):
+        Payment.objects.filter(id=self.payment.id).update(
+            status=Payment.StatusChoices.PENDING
+        )
+
+        self.assertIsNone(
+            create_checkout_session(
+                [self.payment.id], "https://app/s/", "https://app/c/"
+            )
+        )
+        session_create.assert_not_called()
+
+
+class PaymentIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = sample_user()
+        book = sample_book()
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                book=book,
+                user=cls.user,
+                expected_return_date=datetime.today() + timedelta(days=14),
+            )
+            for _ in range(500)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                status=(
+                    Payment.StatusChoices.PENDING
+                    if index % 50 == 0
+                    else Payment.StatusChoices.PAID
+                ),
+                type=Payment.TypeChoices.PAYMENT,
+                borrowing=borrowing,
+                session_url="test_url",
+                session_id=f"cs_{index}",
+                money_to_pay=1,
+            )
+            for index, borrowing in enumerate(borrowings)
+        )
+
+    def assert_uses_index(self, queryset, index_name: str) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE payment_payment")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        self.assertIn(index_name, queryset.explain())
+
+    def test_session_id_lookup_uses_session_index(self):
+        self.assert_uses_index(
+            Payment.objects.filter(
+                session_id="cs_10",
+                status=Payment.StatusChoices.PENDING,
+                type=Payment.TypeChoices.PAYMENT,
+            ),
+            "payment_session_id_idx",
+        )
+
+    def test_pending_payments_use_open_status_index(self):
+        self.assert_uses_index(
+            Payment.objects.filter(status=Payment.StatusChoices.PENDING),
+            "payment_open_status_idx",
+        )
+
+    def test_expired_payment_of_user_uses_open_status_index(self):
+        self.assert_uses_index(
+            Payment.objects.filter(
+                status=Payment.StatusChoices.EXPIRED, borrowing__user=self.user
+            ),
+            "payment_open_status_idx",
+        )
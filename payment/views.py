@@ -1,35 +1,97 @@
 import stripe
-from django.db.transaction import atomic
-from django.shortcuts import get_object_or_404
+from adrf.viewsets import GenericViewSet
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
-from rest_framework import viewsets, status
+from rest_framework import mixins, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from book.serializers import BookSerializer
+from borrowing.filters import BORROWING_FILTER_PARAMETERS, filter_borrowings
 from borrowing.serializers import BorrowingSerializer
-from borrowing.telegram_notifications import send_message
+from library_service.exports import (
+    EXPORT_FORMAT_PARAMETER,
+    EXPORT_RESPONSES,
+    export_response,
+)
+from library_service.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
 from payment.models import Payment
 from payment.serializers import (
     PaymentSerializer,
     PaymentDetailSerializer,
     PaymentSuccessSerializer,
 )
-from payment.stripe_payment import create_stripe_session
+from payment.stripe_payment import (
+    SESSION_EVENT_TYPES,
+    apply_session_statuses,
+    construct_webhook_event,
+    create_stripe_session_async,
+    get_expired_session_payments,
+    get_payment_urls,
+    get_session_payments,
+    get_session_status,
+    pay_session_payments,
+    renew_session_payments,
+    retrieve_stripe_session_async,
+)
+
+
+PAYMENT_FIELDS = (
+    "id",
+    "status",
+    "type",
+    "borrowing",
+    "session_url",
+    "session_id",
+    "money_to_pay",
+)
+
+PAYMENT_EXPORT_FIELDS = (
+    "id",
+    "status",
+    "type",
+    "money_to_pay",
+    "borrowing__id",
+    "borrowing__user__id",
+    "borrowing__user__email",
+    "session_id",
+    "updated_at",
+)
 
 
-class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
+# adrf runs the async Stripe actions natively and the sync ones in a thread.
+class PaymentViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
     queryset = Payment.objects.select_related("borrowing")
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
+        queryset = self.queryset
         user = self.request.user
 
-        if not self.request.user.is_staff:
-            return self.queryset.filter(borrowing__user=user)
+        if self.action == "list":
+            queryset = queryset.select_related("borrowing__user").only(
+                *PAYMENT_FIELDS, "borrowing__user__email"
+            )
+        if self.action == "retrieve":
+            queryset = queryset.select_related(
+                "borrowing__book", "borrowing__user"
+            ).only(
+                *PAYMENT_FIELDS,
+                "borrowing__borrow_date",
+                "borrowing__expected_return_date",
+                "borrowing__actual_return_date",
+                *(f"borrowing__book__{field}" for field in BookSerializer.Meta.fields),
+                "borrowing__user__email",
+            )
 
-        return self.queryset
+        if not user.is_staff:
+            return queryset.filter(borrowing__user=user)
+
+        return queryset
 
     def get_serializer_class(self):
         if self.action == "retrieve":
@@ -45,13 +107,40 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @extend_schema(
+        description="Download payments ordered by ID as a CSV or NDJSON file, "
+        "for admin only. Filters apply to the borrowing of the payment. "
+        "The file is streamed while it is read from the database.",
+        parameters=[*BORROWING_FILTER_PARAMETERS, EXPORT_FORMAT_PARAMETER],
+        responses=EXPORT_RESPONSES,
+    )
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="export",
+        permission_classes=(IsAdminUser,),
+    )
+    def export(self, request):
+        queryset = filter_borrowings(
+            self.get_queryset(),
+            request.query_params.get("is_active"),
+            request.query_params.get("user_id"),
+            prefix="borrowing__",
+        )
+
+        return export_response(
+            request, queryset.order_by("id"), PAYMENT_EXPORT_FIELDS, "payments"
+        )
+
     @extend_schema(
         description="Check stripe payment session status. "
-        "If status is ok, then update payment instance "
-        "and send notification message to telegram chat bot.",
+        "If status is ok, then update all payments of the session "
+        "and queue notification message to telegram chat bot. "
+        "Returns the list of paid payments, one per borrowing of the session.",
+        responses=PaymentSuccessSerializer(many=True),
     )
     @action(methods=["GET"], url_path="success", detail=False)
-    def success(self, request, session_id=None):
+    async def success(self, request, session_id=None):
         session_id = request.query_params.get("session_id", None)
         if not session_id:
             return Response(
@@ -59,40 +148,17 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        payment = get_object_or_404(
-            Payment,
-            session_id=request.GET.get("session_id"),
-            status=Payment.StatusChoices.PENDING,
-            type=Payment.TypeChoices.PAYMENT,
-        )
-        session = stripe.checkout.Session.retrieve(session_id)
+        payments = await sync_to_async(get_session_payments)(session_id)
+        if not payments:
+            raise Http404
+        session = await retrieve_stripe_session_async(session_id)
 
         if session.get("payment_status") == "paid":
-            data = {
-                "status": Payment.StatusChoices.PAID,
-                "type": Payment.TypeChoices.PAYMENT,
-            }
-            serializer = self.get_serializer(payment, data=data)
-
-            if serializer.is_valid():
-                serializer.save()
-
-                message = (
-                    f"Successful payment:\n"
-                    f"${payment.money_to_pay} USD\n"
-                    f"Borrowing details:\n"
-                    f"book: {payment.borrowing.book} "
-                    f"user: {payment.borrowing.user}\n"
-                    f"borrow date: {payment.borrowing.borrow_date.date()}\n"
-                    f"expected return date: {
-                    payment.borrowing.expected_return_date.date()
-                    }"
-                )
-                send_message(message)
-
-                return Response(serializer.data, status=status.HTTP_200_OK)
-
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            await sync_to_async(pay_session_payments)(payments)
+
+            serializer = self.get_serializer(payments, many=True)
+
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
         return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -110,33 +176,25 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     @extend_schema(
         description="If the payment session is expired user can renew it. "
         "System update fields in payment instance: session_id, session_url and status.",
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
     )
     @action(
         detail=False,
         methods=["GET"],
         url_path="renew",
     )
-    @atomic
-    def renew_session(self, request, pk=None):
-        user = request.user
-        payment = Payment.objects.filter(
-            status=Payment.StatusChoices.EXPIRED, borrowing__user=user
-        ).first()
-
-        if payment:
-            days = payment.borrowing.get_borrowing_days()
-            if payment.type == Payment.TypeChoices.FINE:
-                days = payment.borrowing.get_overdue_days()
-
-            new_session = create_stripe_session(
-                payment.borrowing, request, payment.type, payment.money_to_pay, days
+    @idempotent
+    async def renew_session(self, request, pk=None):
+        payments = await sync_to_async(get_expired_session_payments)(request.user)
+
+        if payments:
+            success_url, cancel_url = get_payment_urls(request)
+            new_session = await create_stripe_session_async(
+                payments, success_url, cancel_url
             )
+            await sync_to_async(renew_session_payments)(payments, new_session)
 
-            payment.session_url = new_session.url
-            payment.session_id = new_session.id
-            payment.status = Payment.StatusChoices.PENDING
-            payment.save()
-
+            payment = payments[0]
             borrowing_data = BorrowingSerializer(payment.borrowing).data
             return Response(
                 {
@@ -148,9 +206,46 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
                     "new session id": payment.session_id,
                     "new session url": payment.session_url,
                     "borrowing": borrowing_data,
+                    "renewed payments": [renewed.id for renewed in payments],
                 }
             )
         return Response(
             {"detail": "There is no expired payment session."},
             status=status.HTTP_404_NOT_FOUND,
         )
+
+    @extend_schema(
+        description="Stripe webhook for checkout.session.completed and "
+        "checkout.session.expired events. The request must be signed with "
+        "the endpoint secret in the Stripe-Signature header.",
+        request=OpenApiTypes.OBJECT,
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="webhook",
+        authentication_classes=(),
+        permission_classes=(AllowAny,),
+    )
+    def webhook(self, request):
+        try:
+            event = construct_webhook_event(
+                request.body, request.headers.get("Stripe-Signature", "")
+            )
+        except (ValueError, stripe.SignatureVerificationError):
+            return Response(
+                {"detail": "Invalid Stripe webhook payload or signature."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        updated = 0
+
+        if event["type"] in SESSION_EVENT_TYPES:
+            session = event["data"]["object"]
+            session_status = get_session_status(session)
+
+            if session_status:
+                updated = apply_session_statuses({session["id"]: session_status})
+
+        return Response({"updated": updated}, status=status.HTTP_200_OK)
@@ -0,0 +1,15 @@
+from django.contrib import admin
+
+from reports.models import (
+    DailyBookCirculation,
+    DailyCirculation,
+    DailyOverdue,
+    DailyRevenue,
+    ReportWatermark,
+)
+
+admin.site.register(DailyCirculation)
+admin.site.register(DailyBookCirculation)
+admin.site.register(DailyRevenue)
+admin.site.register(DailyOverdue)
+admin.site.register(ReportWatermark)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from reports.rollups import refresh_reports
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the reporting rollups from borrowings and payments changed "
+        "since the last run. With --full rebuild every day, e.g. after rows "
+        "were deleted or imported without updated_at."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true")
+
+    def handle(self, *args, **options):
+        report = refresh_reports(full=options["full"])
+
+        if "skipped" in report:
+            self.stdout.write(self.style.WARNING(f"Skipped: {report['skipped']}."))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Refreshed {report['days']} days of reports "
+                f"in {report['duration']} s."
+            )
+        )
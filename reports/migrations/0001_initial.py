@@ -0,0 +1,142 @@
+# Generated by Django 5.1.1 on 2026-10-18 22:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("book", "0003_book_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyCirculation",
+            fields=[
+                ("day", models.DateField(primary_key=True, serialize=False)),
+                ("borrowed", models.PositiveIntegerField(default=0)),
+                ("returned", models.PositiveIntegerField(default=0)),
+                ("returned_late", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "daily circulation",
+                "ordering": ("day",),
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyRevenue",
+            fields=[
+                ("day", models.DateField(primary_key=True, serialize=False)),
+                ("payments", models.PositiveIntegerField(default=0)),
+                (
+                    "payments_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "payments_paid_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("fines", models.PositiveIntegerField(default=0)),
+                (
+                    "fines_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "fines_paid_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "daily revenue",
+                "ordering": ("day",),
+            },
+        ),
+        migrations.CreateModel(
+            name="ReportWatermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=63, primary_key=True, serialize=False),
+                ),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyOverdue",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[("author", "Author"), ("cover", "Cover")],
+                        max_length=15,
+                    ),
+                ),
+                ("value", models.CharField(max_length=255)),
+                ("returned", models.PositiveIntegerField(default=0)),
+                ("returned_late", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ("day", "dimension", "value"),
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dimension", "day", "value"),
+                        name="dailyoverdue_dimension_day_value_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyBookCirculation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("borrowed", models.PositiveIntegerField(default=0)),
+                ("returned", models.PositiveIntegerField(default=0)),
+                ("returned_late", models.PositiveIntegerField(default=0)),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="book.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "daily book circulation",
+                "ordering": ("day", "book"),
+                "indexes": [
+                    models.Index(
+                        fields=["book", "day"], name="dailybookcirculation_book_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("day", "book"),
+                        name="dailybookcirculation_day_book_unique",
+                    )
+                ],
+            },
+        ),
+    ]
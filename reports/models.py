@@ -0,0 +1,102 @@
+from django.db import models
+
+from book.models import Book
+
+
+class DailyCirculation(models.Model):
+    """Borrowings and returns of all books on a day."""
+
+    day = models.DateField(primary_key=True)
+    borrowed = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+    returned_late = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("day",)
+        verbose_name_plural = "daily circulation"
+
+    def __str__(self):
+        return f"Circulation on {self.day}"
+
+
+class DailyBookCirculation(models.Model):
+    """Borrowings and returns of a book on a day."""
+
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+")
+    borrowed = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+    returned_late = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("day", "book")
+        verbose_name_plural = "daily book circulation"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("day", "book"), name="dailybookcirculation_day_book_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=("book", "day"), name="dailybookcirculation_book_idx"),
+        ]
+
+    def __str__(self):
+        return f"Circulation of book {self.book_id} on {self.day}"
+
+
+class DailyRevenue(models.Model):
+    """Payments and fines charged on a day: a payment on the borrow date,
+    a fine on the return date."""
+
+    day = models.DateField(primary_key=True)
+    payments = models.PositiveIntegerField(default=0)
+    payments_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payments_paid_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0
+    )
+    fines = models.PositiveIntegerField(default=0)
+    fines_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fines_paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ("day",)
+        verbose_name_plural = "daily revenue"
+
+    def __str__(self):
+        return f"Revenue on {self.day}"
+
+
+class DailyOverdue(models.Model):
+    """Returns and late returns on a day per author or per cover."""
+
+    class DimensionChoices(models.TextChoices):
+        AUTHOR = "author"
+        COVER = "cover"
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=15, choices=DimensionChoices.choices)
+    value = models.CharField(max_length=255)
+    returned = models.PositiveIntegerField(default=0)
+    returned_late = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("day", "dimension", "value")
+        constraints = [
+            models.UniqueConstraint(
+                fields=("dimension", "day", "value"),
+                name="dailyoverdue_dimension_day_value_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Overdue by {self.dimension} {self.value} on {self.day}"
+
+
+class ReportWatermark(models.Model):
+    """Last time the rollups were refreshed from the OLTP tables."""
+
+    name = models.CharField(max_length=63, primary_key=True)
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} refreshed at {self.refreshed_at}"
@@ -0,0 +1,254 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from borrowing.models import Borrowing
+from payment.models import Payment
+from reports.models import (
+    DailyBookCirculation,
+    DailyCirculation,
+    DailyOverdue,
+    DailyRevenue,
+    ReportWatermark,
+)
+
+
+WATERMARK_NAME = "rollups"
+LOCK_KEY = "reports:refresh:lock"
+LOCK_TIMEOUT = 60 * 60
+# Rows changed up to this long before the watermark are read again, so a
+# transaction that was still open during the last refresh is not missed.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+DAYS_PER_BATCH = 31
+
+# The rollups are built by PostgreSQL with INSERT ... SELECT, so no row of
+# the borrowing and payment tables is loaded into Python. Every query reads
+# the [start, end) range of the batch through the date indexes, then keeps
+# the rows of the requested local days only.
+BOOK_CIRCULATION_SQL = """
+INSERT INTO reports_dailybookcirculation (
+    day, book_id, borrowed, returned, returned_late
+)
+SELECT day, book_id, sum(borrowed), sum(returned), sum(returned_late)
+FROM (
+    SELECT
+        (borrow_date AT TIME ZONE %(tz)s)::date AS day,
+        book_id,
+        1 AS borrowed,
+        0 AS returned,
+        0 AS returned_late
+    FROM borrowing_borrowing
+    WHERE borrow_date >= %(start)s AND borrow_date < %(end)s
+    UNION ALL
+    SELECT
+        (actual_return_date AT TIME ZONE %(tz)s)::date,
+        book_id,
+        0,
+        1,
+        (
+            (actual_return_date AT TIME ZONE %(tz)s)::date
+            > (expected_return_date AT TIME ZONE %(tz)s)::date
+        )::int
+    FROM borrowing_borrowing
+    WHERE actual_return_date >= %(start)s AND actual_return_date < %(end)s
+) AS events
+WHERE day = ANY(%(days)s)
+GROUP BY day, book_id;
+"""
+
+CIRCULATION_SQL = """
+INSERT INTO reports_dailycirculation (day, borrowed, returned, returned_late)
+SELECT day, sum(borrowed), sum(returned), sum(returned_late)
+FROM reports_dailybookcirculation
+WHERE day = ANY(%(days)s)
+GROUP BY day;
+"""
+
+# A payment is charged on the borrow date and a fine on the return date.
+REVENUE_SQL = """
+INSERT INTO reports_dailyrevenue (
+    day, payments, payments_amount, payments_paid_amount,
+    fines, fines_amount, fines_paid_amount
+)
+SELECT
+    day,
+    count(*) FILTER (WHERE type = %(payment)s),
+    coalesce(sum(money_to_pay) FILTER (WHERE type = %(payment)s), 0),
+    coalesce(
+        sum(money_to_pay) FILTER (WHERE type = %(payment)s AND status = %(paid)s),
+        0
+    ),
+    count(*) FILTER (WHERE type = %(fine)s),
+    coalesce(sum(money_to_pay) FILTER (WHERE type = %(fine)s), 0),
+    coalesce(
+        sum(money_to_pay) FILTER (WHERE type = %(fine)s AND status = %(paid)s),
+        0
+    )
+FROM (
+    SELECT
+        p.type,
+        p.status,
+        p.money_to_pay,
+        (b.borrow_date AT TIME ZONE %(tz)s)::date AS day
+    FROM payment_payment AS p
+    JOIN borrowing_borrowing AS b ON b.id = p.borrowing_id
+    WHERE p.type = %(payment)s
+        AND b.borrow_date >= %(start)s AND b.borrow_date < %(end)s
+    UNION ALL
+    SELECT
+        p.type,
+        p.status,
+        p.money_to_pay,
+        (b.actual_return_date AT TIME ZONE %(tz)s)::date
+    FROM payment_payment AS p
+    JOIN borrowing_borrowing AS b ON b.id = p.borrowing_id
+    WHERE p.type = %(fine)s
+        AND b.actual_return_date >= %(start)s AND b.actual_return_date < %(end)s
+) AS charges
+WHERE day = ANY(%(days)s)
+GROUP BY day;
+"""
+
+OVERDUE_SQL = """
+INSERT INTO reports_dailyoverdue (day, dimension, value, returned, returned_late)
+SELECT r.day, d.dimension, d.value, count(*), sum(r.late)
+FROM (
+    SELECT
+        (actual_return_date AT TIME ZONE %(tz)s)::date AS day,
+        book_id,
+        (
+            (actual_return_date AT TIME ZONE %(tz)s)::date
+            > (expected_return_date AT TIME ZONE %(tz)s)::date
+        )::int AS late
+    FROM borrowing_borrowing
+    WHERE actual_return_date >= %(start)s AND actual_return_date < %(end)s
+) AS r
+JOIN book_book AS bk ON bk.id = r.book_id
+CROSS JOIN LATERAL (
+    VALUES ('author', bk.author), ('cover', bk.cover)
+) AS d (dimension, value)
+WHERE r.day = ANY(%(days)s)
+GROUP BY r.day, d.dimension, d.value;
+"""
+
+ROLLUPS = (DailyBookCirculation, DailyCirculation, DailyRevenue, DailyOverdue)
+
+
+def day_start(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def day_batches(days: list[date]) -> list[list[date]]:
+    """Group sorted days into batches spanning at most DAYS_PER_BATCH days,
+    so scattered days do not make a batch scan the dates between them."""
+    batches = []
+
+    for day in days:
+        if batches and (day - batches[-1][0]).days < DAYS_PER_BATCH:
+            batches[-1].append(day)
+        else:
+            batches.append([day])
+
+    return batches
+
+
+def get_changed_days(since: datetime) -> set[date]:
+    """Borrow and return days of borrowings and payments changed since."""
+    days = set()
+    borrowings = Borrowing.objects.filter(updated_at__gt=since)
+    payments = Payment.objects.filter(updated_at__gt=since)
+
+    for queryset, prefix in ((borrowings, ""), (payments, "borrowing__")):
+        for field in ("borrow_date", "actual_return_date"):
+            days.update(
+                queryset.annotate(day=TruncDate(f"{prefix}{field}"))
+                .exclude(day=None)
+                .values_list("day", flat=True)
+                .distinct()
+                .order_by()
+            )
+
+    return days
+
+
+def get_all_days() -> set[date]:
+    days = set()
+
+    for field in ("borrow_date", "actual_return_date"):
+        days.update(
+            Borrowing.objects.annotate(day=TruncDate(field))
+            .exclude(day=None)
+            .values_list("day", flat=True)
+            .distinct()
+            .order_by()
+        )
+
+    return days
+
+
+@transaction.atomic
+def rebuild_days(days: list[date]) -> None:
+    """Recompute every rollup row of the given days from the source tables."""
+    params = {
+        "days": days,
+        "start": day_start(min(days)),
+        "end": day_start(max(days) + timedelta(days=1)),
+        "tz": timezone.get_current_timezone_name(),
+        "payment": Payment.TypeChoices.PAYMENT,
+        "fine": Payment.TypeChoices.FINE,
+        "paid": Payment.StatusChoices.PAID,
+    }
+
+    for model in ROLLUPS:
+        model.objects.filter(day__in=days).delete()
+
+    with connection.cursor() as cursor:
+        for sql in (BOOK_CIRCULATION_SQL, CIRCULATION_SQL, REVENUE_SQL, OVERDUE_SQL):
+            cursor.execute(sql, params)
+
+
+def refresh_reports(full: bool = False) -> dict:
+    """Refresh the rollups of the days touched since the last watermark.
+
+    Every borrow or return day of a borrowing or payment changed since the
+    watermark is recomputed as a whole, so refreshing a day twice is
+    harmless. The first run, or full=True, rebuilds all days and drops rows
+    of days with no borrowings left.
+    """
+    if not cache.add(LOCK_KEY, True, timeout=LOCK_TIMEOUT):
+        return {"skipped": "another refresh is running"}
+
+    started = time.perf_counter()
+    refreshed_at = timezone.now()
+
+    try:
+        watermark = ReportWatermark.objects.filter(name=WATERMARK_NAME).first()
+        full = full or watermark is None
+
+        if full:
+            days = sorted(get_all_days())
+        else:
+            days = sorted(get_changed_days(watermark.refreshed_at - WATERMARK_OVERLAP))
+
+        for batch in day_batches(days):
+            rebuild_days(batch)
+
+        if full:
+            for model in ROLLUPS:
+                model.objects.exclude(day__in=days).delete()
+
+        ReportWatermark.objects.update_or_create(
+            name=WATERMARK_NAME, defaults={"refreshed_at": refreshed_at}
+        )
+    finally:
+        cache.delete(LOCK_KEY)
+
+    return {
+        "full": full,
+        "days": len(days),
+        "duration": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+
+from library_service import settings
+from reports.models import DailyOverdue, DailyRevenue
+
+
+class ReportParamsSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    book = serializers.IntegerField(required=False, min_value=1)
+    group_by = serializers.ChoiceField(
+        choices=DailyOverdue.DimensionChoices.choices,
+        default=DailyOverdue.DimensionChoices.COVER,
+    )
+    limit = serializers.IntegerField(default=50, min_value=1, max_value=500)
+
+    def validate(self, attrs):
+        date_to = attrs.get("date_to") or timezone.localdate()
+        date_from = attrs.get("date_from") or date_to - timedelta(days=29)
+
+        if date_from > date_to:
+            raise serializers.ValidationError(
+                {"date_from": "date_from must not be later than date_to."}
+            )
+
+        if (date_to - date_from).days >= settings.REPORTS_MAX_DAYS:
+            raise serializers.ValidationError(
+                {
+                    "date_from": f"Reports cover at most {settings.REPORTS_MAX_DAYS} days."
+                }
+            )
+
+        attrs["date_from"], attrs["date_to"] = date_from, date_to
+
+        return attrs
+
+
+class DailyRevenueSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyRevenue
+        fields = (
+            "day",
+            "payments",
+            "payments_amount",
+            "payments_paid_amount",
+            "fines",
+            "fines_amount",
+            "fines_paid_amount",
+        )
+
+
+class DailyCirculationSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    borrowed = serializers.IntegerField()
+    returned = serializers.IntegerField()
+    returned_late = serializers.IntegerField()
+
+
+class OverdueRateSerializer(serializers.Serializer):
+    value = serializers.CharField()
+    returned = serializers.IntegerField()
+    returned_late = serializers.IntegerField()
+    overdue_rate = serializers.FloatField()
+
+
+class RevenueReportSerializer(serializers.Serializer):
+    refreshed_at = serializers.DateTimeField(allow_null=True)
+    results = DailyRevenueSerializer(many=True)
+
+
+class CirculationReportSerializer(serializers.Serializer):
+    refreshed_at = serializers.DateTimeField(allow_null=True)
+    results = DailyCirculationSerializer(many=True)
+
+
+class OverdueReportSerializer(serializers.Serializer):
+    refreshed_at = serializers.DateTimeField(allow_null=True)
+    results = OverdueRateSerializer(many=True)
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from reports.rollups import refresh_reports
+
+
+@shared_task
+def refresh_report_rollups() -> dict:
+    return refresh_reports()
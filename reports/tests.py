@@ -0,0 +1,248 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from book.tests import sample_book
+from borrowing.models import Borrowing
+from borrowing.tests import sample_user
+from payment.models import Payment
+from reports.models import (
+    DailyBookCirculation,
+    DailyCirculation,
+    DailyOverdue,
+    DailyRevenue,
+    ReportWatermark,
+)
+from reports.rollups import WATERMARK_NAME, refresh_reports
+
+
+REVENUE_URL = reverse("reports:report-revenue")
+CIRCULATION_URL = reverse("reports:report-circulation")
+OVERDUE_URL = reverse("reports:report-overdue")
+
+
+def sample_loan(user, book, borrowed_days_ago: int, returned_days_ago=None, days=7):
+    now = timezone.now()
+    borrowing = Borrowing.objects.create(book=book, user=user, expected_return_date=now)
+    borrow_date = now - timedelta(days=borrowed_days_ago)
+    Borrowing.objects.filter(id=borrowing.id).update(
+        borrow_date=borrow_date,
+        expected_return_date=borrow_date + timedelta(days=days),
+        actual_return_date=(
+            None
+            if returned_days_ago is None
+            else now - timedelta(days=returned_days_ago)
+        ),
+    )
+    borrowing.refresh_from_db()
+
+    return borrowing
+
+
+def sample_payment(borrowing, money_to_pay, **kwargs) -> Payment:
+    defaults = {
+        "status": Payment.StatusChoices.PAID,
+        "type": Payment.TypeChoices.PAYMENT,
+        "session_url": "test_url",
+        "session_id": f"cs_report_{borrowing.id}",
+        "money_to_pay": money_to_pay,
+    }
+    defaults.update(kwargs)
+
+    return Payment.objects.create(borrowing=borrowing, **defaults)
+
+
+class RefreshReportsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = sample_user()
+        self.hard_book = sample_book(cover="Hard", author="Hard author")
+        self.soft_book = sample_book(cover="Soft", author="Soft author")
+        # Borrowed 20 days ago for 7 days, returned 2 days late.
+        self.late = sample_loan(self.user, self.hard_book, 20, 11)
+        self.on_time = sample_loan(self.user, self.soft_book, 20, 15)
+        self.active = sample_loan(self.user, self.hard_book, 3)
+        sample_payment(self.late, 7, type=Payment.TypeChoices.FINE)
+        sample_payment(self.on_time, 5)
+        sample_payment(self.active, 3, status=Payment.StatusChoices.PENDING)
+
+    @staticmethod
+    def local_day(value: datetime):
+        return timezone.localdate(value)
+
+    @staticmethod
+    def age_rows() -> None:
+        """Move every row and the watermark before the next changes."""
+        day_ago = timezone.now() - timedelta(days=1)
+        Borrowing.objects.update(updated_at=day_ago)
+        Payment.objects.update(updated_at=day_ago)
+        ReportWatermark.objects.filter(name=WATERMARK_NAME).update(
+            refreshed_at=timezone.now() - timedelta(hours=1)
+        )
+
+    def test_full_refresh(self):
+        report = refresh_reports()
+
+        self.assertTrue(report["full"])
+        self.assertEqual(report["days"], 4)
+        borrow_day = DailyBookCirculation.objects.get(
+            day=self.local_day(self.late.borrow_date), book=self.hard_book
+        )
+        self.assertEqual(borrow_day.borrowed, 1)
+        self.assertEqual(
+            DailyCirculation.objects.get(
+                day=self.local_day(self.late.actual_return_date)
+            ).returned_late,
+            1,
+        )
+
+        revenue = DailyRevenue.objects.get(day=self.local_day(self.on_time.borrow_date))
+        self.assertEqual((revenue.payments, revenue.payments_paid_amount), (1, 5))
+        fines = DailyRevenue.objects.get(
+            day=self.local_day(self.late.actual_return_date)
+        )
+        self.assertEqual((fines.fines, fines.fines_paid_amount), (1, 7))
+        self.assertEqual(
+            DailyRevenue.objects.get(
+                day=self.local_day(self.active.borrow_date)
+            ).payments_paid_amount,
+            0,
+        )
+
+        self.assertEqual(
+            list(
+                DailyOverdue.objects.filter(dimension="cover")
+                .order_by("value")
+                .values_list("value", "returned", "returned_late")
+            ),
+            [("Hard", 1, 1), ("Soft", 1, 0)],
+        )
+
+    def test_incremental_refresh_reads_changed_rows(self):
+        refresh_reports()
+        self.age_rows()
+        Payment.objects.filter(borrowing=self.active).update(
+            status=Payment.StatusChoices.PAID, updated_at=timezone.now()
+        )
+
+        report = refresh_reports()
+
+        self.assertFalse(report["full"])
+        self.assertEqual(report["days"], 1)
+        self.assertEqual(
+            DailyRevenue.objects.get(
+                day=self.local_day(self.active.borrow_date)
+            ).payments_paid_amount,
+            3,
+        )
+
+    def test_refresh_skips_rows_before_watermark(self):
+        refresh_reports()
+        self.age_rows()
+        Payment.objects.filter(borrowing=self.active).update(
+            status=Payment.StatusChoices.PAID,
+            updated_at=timezone.now() - timedelta(days=1),
+        )
+
+        report = refresh_reports()
+
+        self.assertEqual(report["days"], 0)
+        self.assertEqual(
+            DailyRevenue.objects.get(
+                day=self.local_day(self.active.borrow_date)
+            ).payments_paid_amount,
+            0,
+        )
+
+    def test_bulk_return_updates_updated_at(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        updated_at = self.active.updated_at
+
+        client.post(
+            reverse("borrowing:borrowing-bulk-return"),
+            {"borrowings": [self.active.id]},
+            format="json",
+        )
+        self.active.refresh_from_db()
+
+        self.assertGreater(self.active.updated_at, updated_at)
+
+
+class ReportApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", password="TestUser"
+        )
+        self.client.force_authenticate(self.admin)
+        user = sample_user()
+        book = sample_book(author="Late author")
+        self.borrowing = sample_loan(user, book, 10, 1)
+        sample_payment(self.borrowing, Decimal("4.50"), type=Payment.TypeChoices.FINE)
+        refresh_reports()
+
+    def test_reports_for_admin_only(self):
+        self.client.force_authenticate(
+            get_user_model().objects.create_user(
+                email="member@test.com", password="TestUser"
+            )
+        )
+
+        res = self.client.get(REVENUE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revenue(self):
+        res = self.client.get(REVENUE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(res.data["refreshed_at"])
+        self.assertEqual(len(res.data["results"]), 1)
+        self.assertEqual(res.data["results"][0]["fines_amount"], "4.50")
+
+    def test_circulation(self):
+        res = self.client.get(CIRCULATION_URL, {"book": self.borrowing.book_id})
+        res2 = self.client.get(CIRCULATION_URL, {"book": self.borrowing.book_id + 1})
+        res3 = self.client.get(CIRCULATION_URL)
+
+        self.assertEqual(
+            [(row["borrowed"], row["returned"]) for row in res.data["results"]],
+            [(1, 0), (0, 1)],
+        )
+        self.assertEqual(res2.data["results"], [])
+        self.assertEqual(res3.data["results"], res.data["results"])
+
+    def test_overdue_by_author(self):
+        res = self.client.get(OVERDUE_URL, {"group_by": "author"})
+
+        self.assertEqual(
+            res.data["results"],
+            [
+                {
+                    "value": "Late author",
+                    "returned": 1,
+                    "returned_late": 1,
+                    "overdue_rate": 1.0,
+                }
+            ],
+        )
+
+    def test_invalid_period(self):
+        res = self.client.get(
+            REVENUE_URL, {"date_from": "2024-02-01", "date_to": "2024-01-01"}
+        )
+        res2 = self.client.get(
+            REVENUE_URL, {"date_from": "2020-01-01", "date_to": "2024-01-01"}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res2.status_code, status.HTTP_400_BAD_REQUEST)
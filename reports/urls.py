@@ -0,0 +1,12 @@
+from rest_framework import routers
+
+from reports.views import (
+    ReportViewSet,
+)
+
+app_name = "reports"
+
+router = routers.DefaultRouter()
+router.register("", ReportViewSet, basename="report")
+
+urlpatterns = router.urls
@@ -0,0 +1,146 @@
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import Cast
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from reports.models import (
+    DailyBookCirculation,
+    DailyCirculation,
+    DailyOverdue,
+    DailyRevenue,
+    ReportWatermark,
+)
+from reports.rollups import WATERMARK_NAME
+from reports.serializers import (
+    CirculationReportSerializer,
+    DailyCirculationSerializer,
+    DailyRevenueSerializer,
+    OverdueRateSerializer,
+    OverdueReportSerializer,
+    ReportParamsSerializer,
+    RevenueReportSerializer,
+)
+
+
+DATE_PARAMETERS = [
+    OpenApiParameter(
+        name="date_from",
+        type=OpenApiTypes.DATE,
+        description="First day of the report (ex. ?date_from=2024-05-01). "
+        "Defaults to 30 days before date_to.",
+        required=False,
+    ),
+    OpenApiParameter(
+        name="date_to",
+        type=OpenApiTypes.DATE,
+        description="Last day of the report (ex. ?date_to=2024-05-31). "
+        "Defaults to today.",
+        required=False,
+    ),
+]
+
+
+class ReportViewSet(viewsets.GenericViewSet):
+    """Reports read from the daily rollups refreshed by the
+    refresh_report_rollups task, never from the borrowing and payment tables.
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get_params(self) -> dict:
+        serializer = ReportParamsSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        return serializer.validated_data
+
+    @staticmethod
+    def get_response(results) -> Response:
+        watermark = ReportWatermark.objects.filter(name=WATERMARK_NAME).first()
+
+        return Response(
+            {
+                "refreshed_at": watermark.refreshed_at if watermark else None,
+                "results": results,
+            }
+        )
+
+    @extend_schema(
+        description="Payments and fines per day, for admin only. "
+        "A payment is counted on the borrow date and a fine on the return date.",
+        parameters=DATE_PARAMETERS,
+        responses=RevenueReportSerializer,
+    )
+    @action(detail=False, methods=["GET"], url_path="revenue")
+    def revenue(self, request):
+        params = self.get_params()
+        rows = DailyRevenue.objects.filter(
+            day__range=(params["date_from"], params["date_to"])
+        )
+
+        return self.get_response(DailyRevenueSerializer(rows, many=True).data)
+
+    @extend_schema(
+        description="Borrowings, returns and late returns per day, "
+        "for all books or one book. For admin only.",
+        parameters=[
+            *DATE_PARAMETERS,
+            OpenApiParameter(
+                name="book",
+                type=OpenApiTypes.INT,
+                description="Filter by book ID (ex. ?book=10).",
+                required=False,
+            ),
+        ],
+        responses=CirculationReportSerializer,
+    )
+    @action(detail=False, methods=["GET"], url_path="circulation")
+    def circulation(self, request):
+        params = self.get_params()
+        model = DailyBookCirculation if "book" in params else DailyCirculation
+        rows = model.objects.filter(day__range=(params["date_from"], params["date_to"]))
+
+        if "book" in params:
+            rows = rows.filter(book=params["book"])
+
+        return self.get_response(DailyCirculationSerializer(rows, many=True).data)
+
+    @extend_schema(
+        description="Share of late returns per author or cover over the "
+        "period, highest first. For admin only.",
+        parameters=[
+            *DATE_PARAMETERS,
+            OpenApiParameter(
+                name="group_by",
+                type=OpenApiTypes.STR,
+                enum=DailyOverdue.DimensionChoices.values,
+                description="Group by author or cover (ex. ?group_by=author).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="limit",
+                type=OpenApiTypes.INT,
+                description="Number of groups to return, 50 by default.",
+                required=False,
+            ),
+        ],
+        responses=OverdueReportSerializer,
+    )
+    @action(detail=False, methods=["GET"], url_path="overdue")
+    def overdue(self, request):
+        params = self.get_params()
+        rows = (
+            DailyOverdue.objects.filter(
+                dimension=params["group_by"],
+                day__range=(params["date_from"], params["date_to"]),
+            )
+            .values("value")
+            .annotate(returned=Sum("returned"), returned_late=Sum("returned_late"))
+            .annotate(overdue_rate=Cast("returned_late", FloatField()) / F("returned"))
+            .order_by("-overdue_rate", "-returned", "value")[: params["limit"]]
+        )
+
+        return self.get_response(OverdueRateSerializer(rows, many=True).data)